@@ -10,149 +10,147 @@ Technology Stack:
 - RESTful API
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, redirect, stream_with_context
 from flask_cors import CORS
-from functools import wraps
+from functools import lru_cache, wraps
 import math
 import uuid
 import os
+import secrets
+import threading
 import time
+import atexit
 import bcrypt
-from datetime import datetime
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
-from cassandra.query import SimpleStatement
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import cassandra_config
+import migrate
+from admission import AdmissionController, RouteRule
+from catalog import FundCatalog
+from encoding import NegotiatingJSONProvider
+from export import EXPORT_FORMATS, encode, gzip_chunks
+from health import ErrorRate, HealthProber
+from journal import TransactionJournal
+from onboarding import BulkOnboarding
+from portfolio_cache import PortfolioCache
+from projection import PERIODS_PER_YEAR, Projector
+from querylog import QueryLog
+from recommender import RecommendationEngine
+from roundup_jar import RoundupJar
+from scheduler import FREQUENCIES, Scheduler
+from singleflight import CoalescedTimeout, SingleFlight
+from storage import FUND_FIELDS, open_store
+from stream import LEADERBOARD_TOPIC, EventHub, EventRelay, LeaderboardWatch, StreamServer, user_topic
 
 app = Flask(__name__)
 CORS(app)
 
+# JSON by default, MessagePack for `Accept: application/msgpack` (see encoding.py)
+app.json = NegotiatingJSONProvider(app)
+app.json.compress_min_bytes = int(os.environ.get('MSGPACK_COMPRESS_MIN_BYTES', 1400))
+
 # =============================================================================
 # CASSANDRA DATABASE CONFIGURATION
 # =============================================================================
 
-CASSANDRA_HOST = os.environ.get('CASSANDRA_HOST', 'localhost')
-CASSANDRA_PORT = int(os.environ.get('CASSANDRA_PORT', 9042))
 CASSANDRA_KEYSPACE = os.environ.get('CASSANDRA_KEYSPACE', 'dia_keyspace')
+# Driver tuning profile (see cassandra_config.py for profiles and env overrides)
+CASSANDRA_PROFILE = cassandra_config.load_profile()
+# Apply pending schema migrations on boot; set to false to require `python migrate.py apply`
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'true').lower() == 'true'
 
 cluster = None
 session = None
 
-def connect_to_cassandra(retries=30, delay=5):
-    """Connect to Cassandra with retry logic."""
+# Write-behind journal for the transactions history table (see journal.py)
+journal = TransactionJournal(
+    mode=os.environ.get('JOURNAL_MODE', 'async'),
+    flush_size=int(os.environ.get('JOURNAL_FLUSH_SIZE', 100)),
+    flush_interval=float(os.environ.get('JOURNAL_FLUSH_INTERVAL_MS', 50)) / 1000,
+    max_queue=int(os.environ.get('JOURNAL_MAX_QUEUE', 10000)),
+    enqueue_timeout=float(os.environ.get('JOURNAL_ENQUEUE_TIMEOUT', 1.0)),
+    spool_path=os.environ.get('JOURNAL_SPOOL_PATH', 'transactions.spool'),
+    retry_interval=float(os.environ.get('JOURNAL_RETRY_INTERVAL', 5.0))
+)
+atexit.register(journal.shutdown)
+
+# Slow statements and sampled request traces (see querylog.py)
+query_log = QueryLog(
+    threshold_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+    sample_rate=float(os.environ.get('QUERY_TRACE_SAMPLE_RATE', 0.0)),
+    max_entries=int(os.environ.get('SLOW_QUERY_LOG_SIZE', 500)),
+    max_traces=int(os.environ.get('QUERY_TRACE_BUFFER', 100))
+)
+query_log.init_app(app)
+
+# Users, tokens, portfolios and transactions (see storage.py): cassandra, sqlite or memory
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'cassandra')
+store = open_store(STORAGE_BACKEND, journal=journal)
+# Scheduled deposits and the spare change jar have Cassandra-only tables
+CASSANDRA_FEATURES = STORAGE_BACKEND == 'cassandra'
+
+# Per-user portfolio read cache, written through by the money endpoints (see portfolio_cache.py)
+portfolio_cache = PortfolioCache(
+    max_entries=int(os.environ.get('PORTFOLIO_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('PORTFOLIO_CACHE_TTL', 30))
+)
+# Concurrent identical reads share one query (see singleflight.py)
+read_coalescer = SingleFlight(
+    timeout=float(os.environ.get('COALESCE_TIMEOUT', 5.0)),
+    timeouts={"holdings": float(os.environ.get('COALESCE_HOLDINGS_TIMEOUT', 2.0))}
+)
+
+if os.environ.get('PORTFOLIO_CACHE_LISTEN'):
+    # Multi-worker deployments: e.g. LISTEN=127.0.0.1:7071, PEERS=127.0.0.1:7071,127.0.0.1:7072
+    portfolio_cache.enable_broadcast(
+        os.environ['PORTFOLIO_CACHE_LISTEN'],
+        os.environ.get('PORTFOLIO_CACHE_PEERS', '').split(',')
+    )
+
+def connect_to_cassandra(retries=None):
+    """Connect to Cassandra with exponential backoff between attempts."""
     global cluster, session
 
+    profile = CASSANDRA_PROFILE
+    retries = retries or profile['connect_retries']
+    delays = cassandra_config.reconnect_delays(profile)
+
     for attempt in range(retries):
         try:
-            print(f"Attempting to connect to Cassandra at {CASSANDRA_HOST}:{CASSANDRA_PORT} (attempt {attempt + 1}/{retries})")
-            cluster = Cluster([CASSANDRA_HOST], port=CASSANDRA_PORT)
+            print(f"Attempting to connect to Cassandra ({cassandra_config.describe(profile)}) "
+                  f"(attempt {attempt + 1}/{retries})")
+            cluster = cassandra_config.build_cluster(profile)
             session = cluster.connect()
+            cassandra_config.apply_pool_settings(cluster, profile)
             print("Connected to Cassandra successfully!")
             return True
         except Exception as e:
             print(f"Connection failed: {e}")
+            if cluster is not None:
+                cluster.shutdown()
             if attempt < retries - 1:
-                print(f"Retrying in {delay} seconds...")
+                delay = next(delays, profile['reconnect_max_delay'])
+                print(f"Retrying in {delay:.1f} seconds...")
                 time.sleep(delay)
     return False
 
 def init_database():
-    """Initialize Cassandra keyspace and tables."""
-    global session
-
-    # Create keyspace
-    session.execute("""
-        CREATE KEYSPACE IF NOT EXISTS %s
-        WITH replication = {'class': 'SimpleStrategy', 'replication_factor': 1}
-    """ % CASSANDRA_KEYSPACE)
-
-    session.set_keyspace(CASSANDRA_KEYSPACE)
-
-    # Create users table
-    session.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id text PRIMARY KEY,
-            username text,
-            password_hash text,
-            risk_profile text,
-            created_at timestamp
-        )
-    """)
-
-    # Create index on username for lookups
-    try:
-        session.execute("CREATE INDEX IF NOT EXISTS idx_username ON users (username)")
-    except Exception:
-        pass
-
-    # Create portfolios table
-    session.execute("""
-        CREATE TABLE IF NOT EXISTS portfolios (
-            user_id text PRIMARY KEY,
-            total_value double,
-            fund_id text,
-            fund_name text,
-            invested_amount double,
-            last_24hr_change double
-        )
-    """)
-
-    # Create tokens table (auth_token instead of token - reserved word)
-    session.execute("""
-        CREATE TABLE IF NOT EXISTS auth_tokens (
-            auth_token text PRIMARY KEY,
-            user_id text,
-            created_at timestamp
-        )
-    """)
-
-    # Create transactions table for history
-    session.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id text,
-            user_id text,
-            type text,
-            amount double,
-            fund_id text,
-            created_at timestamp,
-            PRIMARY KEY (user_id, created_at, transaction_id)
-        ) WITH CLUSTERING ORDER BY (created_at DESC, transaction_id ASC)
-    """)
-
-    print("Database tables initialized successfully!")
+    """
+    Bring the schema up to date (see migrate.py and migrations/). When the
+    schema is current this is a single version read and no DDL.
+    """
+    migrate.startup(session, CASSANDRA_KEYSPACE, CASSANDRA_PROFILE,
+                    apply_pending=MIGRATE_ON_STARTUP)
 
 # =============================================================================
 # STATIC DATA
 # =============================================================================
 
-FUNDS_DB = {
-    "fund_001": {
-        "id": "fund_001",
-        "name": "Energy Transition Fund",
-        "description": "A conservative fund focused on stable renewable energy infrastructure investments in the Caspian region.",
-        "risk_level": "Conservative",
-        "annual_return_mock": 6.5,
-        "min_investment": 10.0,
-        "sector": "Green Energy"
-    },
-    "fund_002": {
-        "id": "fund_002",
-        "name": "Balanced Fund",
-        "description": "A diversified portfolio combining green energy assets with emerging ICT opportunities.",
-        "risk_level": "Moderate",
-        "annual_return_mock": 9.2,
-        "min_investment": 10.0,
-        "sector": "Mixed (Green + ICT)"
-    },
-    "fund_003": {
-        "id": "fund_003",
-        "name": "ICT Innovation Fund",
-        "description": "An aggressive growth fund targeting cutting-edge technology startups and digital infrastructure.",
-        "risk_level": "Aggressive",
-        "annual_return_mock": 14.8,
-        "min_investment": 10.0,
-        "sector": "ICT & Technology"
-    }
-}
+# Fund catalog from the funds table, polled for version changes (see catalog.py)
+FUNDS_POLL_INTERVAL = float(os.environ.get('FUNDS_POLL_INTERVAL', 30))
 
 RISK_FUND_MAPPING = {
     "Conservative": "fund_001",
@@ -160,6 +158,95 @@ RISK_FUND_MAPPING = {
     "Aggressive": "fund_003"
 }
 
+# Mean-variance blends per risk profile, recomputed only when the catalog changes (see recommender.py)
+recommender = RecommendationEngine()
+
+fund_catalog = FundCatalog(
+    store,
+    poll_interval=FUNDS_POLL_INTERVAL,
+    on_change=lambda snapshot: recommender.update(snapshot.funds.values())
+)
+recommender.update(fund_catalog.funds.values())
+
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+
+# Rates are requests per second (see admission.py)
+LOGIN_CONCURRENCY = int(os.environ.get('ADMISSION_LOGIN_CONCURRENCY', os.cpu_count() or 2))
+ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', 64))
+
+admission = AdmissionController(
+    rules={
+        # bcrypt is CPU-bound: cap concurrent hashes and per-username/IP attempts
+        'login': RouteRule(user_rate=0.2, user_burst=5, ip_rate=2, ip_burst=20,
+                           concurrency=LOGIN_CONCURRENCY),
+        'register': RouteRule(ip_rate=0.5, ip_burst=10, concurrency=LOGIN_CONCURRENCY),
+        'process_roundup': RouteRule(user_rate=5, user_burst=20, ip_rate=50, ip_burst=100),
+        'process_deposit': RouteRule(user_rate=1, user_burst=5, ip_rate=20, ip_burst=50),
+        'process_withdraw': RouteRule(user_rate=1, user_burst=5, ip_rate=20, ip_burst=50),
+    },
+    default_rule=RouteRule(user_rate=20, user_burst=50, ip_rate=100, ip_burst=200),
+    max_inflight=ADMISSION_MAX_INFLIGHT,
+    queue_budget=float(os.environ.get('ADMISSION_QUEUE_BUDGET_MS', 500)) / 1000,
+    trust_forwarded=os.environ.get('ADMISSION_TRUST_FORWARDED', 'false').lower() == 'true',
+    exempt=('health_check', 'livez', 'readyz', 'get_metrics', 'index', 'stream_redirect'),
+    resolve_token=lambda token: lookup_token(token)
+)
+
+if os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true':
+    admission.init_app(app)
+
+# =============================================================================
+# SPARE CHANGE JAR
+# =============================================================================
+
+# Round-ups accumulate until the jar reaches the threshold (AZN) or the window
+# has passed, then get invested in one go (see roundup_jar.py)
+ROUNDUP_JAR_ENABLED = CASSANDRA_FEATURES and os.environ.get('ROUNDUP_JAR_ENABLED', 'true').lower() == 'true'
+
+roundup_jar = RoundupJar(
+    invest=lambda user_id, amount, fund_id, sweep_id: apply_roundup(user_id, amount, fund_id, sweep_id=sweep_id),
+    threshold=float(os.environ.get('ROUNDUP_JAR_THRESHOLD', 5.0)),
+    window=int(os.environ.get('ROUNDUP_JAR_WINDOW_SECONDS', 86400))
+)
+
+# =============================================================================
+# EVENT STREAM
+# =============================================================================
+
+# Server-Sent Events on a dedicated asyncio worker (see stream.py)
+STREAM_ENABLED = os.environ.get('STREAM_ENABLED', 'true').lower() == 'true'
+STREAM_PORT = int(os.environ.get('STREAM_PORT', 5002))
+# Public base URL of the stream worker when it is not reachable on the API host
+STREAM_PUBLIC_URL = os.environ.get('STREAM_PUBLIC_URL')
+# Multi-worker deployments relay portfolio deltas between workers, e.g.
+# LISTEN=127.0.0.1:7081, PEERS=127.0.0.1:7081,127.0.0.1:7082
+STREAM_RELAY_LISTEN = os.environ.get('STREAM_RELAY_LISTEN')
+
+stream_hub = EventHub(
+    history=int(os.environ.get('STREAM_HISTORY', 5000)),
+    heartbeat=float(os.environ.get('STREAM_HEARTBEAT_SECONDS', 15))
+)
+stream_server = StreamServer(
+    stream_hub,
+    authenticate=lambda token: lookup_token(token),
+    port=STREAM_PORT,
+    max_connections=int(os.environ.get('STREAM_MAX_CONNECTIONS', 20000)),
+    # Every worker sees every event through the relay, so they can share the port
+    reuse_port=bool(STREAM_RELAY_LISTEN)
+)
+leaderboard_watch = LeaderboardWatch(
+    load=lambda limit: top_portfolios(limit),
+    on_change=lambda top: stream_hub.publish(LEADERBOARD_TOPIC, 'leaderboard', build_leaderboard(top)),
+    resync_interval=float(os.environ.get('STREAM_LEADERBOARD_RESYNC_SECONDS', 60))
+)
+stream_relay = EventRelay(
+    STREAM_RELAY_LISTEN,
+    os.environ.get('STREAM_RELAY_PEERS', '').split(','),
+    on_event=lambda event, data: deliver_portfolio_change(data)
+) if STREAM_ENABLED and STREAM_RELAY_LISTEN else None
+
 # =============================================================================
 # HELPER FUNCTIONS
 # =============================================================================
@@ -179,6 +266,131 @@ def hash_password(password):
 def verify_password(password, password_hash):
     return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
+def record_transaction(user_id, type, amount, fund_id, transaction_id=None, units=None):
+    """Add a transaction history row (behind the request with the Cassandra journal)."""
+    store.add_transaction(transaction_id or generate_transaction_id(), user_id, type, amount, fund_id,
+                          datetime.now(), units=units)
+
+def fetch_holdings(user_id):
+    """
+    A user's portfolio state straight from storage:
+    {"exists", "funds": {fund_id: {"units", "cost_basis"}}, "total_value", "last_24hr_change"}
+    """
+    return store.get_holdings(user_id)
+
+def fetch_cacheable_holdings(user_id):
+    """fetch_holdings plus the cache generation taken before the read."""
+    generation = portfolio_cache.generation()
+    return generation, fetch_holdings(user_id)
+
+def load_holdings(user_id):
+    """Portfolio state for reads: served from the portfolio cache when possible."""
+    state = portfolio_cache.get(user_id)
+    if state is None:
+        # Many devices opening the same portfolio at once share the miss. The
+        # generation comes from the shared read, not from when each caller joined.
+        generation, state = read_coalescer.do(("holdings", user_id), fetch_cacheable_holdings, user_id)
+        if state["exists"]:
+            portfolio_cache.put(user_id, state, generation)
+    return state
+
+def value_holdings(state):
+    """
+    Value holdings at the current NAV in a single pass.
+    Returns (holdings, total_value, total_invested).
+    """
+    funds = fund_catalog.funds
+    holdings = []
+    total_value = 0.0
+    total_invested = 0.0
+    for fund_id, holding in state["funds"].items():
+        fund = funds.get(fund_id)
+        nav = fund['nav'] if fund else 0.0
+        value = holding["units"] * nav
+        holdings.append({
+            "fund_id": fund_id,
+            "fund_name": fund['name'] if fund else None,
+            "sector": fund['sector'] if fund else None,
+            "units": holding["units"],
+            "nav": nav,
+            "value": value,
+            "cost_basis": holding["cost_basis"]
+        })
+        total_value += value
+        total_invested += holding["cost_basis"]
+    return holdings, total_value, total_invested
+
+def invest_in_fund(user_id, amount, fund_id, type, mock_daily_change, operation_id=None):
+    """
+    Buy `amount` AZN of a fund. Returns (old_value, new_value, total_invested).
+    A jar sweep or scheduled run passes its id as operation_id: it is recorded with the
+    position write (see Store.update_holding) and used as the transaction id.
+    """
+    fund = fund_catalog.funds[fund_id]
+
+    # Read-modify-write always starts from the database, never the cache
+    state = fetch_holdings(user_id)
+    _, old_value, invested = value_holdings(state)
+    holding = state["funds"].get(fund_id, {"units": 0.0, "cost_basis": 0.0})
+
+    bought = amount / fund['nav']
+    units = holding["units"] + bought
+    cost_basis = holding["cost_basis"] + amount
+    new_value = old_value + amount
+
+    store.update_holding(user_id, fund_id, units, cost_basis, new_value, mock_daily_change, datetime.now(),
+                         operation_id=operation_id)
+
+    state["exists"] = True
+    state["funds"][fund_id] = {"units": units, "cost_basis": cost_basis}
+    state["total_value"] = new_value
+    state["last_24hr_change"] = mock_daily_change
+    portfolio_cache.update(user_id, state)
+    publish_portfolio_change(user_id, type, old_value, new_value, state, [fund_id])
+
+    record_transaction(user_id, type, amount, fund_id, transaction_id=operation_id, units=bought)
+    return old_value, new_value, invested + amount
+
+def apply_roundup(user_id, amount, fund_id, sweep_id=None):
+    """Invest round-up change. Returns (old_value, new_value, total_invested)."""
+    fund = fund_catalog.funds[fund_id]
+    mock_daily_change = round((fund['annual_return_mock'] / 365) * (1 + (amount / 100)), 2)
+    return invest_in_fund(user_id, amount, fund_id, 'roundup', mock_daily_change, operation_id=sweep_id)
+
+def apply_deposit(user_id, amount, fund_id, type='deposit', run_id=None):
+    """
+    Add a deposit to the user's portfolio. Returns (old_value, new_value).
+    A scheduled run passes its run_id, recorded as an applied operation like a jar sweep's id.
+    """
+    fund = fund_catalog.funds[fund_id]
+    mock_daily_change = round((fund['annual_return_mock'] / 365) * 1.5, 2)
+    return invest_in_fund(user_id, amount, fund_id, type, mock_daily_change, operation_id=run_id)[:2]
+
+def publish_portfolio_change(user_id, type, old_value, new_value, state, fund_ids):
+    """Push a committed portfolio change to the user's stream and the leaderboard watch."""
+    if not STREAM_ENABLED:
+        return
+    delta = {
+        "user_id": user_id,
+        "type": type,
+        "previous_value": round(old_value, 2),
+        "new_total_value": round(new_value, 2),
+        "holdings": [
+            {"fund_id": fund_id, **state["funds"].get(fund_id, {"units": 0.0, "cost_basis": 0.0})}
+            for fund_id in fund_ids
+        ],
+        "updated_at": datetime.now().isoformat()
+    }
+    deliver_portfolio_change(delta, exact_value=new_value)
+    if stream_relay is not None:
+        stream_relay.send('portfolio', delta)
+
+def deliver_portfolio_change(delta, exact_value=None):
+    """Publish a portfolio delta to this worker's stream clients and leaderboard watch."""
+    stream_hub.publish(user_topic(delta["user_id"]), 'portfolio', delta)
+    leaderboard_watch.observe(delta["user_id"],
+                              delta["new_total_value"] if exact_value is None else exact_value)
+
 def calculate_roundup(amount):
     ceiling = math.ceil(amount)
     roundup = round(ceiling - amount, 2)
@@ -186,6 +398,16 @@ def calculate_roundup(amount):
         roundup = 1.0
     return roundup
 
+def lookup_token(token):
+    """user_id for an auth token, or None."""
+    return store.get_token_user(token)
+
+@lru_cache(maxsize=10000)
+def lookup_username(user_id):
+    # Usernames never change, so leaderboard rebuilds can skip the lookup
+    user = store.get_user(user_id)
+    return user['username'] if user else None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -198,20 +420,16 @@ def token_required(f):
                 "code": "AUTH_TOKEN_MISSING"
             }), 401
 
-        # Look up token in database
-        result = session.execute(
-            "SELECT user_id FROM auth_tokens WHERE auth_token = %s",
-            [token]
-        ).one()
-
-        if not result:
+        # Admission control may already have resolved the token for its rate limit
+        current_user_id = g.get('authenticated_user_id') or lookup_token(token)
+        if not current_user_id:
             return jsonify({
                 "success": False,
                 "error": "Invalid or expired token",
                 "code": "AUTH_TOKEN_INVALID"
             }), 401
 
-        kwargs['current_user_id'] = result.user_id
+        kwargs['current_user_id'] = current_user_id
         return f(*args, **kwargs)
 
     return decorated
@@ -245,35 +463,20 @@ def register():
             "code": "INVALID_RISK_PROFILE"
         }), 400
 
-    # Check if username exists
-    existing = session.execute(
-        "SELECT user_id FROM users WHERE username = %s ALLOW FILTERING",
-        [username]
-    ).one()
+    # Create user with an empty portfolio
+    user_id = generate_user_id()
+    password_hash = hash_password(password)
 
-    if existing:
+    if not store.create_user(user_id, username, password_hash, risk_profile, datetime.now()):
         return jsonify({
             "success": False,
             "error": "Username already exists",
             "code": "USERNAME_EXISTS"
         }), 409
 
-    # Create user
-    user_id = generate_user_id()
-    password_hash = hash_password(password)
-
-    session.execute(
-        """INSERT INTO users (user_id, username, password_hash, risk_profile, created_at)
-           VALUES (%s, %s, %s, %s, %s)""",
-        [user_id, username, password_hash, risk_profile, datetime.now()]
-    )
-
-    # Initialize portfolio
-    session.execute(
-        """INSERT INTO portfolios (user_id, total_value, fund_id, fund_name, invested_amount, last_24hr_change)
-           VALUES (%s, %s, %s, %s, %s, %s)""",
-        [user_id, 0.0, None, None, 0.0, 0.0]
-    )
+    # Signed in straight away, like a login
+    token = generate_token()
+    store.create_token(token, user_id, datetime.now())
 
     return jsonify({
         "success": True,
@@ -281,7 +484,9 @@ def register():
         "data": {
             "user_id": user_id,
             "username": username,
-            "risk_profile": risk_profile
+            "risk_profile": risk_profile,
+            "token": token,
+            "token_type": "Bearer"
         }
     }), 201
 
@@ -301,10 +506,7 @@ def login():
     password = data['password']
 
     # Find user
-    user = session.execute(
-        "SELECT user_id, password_hash FROM users WHERE username = %s ALLOW FILTERING",
-        [username]
-    ).one()
+    user = store.get_user_by_username(username)
 
     if not user:
         return jsonify({
@@ -313,7 +515,7 @@ def login():
             "code": "USER_NOT_FOUND"
         }), 404
 
-    if not verify_password(password, user.password_hash):
+    if not verify_password(password, user['password_hash']):
         return jsonify({
             "success": False,
             "error": "Invalid password",
@@ -322,76 +524,88 @@ def login():
 
     # Generate and store token
     token = generate_token()
-    session.execute(
-        "INSERT INTO auth_tokens (auth_token, user_id, created_at) VALUES (%s, %s, %s)",
-        [token, user.user_id, datetime.now()]
-    )
+    store.create_token(token, user['user_id'], datetime.now())
 
     return jsonify({
         "success": True,
         "message": "Login successful",
         "data": {
-            "user_id": user.user_id,
+            "user_id": user['user_id'],
             "token": token,
             "token_type": "Bearer"
         }
     }), 200
 
 
+def build_portfolio(user_id):
+    """Portfolio response data for a user, or None if the user does not exist."""
+    # Whole portfolio in one read (or from the cache)
+    state = load_holdings(user_id)
+
+    if not state["exists"]:
+        # Only users without a portfolio pay for the user lookup
+        if not store.get_user(user_id):
+            return None
+
+    holdings, total_value, invested = value_holdings(state)
+    last_24hr_change = state["last_24hr_change"]
+
+    breakdown = []
+    for holding in holdings:
+        breakdown.append({
+            "fund_id": holding['fund_id'],
+            "fund_name": holding['fund_name'],
+            "sector": holding['sector'],
+            "units": round(holding['units'], 6),
+            "nav": holding['nav'],
+            "value": round(holding['value'], 2),
+            "cost_basis": round(holding['cost_basis'], 2),
+            "gain": round(holding['value'] - holding['cost_basis'], 2),
+            "allocation_percent": round(holding['value'] / total_value * 100, 2) if total_value else 0.0
+        })
+
+    # Largest holding, for clients that show a single fund
+    fund_details = None
+    if holdings:
+        fund = fund_catalog.funds.get(max(holdings, key=lambda h: h['value'])['fund_id'])
+        if fund:
+            fund_details = {
+                "name": fund['name'],
+                "sector": fund['sector'],
+                "annual_return_mock": fund['annual_return_mock']
+            }
+
+    portfolio_data = {
+        "total_value": round(total_value, 2),
+        "invested_amount": round(invested, 2),
+        "last_24hr_change_percent": last_24hr_change,
+        "invested_fund": fund_details,
+        "holdings": breakdown,
+        "total_funds": len(breakdown)
+    }
+
+    return {
+        "user_id": user_id,
+        "portfolio": portfolio_data,
+        "currency": "AZN"
+    }
+
+
 @app.route('/api/user/<user_id>/portfolio', methods=['GET'])
 @token_required
 def get_portfolio(user_id, current_user_id):
-    # Get user
-    user = session.execute(
-        "SELECT user_id FROM users WHERE user_id = %s",
-        [user_id]
-    ).one()
+    portfolio = build_portfolio(user_id)
 
-    if not user:
+    if portfolio is None:
         return jsonify({
             "success": False,
             "error": "User not found",
             "code": "USER_NOT_FOUND"
         }), 404
 
-    # Get portfolio
-    portfolio = session.execute(
-        "SELECT * FROM portfolios WHERE user_id = %s",
-        [user_id]
-    ).one()
-
-    if not portfolio:
-        portfolio_data = {
-            "total_value": 0.0,
-            "invested_amount": 0.0,
-            "last_24hr_change_percent": 0.0,
-            "invested_fund": None
-        }
-    else:
-        fund_details = None
-        if portfolio.fund_id:
-            fund = FUNDS_DB.get(portfolio.fund_id)
-            if fund:
-                fund_details = {
-                    "name": fund['name'],
-                    "sector": fund['sector'],
-                    "annual_return_mock": fund['annual_return_mock']
-                }
-
-        portfolio_data = {
-            "total_value": round(portfolio.total_value or 0, 2),
-            "invested_amount": round(portfolio.invested_amount or 0, 2),
-            "last_24hr_change_percent": portfolio.last_24hr_change or 0,
-            "invested_fund": fund_details
-        }
-
     return jsonify({
         "success": True,
-        "data": {
-            "user_id": user_id,
-            "portfolio": portfolio_data,
-            "currency": "AZN"
-        }
+        "data": portfolio
     }), 200
 
 
@@ -399,39 +613,84 @@ def get_portfolio(user_id, current_user_id):
 # API ENDPOINTS: INVESTMENT
 # =============================================================================
 
+def describe_allocation(allocation):
+    if not allocation:
+        return None
+    funds = fund_catalog.funds
+    return {
+        "funds": [
+            {
+                "fund_id": fund_id,
+                "fund_name": funds[fund_id]['name'] if fund_id in funds else None,
+                "weight": weight
+            }
+            for fund_id, weight in sorted(allocation['weights'].items(), key=lambda item: -item[1])
+        ],
+        "expected_annual_return": allocation['expected_annual_return'],
+        "annual_volatility": allocation['annual_volatility']
+    }
+
+
+def build_recommendation(user_id):
+    """Fund recommendation data for a user, or None if the user does not exist."""
+    user = store.get_user(user_id)
+
+    if not user:
+        return None
+
+    risk_profile = user['risk_profile']
+    allocation = recommender.allocation(risk_profile)
+    if allocation:
+        # Headline fund is the largest position in the blend
+        recommended_fund_id = max(allocation['weights'], key=allocation['weights'].get)
+    else:
+        recommended_fund_id = RISK_FUND_MAPPING.get(risk_profile)
+    recommended_fund = fund_catalog.funds.get(recommended_fund_id)
+
+    return {
+        "user_risk_profile": risk_profile,
+        "allocation": describe_allocation(allocation),
+        "recommendation": {
+            "fund_id": recommended_fund['id'],
+            "fund_name": recommended_fund['name'],
+            "description": recommended_fund['description'],
+            "risk_level": recommended_fund['risk_level'],
+            "annual_return_mock": recommended_fund['annual_return_mock'],
+            "sector": recommended_fund['sector'],
+            "min_investment_azn": recommended_fund['min_investment']
+        },
+        "recommendation_reason": f"Based on your {risk_profile} risk profile, we recommend the {recommended_fund['name']}."
+    }
+
+
 @app.route('/api/funds/recommend', methods=['GET'])
 @token_required
 def recommend_fund(current_user_id):
-    user = session.execute(
-        "SELECT risk_profile FROM users WHERE user_id = %s",
-        [current_user_id]
-    ).one()
+    recommendation = build_recommendation(current_user_id)
 
-    if not user:
+    if recommendation is None:
         return jsonify({
             "success": False,
             "error": "User not found",
             "code": "USER_NOT_FOUND"
         }), 404
 
-    risk_profile = user.risk_profile
-    recommended_fund_id = RISK_FUND_MAPPING.get(risk_profile)
-    recommended_fund = FUNDS_DB.get(recommended_fund_id)
+    return jsonify({
+        "success": True,
+        "data": recommendation
+    }), 200
+
 
+@app.route('/api/funds/allocations', methods=['GET'])
+def list_allocations():
+    allocations = recommender.allocations()
     return jsonify({
         "success": True,
         "data": {
-            "user_risk_profile": risk_profile,
-            "recommendation": {
-                "fund_id": recommended_fund['id'],
-                "fund_name": recommended_fund['name'],
-                "description": recommended_fund['description'],
-                "risk_level": recommended_fund['risk_level'],
-                "annual_return_mock": recommended_fund['annual_return_mock'],
-                "sector": recommended_fund['sector'],
-                "min_investment_azn": recommended_fund['min_investment']
-            },
-            "recommendation_reason": f"Based on your {risk_profile} risk profile, we recommend the {recommended_fund['name']}."
+            "profiles": {profile: describe_allocation(allocation)
+                         for profile, allocation in allocations['profiles'].items()},
+            "frontier": allocations['frontier'],
+            "fund_statistics": allocations['fund_statistics']
         }
     }), 200
 
@@ -460,52 +719,60 @@ def process_roundup(current_user_id):
         }), 400
 
     fund_id = data['fund_id']
-    if fund_id not in FUNDS_DB:
+    funds = fund_catalog.funds
+    if fund_id not in funds:
         return jsonify({
             "success": False,
             "error": "Fund not found",
             "code": "FUND_NOT_FOUND"
         }), 404
 
-    fund = FUNDS_DB[fund_id]
+    fund = funds[fund_id]
     roundup_amount = calculate_roundup(transaction_amount)
     rounded_to = math.ceil(transaction_amount)
 
-    # Get current portfolio
-    portfolio = session.execute(
-        "SELECT * FROM portfolios WHERE user_id = %s",
-        [current_user_id]
-    ).one()
-
-    old_value = portfolio.total_value if portfolio else 0.0
-    new_value = old_value + roundup_amount
-    invested = (portfolio.invested_amount if portfolio else 0.0) + roundup_amount
-    mock_daily_change = round((fund['annual_return_mock'] / 365) * (1 + (roundup_amount / 100)), 2)
-
-    # Update portfolio
-    session.execute(
-        """UPDATE portfolios SET total_value = %s, fund_id = %s, fund_name = %s,
-           invested_amount = %s, last_24hr_change = %s WHERE user_id = %s""",
-        [new_value, fund_id, fund['name'], invested, mock_daily_change, current_user_id]
-    )
+    transaction = {
+        "original_amount": transaction_amount,
+        "rounded_to": rounded_to,
+        "roundup_amount": roundup_amount,
+        "currency": "AZN"
+    }
 
-    # Record transaction
-    session.execute(
-        """INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at)
-           VALUES (%s, %s, %s, %s, %s, %s)""",
-        [generate_transaction_id(), current_user_id, 'roundup', roundup_amount, fund_id, datetime.now()]
-    )
+    if ROUNDUP_JAR_ENABLED:
+        jar, sweep = roundup_jar.add(current_user_id, roundup_amount, fund_id)
+
+        data = {
+            "transaction": transaction,
+            "jar": jar,
+            "investment": None,
+            "portfolio": None
+        }
+        if sweep is not None:
+            data["investment"] = {
+                "fund_id": fund_id,
+                "fund_name": fund['name'],
+                "amount_invested": round(sweep['amount'], 2),
+                "breakdown": sweep['invested']
+            }
+            data["portfolio"] = {
+                "previous_value": round(sweep['previous_value'], 2),
+                "new_total_value": round(sweep['new_total_value'], 2)
+            }
+
+        return jsonify({
+            "success": True,
+            "message": ("Spare change jar invested!" if sweep is not None
+                        else "Round-up added to your spare change jar!"),
+            "data": data
+        }), 200
+
+    old_value, new_value, invested = apply_roundup(current_user_id, roundup_amount, fund_id)
 
     return jsonify({
         "success": True,
         "message": "Round-up investment processed successfully!",
         "data": {
-            "transaction": {
-                "original_amount": transaction_amount,
-                "rounded_to": rounded_to,
-                "roundup_amount": roundup_amount,
-                "currency": "AZN"
-            },
+            "transaction": transaction,
             "investment": {
                 "fund_id": fund_id,
                 "fund_name": fund['name'],
@@ -520,6 +787,29 @@ def process_roundup(current_user_id):
     }), 200
 
 
+@app.route('/api/roundups/pending', methods=['GET'])
+@token_required
+def get_pending_roundups(current_user_id):
+    if CASSANDRA_FEATURES:
+        jar = roundup_jar.pending(current_user_id)
+    else:
+        jar = {"pending_amount": 0.0, "swipes": 0, "funds": [],
+               "threshold": roundup_jar.threshold, "window_seconds": roundup_jar.window}
+    for item in jar['funds']:
+        fund = fund_catalog.funds.get(item['fund_id'])
+        item['fund_name'] = fund['name'] if fund else None
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "user_id": current_user_id,
+            "jar": jar,
+            "enabled": ROUNDUP_JAR_ENABLED,
+            "currency": "AZN"
+        }
+    }), 200
+
+
 @app.route('/api/transactions/deposit', methods=['POST'])
 @token_required
 def process_deposit(current_user_id):
@@ -544,36 +834,16 @@ def process_deposit(current_user_id):
         }), 400
 
     fund_id = data['fund_id']
-    if fund_id not in FUNDS_DB:
+    funds = fund_catalog.funds
+    if fund_id not in funds:
         return jsonify({
             "success": False,
             "error": "Fund not found",
             "code": "FUND_NOT_FOUND"
         }), 404
 
-    fund = FUNDS_DB[fund_id]
-
-    portfolio = session.execute(
-        "SELECT * FROM portfolios WHERE user_id = %s",
-        [current_user_id]
-    ).one()
-
-    old_value = portfolio.total_value if portfolio else 0.0
-    new_value = old_value + amount
-    invested = (portfolio.invested_amount if portfolio else 0.0) + amount
-    mock_daily_change = round((fund['annual_return_mock'] / 365) * 1.5, 2)
-
-    session.execute(
-        """UPDATE portfolios SET total_value = %s, fund_id = %s, fund_name = %s,
-           invested_amount = %s, last_24hr_change = %s WHERE user_id = %s""",
-        [new_value, fund_id, fund['name'], invested, mock_daily_change, current_user_id]
-    )
-
-    session.execute(
-        """INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at)
-           VALUES (%s, %s, %s, %s, %s, %s)""",
-        [generate_transaction_id(), current_user_id, 'deposit', amount, fund_id, datetime.now()]
-    )
+    fund = funds[fund_id]
+    old_value, new_value = apply_deposit(current_user_id, amount, fund_id)
 
     return jsonify({
         "success": True,
@@ -619,32 +889,53 @@ def process_withdraw(current_user_id):
             "code": "INVALID_AMOUNT"
         }), 400
 
-    portfolio = session.execute(
-        "SELECT * FROM portfolios WHERE user_id = %s",
-        [current_user_id]
-    ).one()
+    state = fetch_holdings(current_user_id)
+    holdings, old_value, _ = value_holdings(state)
 
-    if not portfolio or (portfolio.total_value or 0) < amount:
+    # Withdraw from one fund, or pro rata across all holdings
+    fund_id = data.get('fund_id')
+    sources = [h for h in holdings if h['fund_id'] == fund_id] if fund_id else holdings
+    # Holdings worth nothing at current NAV take no share and would divide by zero
+    sources = [h for h in sources if h['value'] > 0]
+    available = sum(h['value'] for h in sources)
+
+    if available < amount:
         return jsonify({
             "success": False,
             "error": "Insufficient balance",
             "code": "INSUFFICIENT_BALANCE"
         }), 400
 
-    old_value = portfolio.total_value
     new_value = old_value - amount
-    invested = max(0, (portfolio.invested_amount or 0) - amount)
 
-    session.execute(
-        """UPDATE portfolios SET total_value = %s, invested_amount = %s WHERE user_id = %s""",
-        [new_value, invested, current_user_id]
-    )
-
-    session.execute(
-        """INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at)
-           VALUES (%s, %s, %s, %s, %s, %s)""",
-        [generate_transaction_id(), current_user_id, 'withdraw', amount, portfolio.fund_id, datetime.now()]
-    )
+    # Every holding and the portfolio total change together
+    positions = []
+    withdrawn = []
+    amount_minor = int(round(amount * 100))
+    left_minor = amount_minor
+    for index, holding in enumerate(sources):
+        # Split in qəpik; the last fund takes the rounding remainder
+        if index == len(sources) - 1:
+            take_minor = left_minor
+        else:
+            take_minor = int(round(amount_minor * holding['value'] / available))
+        left_minor -= take_minor
+        take = take_minor / 100
+        remaining = max(0.0, 1 - take / holding['value'])
+        units = holding['units'] * remaining
+        cost_basis = holding['cost_basis'] * remaining
+        positions.append((holding['fund_id'], units, cost_basis))
+        state["funds"][holding['fund_id']] = {"units": units, "cost_basis": cost_basis}
+        withdrawn.append((holding['fund_id'], take, holding['units'] - units))
+    store.apply_withdrawal(current_user_id, positions, new_value, datetime.now())
+
+    state["total_value"] = new_value
+    portfolio_cache.update(current_user_id, state)
+    publish_portfolio_change(current_user_id, 'withdraw', old_value, new_value, state,
+                             [source_fund_id for source_fund_id, _, _ in withdrawn])
+
+    for source_fund_id, take, sold in withdrawn:
+        record_transaction(current_user_id, 'withdraw', take, source_fund_id, units=sold)
 
     return jsonify({
         "success": True,
@@ -655,6 +946,7 @@ def process_withdraw(current_user_id):
                 "amount": amount,
                 "currency": "AZN"
             },
+            "funds": [{"fund_id": source_fund_id, "amount": take} for source_fund_id, take, _ in withdrawn],
             "portfolio": {
                 "previous_value": round(old_value, 2),
                 "new_total_value": round(new_value, 2)
@@ -663,42 +955,733 @@ def process_withdraw(current_user_id):
     }), 200
 
 
+# =============================================================================
+# API ENDPOINTS: SCHEDULED DEPOSITS
+# =============================================================================
+
+# Recurring auto-invest (see scheduler.py)
+scheduler = Scheduler(
+    execute_deposit=lambda user_id, amount, fund_id, run_id: apply_deposit(user_id, amount, fund_id,
+                                                                           'scheduled_deposit', run_id),
+    shards=int(os.environ.get('SCHEDULER_SHARDS', 16)),
+    concurrency=int(os.environ.get('SCHEDULER_CONCURRENCY', 64)),
+    io_concurrency=int(os.environ.get('SCHEDULER_IO_CONCURRENCY', 256)),
+    lookahead=int(os.environ.get('SCHEDULER_LOOKAHEAD_SECONDS', 120)),
+    catchup=int(os.environ.get('SCHEDULER_CATCHUP_SECONDS', 3600)),
+    max_attempts=int(os.environ.get('SCHEDULER_MAX_ATTEMPTS', 3)),
+    retry_delay=int(os.environ.get('SCHEDULER_RETRY_SECONDS', 300))
+)
+# Zone for schedule times when the request does not name one
+SCHEDULE_TIMEZONE = os.environ.get('SCHEDULE_TIMEZONE', 'Asia/Baku')
+SCHEDULER_ENABLED = CASSANDRA_FEATURES and os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+
+def schedules_unavailable():
+    return jsonify({
+        "success": False,
+        "error": "Scheduled deposits require the cassandra storage backend",
+        "code": "NOT_AVAILABLE"
+    }), 503
+
+
+@app.route('/api/schedules', methods=['POST'])
+@token_required
+def create_schedule(current_user_id):
+    if not CASSANDRA_FEATURES:
+        return schedules_unavailable()
+
+    data = request.get_json()
+
+    if 'amount' not in data or 'fund_id' not in data or 'frequency' not in data:
+        return jsonify({
+            "success": False,
+            "error": "Missing required fields",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    try:
+        amount = float(data['amount'])
+        if amount <= 0:
+            raise ValueError()
+    except:
+        return jsonify({
+            "success": False,
+            "error": "Invalid amount",
+            "code": "INVALID_AMOUNT"
+        }), 400
+
+    fund_id = data['fund_id']
+    funds = fund_catalog.funds
+    if fund_id not in funds:
+        return jsonify({
+            "success": False,
+            "error": "Fund not found",
+            "code": "FUND_NOT_FOUND"
+        }), 404
+
+    frequency = data['frequency']
+    if frequency not in FREQUENCIES:
+        return jsonify({
+            "success": False,
+            "error": f"Invalid frequency. Must be one of: {list(FREQUENCIES)}",
+            "code": "INVALID_FREQUENCY"
+        }), 400
+
+    try:
+        hour = int(data.get('hour', 9))
+        minute = int(data.get('minute', 0))
+        weekday = int(data['weekday']) if data.get('weekday') is not None else None
+        day_of_month = int(data['day_of_month']) if data.get('day_of_month') is not None else None
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError()
+        if weekday is not None and not 0 <= weekday <= 6:
+            raise ValueError()
+        if day_of_month is not None and not 1 <= day_of_month <= 31:
+            raise ValueError()
+    except:
+        return jsonify({
+            "success": False,
+            "error": "Invalid schedule time (hour 0-23, minute 0-59, weekday 0-6 with 0 = Monday, day_of_month 1-31)",
+            "code": "INVALID_SCHEDULE"
+        }), 400
+
+    time_zone = data.get('timezone') or SCHEDULE_TIMEZONE
+    try:
+        ZoneInfo(time_zone)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return jsonify({
+            "success": False,
+            "error": f"Unknown timezone '{time_zone}'. Use an IANA name such as Asia/Baku",
+            "code": "INVALID_SCHEDULE"
+        }), 400
+
+    schedule = scheduler.create(current_user_id, amount, fund_id, frequency,
+                                hour=hour, minute=minute, weekday=weekday,
+                                day_of_month=day_of_month, time_zone=time_zone)
+
+    return jsonify({
+        "success": True,
+        "message": "Recurring investment scheduled!",
+        "data": {
+            "schedule": schedule,
+            "fund_name": funds[fund_id]['name'],
+            "currency": "AZN"
+        }
+    }), 201
+
+
+@app.route('/api/schedules', methods=['GET'])
+@token_required
+def list_schedules(current_user_id):
+    if not CASSANDRA_FEATURES:
+        return schedules_unavailable()
+
+    schedules = scheduler.list_for_user(current_user_id)
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "schedules": schedules,
+            "total_schedules": len(schedules),
+            "currency": "AZN"
+        }
+    }), 200
+
+
+@app.route('/api/schedules/<schedule_id>', methods=['DELETE'])
+@token_required
+def cancel_schedule(schedule_id, current_user_id):
+    if not CASSANDRA_FEATURES:
+        return schedules_unavailable()
+
+    if not scheduler.cancel(current_user_id, schedule_id):
+        return jsonify({
+            "success": False,
+            "error": "Schedule not found",
+            "code": "SCHEDULE_NOT_FOUND"
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "message": "Recurring investment cancelled",
+        "data": {
+            "schedule_id": schedule_id,
+            "active": False
+        }
+    }), 200
+
+
+# =============================================================================
+# API ENDPOINTS: TRANSACTION EXPORT
+# =============================================================================
+
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 500))
+
+
+@app.route('/api/user/<user_id>/transactions/export', methods=['GET'])
+@token_required
+def export_transactions(user_id, current_user_id):
+    if user_id != current_user_id:
+        return jsonify({
+            "success": False,
+            "error": "You can only export your own transactions",
+            "code": "FORBIDDEN"
+        }), 403
+
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        return jsonify({
+            "success": False,
+            "error": f"Invalid format. Must be one of: {list(EXPORT_FORMATS)}",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    # Rows are paged from storage and encoded batch by batch while the response streams
+    chunks = encode(store.iter_transactions(user_id, page_size=EXPORT_PAGE_SIZE),
+                    format, fund_catalog.funds, batch_size=EXPORT_PAGE_SIZE)
+    headers = {
+        "Content-Disposition": f'attachment; filename="transactions-{user_id}.{format}"',
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding"
+    }
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[format], headers=headers)
+
+
+# =============================================================================
+# API ENDPOINTS: PROJECTION
+# =============================================================================
+
+# Monte Carlo growth bands, memoized per fund mix, horizon and contribution bucket (see projection.py)
+projector = Projector(paths=int(os.environ.get('PROJECTION_PATHS', 10000)))
+PROJECTION_LOOKBACK_DAYS = int(os.environ.get('PROJECTION_LOOKBACK_DAYS', 90))
+PROJECTION_MAX_YEARS = 40
+PROJECTION_MAX_MONTHLY_YEARS = 5
+
+
+def recent_roundup_rate(user_id, days=PROJECTION_LOOKBACK_DAYS):
+    """Average monthly round-up amount over the last `days`, from one partition slice."""
+    rows = store.transactions_since(user_id, datetime.now() - timedelta(days=days))
+    total = sum(row['amount'] for row in rows if row['type'] == 'roundup')
+    return total * 30.4 / days
+
+
+@app.route('/api/user/<user_id>/projection', methods=['GET'])
+@token_required
+def get_projection(user_id, current_user_id):
+    if user_id != current_user_id:
+        return jsonify({
+            "success": False,
+            "error": "You can only view your own projection",
+            "code": "FORBIDDEN"
+        }), 403
+
+    interval = request.args.get('interval', 'year')
+    try:
+        years = int(request.args.get('years', 5))
+        contribution = request.args.get('monthly_contribution')
+        contribution = float(contribution) if contribution is not None else None
+        if interval not in PERIODS_PER_YEAR or not 1 <= years <= PROJECTION_MAX_YEARS \
+                or (contribution is not None and contribution < 0):
+            raise ValueError()
+        if interval == 'month' and years > PROJECTION_MAX_MONTHLY_YEARS:
+            raise ValueError()
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": f"years must be 1-{PROJECTION_MAX_YEARS} (1-{PROJECTION_MAX_MONTHLY_YEARS} "
+                     f"with interval=month), interval one of: {', '.join(PERIODS_PER_YEAR)}, "
+                     f"monthly_contribution must be non-negative",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    holdings, total_value, _ = value_holdings(load_holdings(user_id))
+    if holdings:
+        mix = {holding['fund_id']: holding['value'] for holding in holdings}
+    else:
+        # Nothing invested yet: project the blend recommended for the user's risk profile
+        user = store.get_user(user_id)
+        if not user:
+            return jsonify({
+                "success": False,
+                "error": "User not found",
+                "code": "USER_NOT_FOUND"
+            }), 404
+        allocation = recommender.allocation(user['risk_profile'])
+        mix = dict(allocation['weights']) if allocation else {}
+
+    estimated = contribution is None
+    if estimated:
+        contribution = recent_roundup_rate(user_id)
+
+    projection = projector.project(recommender.market(), mix, years, total_value, contribution, interval)
+
+    total_weight = sum(mix.values())
+    return jsonify({
+        "success": True,
+        "data": {
+            "user_id": user_id,
+            "current_value": round(total_value, 2),
+            "horizon_years": years,
+            "monthly_contribution": round(contribution, 2),
+            "contribution_source": (f"round-ups over the last {PROJECTION_LOOKBACK_DAYS} days"
+                                    if estimated else "requested"),
+            "fund_mix": {fund_id: round(weight / total_weight, 4) for fund_id, weight in mix.items()}
+                        if total_weight else {},
+            "paths": projector.paths,
+            **projection,
+            "currency": "AZN"
+        }
+    }), 200
+
+
+# =============================================================================
+# API ENDPOINTS: ACTIVITY
+# =============================================================================
+
+# range -> (bucket size, number of buckets); served from the daily rollups in storage
+ACTIVITY_RANGES = {
+    'week': ('day', 7),
+    'month': ('day', 30),
+    'quarter': ('week', 13),
+    'year': ('month', 12),
+}
+
+
+def activity_buckets(bucket, count, today):
+    """Start dates of the last `count` buckets, oldest first, the last one containing today."""
+    if bucket == 'day':
+        return [today - timedelta(days=i) for i in range(count - 1, -1, -1)]
+    if bucket == 'week':
+        monday = today - timedelta(days=today.weekday())
+        return [monday - timedelta(weeks=i) for i in range(count - 1, -1, -1)]
+    starts = []
+    year, month = today.year, today.month
+    for _ in range(count):
+        starts.append(today.replace(year=year, month=month, day=1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+
+def bucket_start(day, bucket):
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+@app.route('/api/user/<user_id>/activity', methods=['GET'])
+@token_required
+def get_activity(user_id, current_user_id):
+    if user_id != current_user_id:
+        return jsonify({
+            "success": False,
+            "error": "You can only view your own activity",
+            "code": "FORBIDDEN"
+        }), 403
+
+    range_name = request.args.get('range', 'month')
+    if range_name not in ACTIVITY_RANGES:
+        return jsonify({
+            "success": False,
+            "error": f"Invalid range. Must be one of: {list(ACTIVITY_RANGES)}",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    bucket, count = ACTIVITY_RANGES[range_name]
+    starts = activity_buckets(bucket, count, datetime.now().date())
+    series = {start: {"count": 0, "amount_minor": 0, "by_type": {}} for start in starts}
+    by_fund = {}
+    for row in store.daily_activity(user_id, starts[0]):
+        point = series.get(bucket_start(row['day'], bucket))
+        if point is None:
+            continue
+        point["count"] += row['count']
+        point["amount_minor"] += row['amount_minor']
+        by_type = point["by_type"].setdefault(row['type'], {"count": 0, "amount_minor": 0})
+        by_type["count"] += row['count']
+        by_type["amount_minor"] += row['amount_minor']
+        if row['fund_id']:
+            fund = by_fund.setdefault(row['fund_id'], {"count": 0, "amount_minor": 0})
+            fund["count"] += row['count']
+            fund["amount_minor"] += row['amount_minor']
+
+    funds = fund_catalog.funds
+    return jsonify({
+        "success": True,
+        "data": {
+            "user_id": user_id,
+            "range": range_name,
+            "bucket": bucket,
+            "series": [
+                {
+                    "period_start": start.isoformat(),
+                    "count": point["count"],
+                    "amount": point["amount_minor"] / 100,
+                    "by_type": {type: {"count": totals["count"], "amount": totals["amount_minor"] / 100}
+                                for type, totals in point["by_type"].items()}
+                }
+                for start, point in series.items()
+            ],
+            "totals": {
+                "count": sum(point["count"] for point in series.values()),
+                "amount": sum(point["amount_minor"] for point in series.values()) / 100
+            },
+            "by_fund": [
+                {
+                    "fund_id": fund_id,
+                    "fund_name": funds[fund_id]['name'] if fund_id in funds else fund_id,
+                    "count": totals["count"],
+                    "amount": totals["amount_minor"] / 100
+                }
+                for fund_id, totals in sorted(by_fund.items(), key=lambda item: -item[1]["amount_minor"])
+            ],
+            "currency": "AZN"
+        }
+    }), 200
+
+
+# =============================================================================
+# API ENDPOINTS: DASHBOARD
+# =============================================================================
+
+# Sections of GET /api/dashboard and the builder behind each one
+DASHBOARD_SECTIONS = {
+    "portfolio": lambda user_id: build_portfolio(user_id),
+    "funds": lambda user_id: build_funds(),
+    "recommendation": lambda user_id: build_recommendation(user_id),
+    "leaderboard": lambda user_id: build_leaderboard(),
+}
+# Sections that only touch in-process data and are not worth a thread hop
+DASHBOARD_INLINE_SECTIONS = ('funds',)
+DASHBOARD_TIMEOUT = float(os.environ.get('DASHBOARD_TIMEOUT', 5.0))
+
+dashboard_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('DASHBOARD_WORKERS', 16)),
+    thread_name_prefix='dashboard'
+)
+
+
+@app.route('/api/dashboard', methods=['GET'])
+@token_required
+def get_dashboard(current_user_id):
+    fields = request.args.get('fields')
+    if fields:
+        sections = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in sections if field not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({
+                "success": False,
+                "error": f"Unknown fields: {unknown}. Must be among: {list(DASHBOARD_SECTIONS)}",
+                "code": "VALIDATION_ERROR"
+            }), 400
+    else:
+        sections = list(DASHBOARD_SECTIONS)
+
+    # Fan the database reads out concurrently; authentication happened once above.
+    # Each section runs in a copy of the request context so its statements stay tagged.
+    futures = {
+        section: dashboard_executor.submit(contextvars.copy_context().run,
+                                           DASHBOARD_SECTIONS[section], current_user_id)
+        for section in sections if section not in DASHBOARD_INLINE_SECTIONS
+    }
+
+    data = {"user_id": current_user_id}
+    errors = {}
+    for section in sections:
+        if section in DASHBOARD_INLINE_SECTIONS:
+            data[section] = DASHBOARD_SECTIONS[section](current_user_id)
+            continue
+        try:
+            data[section] = futures[section].result(timeout=DASHBOARD_TIMEOUT)
+        except Exception as e:
+            # One slow or failing section should not blank the whole screen. The
+            # cause stays in the server log; driver errors name hosts and queries.
+            print(f"Dashboard section {section} failed for {current_user_id}: {e!r}")
+            data[section] = None
+            errors[section] = "unavailable"
+
+    if 'portfolio' in data and data['portfolio'] is None and 'portfolio' not in errors:
+        return jsonify({
+            "success": False,
+            "error": "User not found",
+            "code": "USER_NOT_FOUND"
+        }), 404
+
+    if errors:
+        data["errors"] = errors
+
+    return jsonify({
+        "success": True,
+        "data": data
+    }), 200
+
+
+# =============================================================================
+# API ENDPOINTS: ADMIN
+# =============================================================================
+
+# Shared secret for operator endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Uploaded partner files, checkpoints and reject reports (see onboarding.py)
+ONBOARDING_DIR = os.environ.get('ONBOARDING_DIR', 'onboarding')
+ONBOARDING_BCRYPT_ROUNDS = int(os.environ.get('ONBOARDING_BCRYPT_ROUNDS', 12))
+ONBOARDING_WORKERS = int(os.environ.get('ONBOARDING_WORKERS', 0)) or None
+ONBOARDING_FORMATS = ('csv', 'ndjson', 'csv.gz', 'ndjson.gz')
+
+onboarding_jobs = {}
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({
+                "success": False,
+                "error": "Admin endpoints are disabled",
+                "code": "NOT_AVAILABLE"
+            }), 503
+        if not secrets.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({
+                "success": False,
+                "error": "Invalid admin token",
+                "code": "FORBIDDEN"
+            }), 403
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+def onboarding_paths(job_id):
+    base = os.path.join(ONBOARDING_DIR, job_id)
+    return base + '.upload', base + '.checkpoint'
+
+
+def start_onboarding(job_id, filename):
+    upload_path, checkpoint_path = onboarding_paths(job_id)
+    # The reader picks CSV or NDJSON (and gzip) from the extension
+    path = f"{upload_path}.{filename}"
+    job = BulkOnboarding(store, checkpoint_path, workers=ONBOARDING_WORKERS,
+                         rounds=ONBOARDING_BCRYPT_ROUNDS,
+                         log=lambda message: print(f"[onboarding {job_id}] {message}"))
+    entry = {"job": job, "path": path, "status": "running", "error": None}
+
+    def run():
+        try:
+            job.run(path)
+            entry["status"] = "finished" if job.state["finished"] else "stopped"
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+
+    onboarding_jobs[job_id] = entry
+    threading.Thread(target=run, name=f'onboarding-{job_id}', daemon=True).start()
+    return entry
+
+
+def describe_onboarding(job_id, entry):
+    state = entry["job"].state or {}
+    return {
+        "job_id": job_id,
+        "status": entry["status"],
+        "error": entry["error"],
+        "records_done": state.get("records_done", 0),
+        "counts": state.get("counts", {}),
+        "started_at": state.get("started_at"),
+        "updated_at": state.get("updated_at")
+    }
+
+
+@app.route('/api/admin/onboarding', methods=['POST'])
+@admin_required
+def create_onboarding():
+    upload = request.files.get('file')
+    filename = (upload.filename or '').lower() if upload else ''
+    extension = next((ext for ext in ONBOARDING_FORMATS if filename.endswith('.' + ext)), None)
+    if not extension:
+        return jsonify({
+            "success": False,
+            "error": "Upload a .csv or .ndjson file (optionally .gz) as 'file'",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    os.makedirs(ONBOARDING_DIR, exist_ok=True)
+    job_id = f"onb_{uuid.uuid4().hex[:12]}"
+    upload_path, _ = onboarding_paths(job_id)
+    # Spooled to disk in chunks; the pipeline streams it back batch by batch
+    upload.save(f"{upload_path}.{extension}")
+    entry = start_onboarding(job_id, extension)
+
+    return jsonify({
+        "success": True,
+        "data": describe_onboarding(job_id, entry)
+    }), 202
+
+
+@app.route('/api/admin/onboarding/<job_id>', methods=['GET'])
+@admin_required
+def get_onboarding(job_id):
+    entry = onboarding_jobs.get(job_id)
+    if not entry:
+        return jsonify({
+            "success": False,
+            "error": "Onboarding job not found",
+            "code": "NOT_FOUND"
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "data": describe_onboarding(job_id, entry)
+    }), 200
+
+
+@app.route('/api/admin/onboarding/<job_id>/resume', methods=['POST'])
+@admin_required
+def resume_onboarding(job_id):
+    entry = onboarding_jobs.get(job_id)
+    if entry and entry["status"] == "running":
+        return jsonify({
+            "success": False,
+            "error": "Onboarding job is still running",
+            "code": "CONFLICT"
+        }), 409
+
+    # After a restart the job is only known by its files on disk
+    upload_path, _ = onboarding_paths(job_id)
+    uploads = [name for name in os.listdir(ONBOARDING_DIR) if name.startswith(os.path.basename(upload_path) + '.')] \
+        if os.path.isdir(ONBOARDING_DIR) else []
+    if not uploads:
+        return jsonify({
+            "success": False,
+            "error": "Onboarding job not found",
+            "code": "NOT_FOUND"
+        }), 404
+
+    extension = uploads[0][len(os.path.basename(upload_path)) + 1:]
+    entry = start_onboarding(job_id, extension)
+
+    return jsonify({
+        "success": True,
+        "data": describe_onboarding(job_id, entry)
+    }), 202
+
+
+FUND_NUMERIC_FIELDS = ('nav', 'annual_return_mock', 'volatility_mock', 'min_investment')
+# volatility_mock for new funds that do not give one
+FUND_DEFAULT_VOLATILITY = 10.0
+
+
+@app.route('/api/admin/funds/<fund_id>', methods=['PUT'])
+@admin_required
+def put_fund(fund_id):
+    data = request.get_json() or {}
+    unknown = [field for field in data if field not in FUND_FIELDS or field == 'id']
+    if unknown:
+        return jsonify({
+            "success": False,
+            "error": f"Unknown fields: {unknown}. Must be among: {list(FUND_FIELDS[1:])}",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    current = fund_catalog.funds.get(fund_id)
+    if current:
+        fund = dict(current)
+    else:
+        fund = {field: None for field in FUND_FIELDS}
+        fund['volatility_mock'] = FUND_DEFAULT_VOLATILITY
+    fund.update(data, id=fund_id)
+    try:
+        for field in FUND_NUMERIC_FIELDS:
+            if fund[field] is not None:
+                fund[field] = float(fund[field])
+        # The recommender and the daily valuation use both, so neither may be missing
+        if not fund['name'] or fund['nav'] is None or fund['nav'] <= 0 \
+                or fund['annual_return_mock'] is None or fund['volatility_mock'] is None \
+                or fund['volatility_mock'] < 0:
+            raise ValueError()
+    except (TypeError, ValueError):
+        return jsonify({
+            "success": False,
+            "error": "A fund needs a name, a positive nav, an annual_return_mock and a non-negative "
+                     "volatility_mock; numeric fields must be numbers",
+            "code": "VALIDATION_ERROR"
+        }), 400
+
+    # Other processes pick the new version up on their next poll
+    snapshot = fund_catalog.publish([fund])
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "fund": dict(snapshot.funds[fund_id]),
+            "catalog_version": snapshot.version
+        }
+    }), 200 if current else 201
+
+
+@app.route('/api/admin/queries', methods=['GET'])
+@admin_required
+def get_query_log():
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        limit = 50
+    endpoint = request.args.get('endpoint')
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "slow": query_log.slow_queries(limit, endpoint),
+            "traces": query_log.traces(limit, endpoint),
+            "stats": query_log.stats()
+        }
+    }), 200
+
+
 # =============================================================================
 # API ENDPOINTS: OTHER
 # =============================================================================
 
+def build_funds():
+    snapshot = fund_catalog.snapshot
+    return {
+        "funds": [dict(fund) for fund in snapshot.funds.values()],
+        "total_funds": len(snapshot.funds),
+        "catalog_version": snapshot.version
+    }
+
+
 @app.route('/api/funds', methods=['GET'])
 def list_funds():
     return jsonify({
         "success": True,
-        "data": {
-            "funds": list(FUNDS_DB.values()),
-            "total_funds": len(FUNDS_DB)
-        }
+        "data": build_funds()
     }), 200
 
 
-@app.route('/api/leaderboard', methods=['GET'])
-def get_leaderboard():
-    # Get top investors from database
-    rows = session.execute(
-        "SELECT user_id, total_value FROM portfolios"
-    ).all()
+def top_portfolios(limit=10):
+    """Top [(user_id, total_value)] from the portfolio totals."""
+    # Every concurrent leaderboard request shares one scan of the totals
+    totals = read_coalescer.do(("portfolio_totals",), store.portfolio_totals)
+    return sorted(totals, key=lambda pair: pair[1], reverse=True)[:limit]
+
 
-    # Sort by total_value
-    sorted_portfolios = sorted(rows, key=lambda x: x.total_value or 0, reverse=True)[:10]
+def build_leaderboard(top=None):
+    if top is None:
+        top = top_portfolios()
 
     leaderboard = []
-    for rank, row in enumerate(sorted_portfolios, 1):
-        user = session.execute(
-            "SELECT username FROM users WHERE user_id = %s",
-            [row.user_id]
-        ).one()
-        if user:
+    for rank, (user_id, total_value) in enumerate(top, 1):
+        username = lookup_username(user_id)
+        if username:
             leaderboard.append({
                 "rank": rank,
-                "username": user.username,
-                "total_invested": round(row.total_value or 0, 2)
+                "username": username,
+                "total_invested": round(total_value, 2)
             })
 
     # Add mock data if less than 5
@@ -716,16 +1699,31 @@ def get_leaderboard():
         else:
             break
 
+    return {
+        "leaderboard": leaderboard,
+        "updated_at": datetime.now().isoformat(),
+        "currency": "AZN"
+    }
+
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
     return jsonify({
         "success": True,
-        "data": {
-            "leaderboard": leaderboard,
-            "updated_at": datetime.now().isoformat(),
-            "currency": "AZN"
-        }
+        "data": build_leaderboard()
     }), 200
 
 
+@app.route('/api/stream', methods=['GET'])
+def stream_redirect():
+    # The stream is served by the SSE worker; EventSource follows the redirect
+    base = STREAM_PUBLIC_URL or f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{STREAM_PORT}"
+    target = f"{base}/api/stream"
+    if request.query_string:
+        target += '?' + request.query_string.decode('utf-8')
+    return redirect(target, code=307)
+
+
 @app.route('/api/b2b-status', methods=['GET'])
 def get_b2b_status():
     return jsonify({
@@ -747,21 +1745,148 @@ def get_b2b_status():
     }), 200
 
 
+# Health is probed in the background; these endpoints only read the cached state (see health.py)
+HEALTH_DB_SLOW_MS = float(os.environ.get('HEALTH_DB_SLOW_MS', 250))
+HEALTH_POOL_MAX_INFLIGHT = int(os.environ.get('HEALTH_POOL_MAX_INFLIGHT', 1024))
+HEALTH_MAX_ERROR_RATE = float(os.environ.get('HEALTH_MAX_ERROR_RATE', 0.05))
+
+error_rate = ErrorRate()
+
+
+@app.after_request
+def count_response(response):
+    error_rate.record(response.status_code)
+    return response
+
+
+def check_database():
+    started = time.perf_counter()
+    store.ping()
+    latency_ms = (time.perf_counter() - started) * 1000
+    return {
+        "status": "degraded" if latency_ms > HEALTH_DB_SLOW_MS else "ok",
+        "latency_ms": round(latency_ms, 2)
+    }
+
+
+def check_connections():
+    """Driver connection pools: open connections and requests in flight per host."""
+    if session is None:
+        return {"status": "ok", "hosts": 0}
+    pools = session.get_pool_state()
+    open_hosts = sum(1 for state in pools.values() if state['open_count'])
+    busiest = max((sum(state['in_flights']) for state in pools.values()), default=0)
+    if not open_hosts:
+        status = "failing"
+    elif busiest >= HEALTH_POOL_MAX_INFLIGHT:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {
+        "status": status,
+        "hosts": len(pools),
+        "open_hosts": open_hosts,
+        "max_in_flight": busiest,
+        "saturation": round(busiest / HEALTH_POOL_MAX_INFLIGHT, 4)
+    }
+
+
+def check_queues():
+    """Journal backlog (writers block once it is full) and request concurrency."""
+    journal_stats = journal.stats()
+    journal_fill = journal_stats["queue_depth"] / journal_stats["queue_capacity"] \
+        if journal_stats["queue_capacity"] else 0.0
+    inflight = admission.stats()["inflight"]
+    inflight_fill = inflight / ADMISSION_MAX_INFLIGHT if ADMISSION_MAX_INFLIGHT else 0.0
+    if journal_fill >= 0.9:
+        status = "failing"
+    elif journal_fill >= 0.5 or inflight_fill >= 0.9:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {
+        "status": status,
+        "journal_queue_depth": journal_stats["queue_depth"],
+        "journal_spool_pending": journal_stats["spool_pending"],
+        "requests_in_flight": inflight,
+        "query_log_pending": query_log.stats()["pending"]
+    }
+
+
+def check_errors():
+    """Share of 5xx responses since the previous probe."""
+    requests_seen, errors = error_rate.take()
+    rate = errors / requests_seen if requests_seen else 0.0
+    return {
+        # A handful of requests is too few to judge
+        "status": "degraded" if requests_seen >= 20 and rate >= HEALTH_MAX_ERROR_RATE else "ok",
+        "requests": requests_seen,
+        "errors": errors,
+        "error_rate": round(rate, 4)
+    }
+
+
+health = HealthProber(
+    checks={
+        "database": check_database,
+        "connections": check_connections,
+        "queues": check_queues,
+        "errors": check_errors
+    },
+    interval=float(os.environ.get('HEALTH_PROBE_INTERVAL', 5.0)),
+    failure_threshold=int(os.environ.get('HEALTH_FAILURE_THRESHOLD', 2))
+)
+
+
+@app.route('/livez', methods=['GET'])
+def livez():
+    live = health.live()
+    return jsonify({"status": "live" if live else "stalled"}), 200 if live else 503
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    ready, reason = health.ready()
+    return jsonify({"status": "ready" if ready else "not_ready", "reason": reason}), 200 if ready else 503
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    db_status = "healthy"
-    try:
-        session.execute("SELECT now() FROM system.local")
-    except:
-        db_status = "unhealthy"
+    state = health.status()
+    database = state["checks"].get("database", {}).get("status")
 
     return jsonify({
-        "success": True,
-        "status": "healthy",
-        "database": db_status,
+        "success": state["ready"],
+        "status": state["status"],
+        "database": "healthy" if database == "ok" else database or "unknown",
+        "storage": STORAGE_BACKEND,
+        "checks": state["checks"],
+        "reason": state["reason"],
+        "last_probe_age_s": state["last_probe_age_s"],
         "service": "DÍA - Digital Investment Accelerator",
         "version": "1.0.0-docker",
         "timestamp": datetime.now().isoformat()
+    }), 200 if state["ready"] else 503
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        "success": True,
+        "data": {
+            "admission": admission.stats(),
+            "journal": journal.stats(),
+            "scheduler": scheduler.stats(),
+            "roundup_jar": roundup_jar.stats(),
+            "portfolio_cache": portfolio_cache.stats(),
+            "recommender": recommender.stats(),
+            "projection": projector.stats(),
+            "stream": dict(stream_hub.stats(), relay=stream_relay.stats() if stream_relay is not None else None),
+            "query_log": query_log.stats(),
+            "coalescing": read_coalescer.stats(),
+            "fund_catalog": fund_catalog.stats(),
+            "timestamp": datetime.now().isoformat()
+        }
     }), 200
 
 
@@ -787,11 +1912,61 @@ def not_found(error):
 def internal_error(error):
     return jsonify({"success": False, "error": "Internal server error"}), 500
 
+@app.errorhandler(CoalescedTimeout)
+def coalesced_timeout(error):
+    return jsonify({"success": False, "error": "Timed out waiting for the database", "code": "TIMEOUT"}), 503
+
 
 # =============================================================================
 # MAIN
 # =============================================================================
 
+def start_services():
+    """Connect storage and start the background workers for the configured backend."""
+    print(f"Storage backend: {STORAGE_BACKEND}")
+    if STORAGE_BACKEND == 'cassandra':
+        if not connect_to_cassandra():
+            print("Failed to connect to Cassandra. Exiting.")
+            exit(1)
+        try:
+            init_database()
+        except migrate.MigrationError as e:
+            print(f"Schema check failed: {e}")
+            exit(1)
+        query_log.attach(session)
+        atexit.register(query_log.shutdown)
+        store.attach(session)
+
+    # Funds are needed by every money path, so load them before the workers start
+    fund_catalog.load()
+    fund_catalog.start()
+    atexit.register(fund_catalog.shutdown)
+
+    if STORAGE_BACKEND == 'cassandra':
+        journal.start(session)
+        if SCHEDULER_ENABLED:
+            scheduler.start(session)
+            atexit.register(scheduler.shutdown)
+        else:
+            scheduler.attach(session)
+        if ROUNDUP_JAR_ENABLED:
+            roundup_jar.start(session)
+            atexit.register(roundup_jar.shutdown)
+    atexit.register(store.close)
+    health.start()
+    atexit.register(health.shutdown)
+
+    # The debug reloader runs this block in its watcher process too; only the child serves requests
+    serving = not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if STREAM_ENABLED and serving:
+        stream_server.start()
+        leaderboard_watch.start()
+        atexit.register(stream_server.shutdown)
+        atexit.register(leaderboard_watch.shutdown)
+        if stream_relay is not None:
+            stream_relay.start()
+
+
 if __name__ == '__main__':
     print("""
     ╔═══════════════════════════════════════════════════════════════╗
@@ -800,9 +1975,6 @@ if __name__ == '__main__':
     ╚═══════════════════════════════════════════════════════════════╝
     """)
 
-    if connect_to_cassandra():
-        init_database()
-        app.run(debug=True, host='0.0.0.0', port=5000)
-    else:
-        print("Failed to connect to Cassandra. Exiting.")
-        exit(1)
+    app.debug = os.environ.get('FLASK_DEBUG', 'true').lower() == 'true'
+    start_services()
+    app.run(debug=app.debug, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
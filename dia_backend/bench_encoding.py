@@ -0,0 +1,96 @@
+"""
+DÍA - Response Encoding Benchmark
+=================================
+Compares JSON and MessagePack payload sizes and encode times for the main
+read endpoints.
+
+Runs the app in-process on the memory backend with a seeded user who has
+a few months of round-ups across every fund. Each endpoint's response is
+fetched once to get its data. Then the same structure is encoded repeatedly
+with each format, plain and gzip-compressed, and the results are printed
+as a table.
+
+Usage:
+    python bench_encoding.py [--iterations 2000] [--transactions 300]
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import time
+
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ.setdefault('STREAM_ENABLED', 'false')
+os.environ.setdefault('ADMISSION_ENABLED', 'false')
+
+import app as dia
+
+ENDPOINTS = (
+    ('portfolio', '/api/user/{user_id}/portfolio'),
+    ('funds', '/api/funds'),
+    ('recommend', '/api/funds/recommend'),
+    ('allocations', '/api/funds/allocations'),
+    ('leaderboard', '/api/leaderboard'),
+    ('projection', '/api/user/{user_id}/projection?years=10'),
+    ('dashboard', '/api/dashboard'),
+)
+
+
+def seed(client, transactions):
+    users = []
+    for index in range(12):
+        response = client.post('/api/register', json={
+            'username': f'bench_{index}', 'password': 'bench-password', 'risk_profile': 'Moderate'
+        }).get_json()['data']
+        users.append(response)
+    headers = {'Authorization': f"Bearer {users[0]['token']}"}
+    fund_ids = list(dia.fund_catalog.funds)
+    for index in range(transactions):
+        client.post('/api/transactions/roundup', headers=headers, json={
+            'transaction_amount': 3.17 + index % 40, 'fund_id': fund_ids[index % len(fund_ids)]
+        })
+    for user in users[1:]:
+        client.post('/api/transactions/deposit', headers={'Authorization': f"Bearer {user['token']}"},
+                    json={'amount': 50, 'fund_id': fund_ids[0]})
+    return users[0]['user_id'], headers
+
+
+def timed(encode, obj, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        body = encode(obj)
+    return body, (time.perf_counter() - started) / iterations * 1e6
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs MessagePack response encoding.")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=300)
+    args = parser.parse_args(argv)
+
+    client = dia.app.test_client()
+    user_id, headers = seed(client, args.transactions)
+    provider = dia.app.json
+
+    print(f"{'endpoint':<12} {'json B':>8} {'msgpack B':>10} {'ratio':>6} "
+          f"{'json.gz B':>10} {'mpack.gz B':>11} {'json us':>8} {'msgpack us':>11}")
+    totals = [0, 0, 0, 0]
+    for name, path in ENDPOINTS:
+        obj = client.get(path.format(user_id=user_id), headers=headers).get_json()
+        json_body, json_us = timed(lambda o: provider.dumps(o).encode('utf-8'), obj, args.iterations)
+        msgpack_body, msgpack_us = timed(provider.packb, obj, args.iterations)
+        json_gz = len(gzip.compress(json_body, provider.compress_level))
+        msgpack_gz = len(gzip.compress(msgpack_body, provider.compress_level))
+        for i, size in enumerate((len(json_body), len(msgpack_body), json_gz, msgpack_gz)):
+            totals[i] += size
+        print(f"{name:<12} {len(json_body):>8} {len(msgpack_body):>10} "
+              f"{len(msgpack_body) / len(json_body):>6.2f} {json_gz:>10} {msgpack_gz:>11} "
+              f"{json_us:>8.1f} {msgpack_us:>11.1f}")
+    print(f"{'total':<12} {totals[0]:>8} {totals[1]:>10} {totals[1] / totals[0]:>6.2f} "
+          f"{totals[2]:>10} {totals[3]:>11}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,258 @@
+"""
+DÍA - Cassandra Driver Tuning Profiles
+======================================
+Named driver profiles for connecting to Cassandra.
+
+A profile is a plain dict of driver settings. Built-in profiles cover local
+development (`local`) and a multi-node, multi-DC deployment (`cluster`).
+Profiles can be extended or overridden through a JSON config file
+(`CASSANDRA_CONFIG_FILE`) and individual settings through environment
+variables, in that order of precedence:
+
+    built-in profile  <  config file  <  environment variables
+
+Example config file:
+
+    {
+        "profile": "production",
+        "profiles": {
+            "production": {
+                "extends": "cluster",
+                "contact_points": ["10.0.0.11", "10.0.0.12", "10.0.0.13"],
+                "local_dc": "baku1",
+                "replication": {"baku1": 3, "ganja1": 2}
+            }
+        }
+    }
+"""
+
+import json
+import os
+
+from cassandra.auth import PlainTextAuthProvider
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import (
+    DCAwareRoundRobinPolicy,
+    ExponentialReconnectionPolicy,
+    HostDistance,
+    TokenAwarePolicy,
+)
+
+# =============================================================================
+# BUILT-IN PROFILES
+# =============================================================================
+
+PROFILES = {
+    # Single node in docker-compose / on a laptop
+    "local": {
+        "contact_points": ["localhost"],
+        "port": 9042,
+        "local_dc": None,
+        "used_hosts_per_remote_dc": 0,
+        "compression": None,
+        "username": None,
+        "password": None,
+        "core_connections_per_host": 1,
+        "max_connections_per_host": 2,
+        "request_timeout": 10.0,
+        "connect_timeout": 5.0,
+        "reconnect_base_delay": 1.0,
+        "reconnect_max_delay": 30.0,
+        "connect_retries": 30,
+        "replication_strategy": "SimpleStrategy",
+        "replication": {"replication_factor": 1},
+    },
+    # Multi-node cluster: token-aware routing pinned to the local DC
+    "cluster": {
+        "contact_points": ["localhost"],
+        "port": 9042,
+        "local_dc": "dc1",
+        "used_hosts_per_remote_dc": 0,
+        "compression": "lz4",
+        "username": None,
+        "password": None,
+        "core_connections_per_host": 2,
+        "max_connections_per_host": 8,
+        "request_timeout": 5.0,
+        "connect_timeout": 5.0,
+        "reconnect_base_delay": 0.5,
+        "reconnect_max_delay": 60.0,
+        "connect_retries": 10,
+        "replication_strategy": "NetworkTopologyStrategy",
+        "replication": {"dc1": 3},
+    },
+}
+
+DEFAULT_PROFILE = "local"
+
+# =============================================================================
+# ENVIRONMENT OVERRIDES
+# =============================================================================
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def _replication(value):
+    """Parse `dc1:3,dc2:2` (NetworkTopologyStrategy) or `3` (SimpleStrategy)."""
+    value = value.strip()
+    if ':' not in value:
+        return {"replication_factor": int(value)}
+    replication = {}
+    for item in _csv(value):
+        dc, factor = item.split(':', 1)
+        replication[dc.strip()] = int(factor)
+    return replication
+
+def _none_if_off(value):
+    return None if value.lower() in ('', 'none', 'off', 'false') else value.lower()
+
+# Environment variable -> (profile key, parser)
+ENV_OVERRIDES = {
+    "CASSANDRA_HOSTS": ("contact_points", _csv),
+    "CASSANDRA_HOST": ("contact_points", _csv),
+    "CASSANDRA_PORT": ("port", int),
+    "CASSANDRA_LOCAL_DC": ("local_dc", str),
+    "CASSANDRA_REMOTE_HOSTS_PER_DC": ("used_hosts_per_remote_dc", int),
+    "CASSANDRA_COMPRESSION": ("compression", _none_if_off),
+    "CASSANDRA_USERNAME": ("username", str),
+    "CASSANDRA_PASSWORD": ("password", str),
+    "CASSANDRA_CORE_CONNECTIONS": ("core_connections_per_host", int),
+    "CASSANDRA_MAX_CONNECTIONS": ("max_connections_per_host", int),
+    "CASSANDRA_REQUEST_TIMEOUT": ("request_timeout", float),
+    "CASSANDRA_CONNECT_TIMEOUT": ("connect_timeout", float),
+    "CASSANDRA_RECONNECT_BASE_DELAY": ("reconnect_base_delay", float),
+    "CASSANDRA_RECONNECT_MAX_DELAY": ("reconnect_max_delay", float),
+    "CASSANDRA_CONNECT_RETRIES": ("connect_retries", int),
+    "CASSANDRA_REPLICATION_STRATEGY": ("replication_strategy", str),
+    "CASSANDRA_REPLICATION": ("replication", _replication),
+}
+
+# =============================================================================
+# PROFILE LOADING
+# =============================================================================
+
+def _read_config_file(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _resolve(name, profiles, seen=()):
+    if name in seen:
+        raise ValueError(f"Cassandra profile inheritance loop: {' -> '.join(seen + (name,))}")
+    if name not in profiles:
+        raise ValueError(f"Unknown Cassandra profile '{name}'. Available: {sorted(profiles)}")
+
+    profile = dict(profiles[name])
+    parent = profile.pop("extends", None)
+    if parent:
+        base = _resolve(parent, profiles, seen + (name,))
+        base.update(profile)
+        profile = base
+    return profile
+
+def load_profile(name=None, environ=None):
+    """Return the effective settings dict for the selected profile."""
+    environ = os.environ if environ is None else environ
+
+    profiles = dict(PROFILES)
+    config = {}
+    config_file = environ.get('CASSANDRA_CONFIG_FILE')
+    if config_file:
+        config = _read_config_file(config_file)
+        profiles.update(config.get('profiles', {}))
+
+    name = name or environ.get('CASSANDRA_PROFILE') or config.get('profile') or DEFAULT_PROFILE
+    profile = _resolve(name, profiles)
+
+    # CASSANDRA_HOSTS wins over the legacy single CASSANDRA_HOST
+    for env_name, (key, parse) in ENV_OVERRIDES.items():
+        if env_name == 'CASSANDRA_HOST' and environ.get('CASSANDRA_HOSTS'):
+            continue
+        if env_name in environ:
+            profile[key] = parse(environ[env_name])
+
+    strategy = profile['replication_strategy']
+    if strategy not in ('SimpleStrategy', 'NetworkTopologyStrategy'):
+        raise ValueError(f"Unsupported replication strategy: {strategy}")
+    if strategy == 'NetworkTopologyStrategy' and 'replication_factor' in profile['replication']:
+        # A bare factor means "this factor in the local DC"
+        dc = profile['local_dc'] or 'dc1'
+        profile['replication'] = {dc: profile['replication']['replication_factor']}
+
+    profile['name'] = name
+    return profile
+
+# =============================================================================
+# CLUSTER CONSTRUCTION
+# =============================================================================
+
+def build_load_balancing_policy(profile):
+    child = DCAwareRoundRobinPolicy(
+        local_dc=profile['local_dc'],
+        used_hosts_per_remote_dc=profile['used_hosts_per_remote_dc']
+    )
+    return TokenAwarePolicy(child)
+
+def build_cluster(profile):
+    """Create an (unconnected) Cluster configured from a profile."""
+    auth_provider = None
+    if profile.get('username'):
+        auth_provider = PlainTextAuthProvider(
+            username=profile['username'],
+            password=profile.get('password') or ''
+        )
+
+    default_profile = ExecutionProfile(
+        load_balancing_policy=build_load_balancing_policy(profile),
+        request_timeout=profile['request_timeout']
+    )
+
+    cluster = Cluster(
+        contact_points=profile['contact_points'],
+        port=profile['port'],
+        compression=profile['compression'] or False,
+        auth_provider=auth_provider,
+        reconnection_policy=ExponentialReconnectionPolicy(
+            base_delay=profile['reconnect_base_delay'],
+            max_delay=profile['reconnect_max_delay']
+        ),
+        connect_timeout=profile['connect_timeout'],
+        execution_profiles={EXEC_PROFILE_DEFAULT: default_profile}
+    )
+    return cluster
+
+def apply_pool_settings(cluster, profile):
+    """
+    Apply per-host connection pool sizes.
+
+    The driver only honours core/max connections per host on protocol v1/v2;
+    on v3+ it multiplexes requests over one connection per host and these
+    settings are ignored.
+    """
+    if cluster.protocol_version is None or cluster.protocol_version >= 3:
+        return False
+    for distance in (HostDistance.LOCAL, HostDistance.REMOTE):
+        cluster.set_max_connections_per_host(distance, profile['max_connections_per_host'])
+        cluster.set_core_connections_per_host(distance, profile['core_connections_per_host'])
+    return True
+
+def reconnect_delays(profile):
+    """Exponential backoff schedule used between initial connection attempts."""
+    policy = ExponentialReconnectionPolicy(
+        base_delay=profile['reconnect_base_delay'],
+        max_delay=profile['reconnect_max_delay'],
+        max_attempts=profile['connect_retries']
+    )
+    return policy.new_schedule()
+
+def keyspace_replication(profile):
+    """CQL replication map for CREATE KEYSPACE."""
+    options = {"class": profile['replication_strategy']}
+    options.update({key: int(value) for key, value in profile['replication'].items()})
+    return "{" + ", ".join(f"'{key}': '{value}'" if key == 'class' else f"'{key}': {value}"
+                           for key, value in options.items()) + "}"
+
+def describe(profile):
+    """Short, password-free summary for startup logs."""
+    return (f"profile={profile['name']} hosts={','.join(profile['contact_points'])}:{profile['port']} "
+            f"dc={profile['local_dc'] or 'auto'} compression={profile['compression'] or 'none'} "
+            f"replication={profile['replication_strategy']}")
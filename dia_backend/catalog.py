@@ -0,0 +1,144 @@
+"""
+DÍA - Fund Catalog
+==================
+In-process snapshot of the funds table.
+
+Each process holds one immutable snapshot: a version number and a read-only
+{fund_id: fund} mapping. Request handlers read `catalog.funds` and do
+plain dict lookups, never touching the database. A background poller
+reads the single catalog_version row every `poll_interval` seconds. When
+the version changes, it loads the full catalog, builds a new snapshot and
+swaps it in with one reference assignment. Readers that already hold the
+old mapping keep a consistent view until they are done.
+
+Before the store is connected, the snapshot is DEFAULT_FUNDS at version 0.
+An empty catalog (fresh SQLite file or memory store) is seeded with them.
+"""
+
+import threading
+import time
+from types import MappingProxyType
+
+DEFAULT_FUNDS = [
+    {
+        "id": "fund_001",
+        "name": "Energy Transition Fund",
+        "description": "A conservative fund focused on stable renewable energy infrastructure investments in the Caspian region.",
+        "risk_level": "Conservative",
+        "annual_return_mock": 6.5,
+        "volatility_mock": 5.0,
+        "nav": 124.56,
+        "min_investment": 10.0,
+        "sector": "Green Energy"
+    },
+    {
+        "id": "fund_002",
+        "name": "Balanced Green Fund",
+        "description": "A diversified portfolio combining green energy assets with emerging ICT opportunities.",
+        "risk_level": "Moderate",
+        "annual_return_mock": 9.2,
+        "volatility_mock": 10.0,
+        "nav": 187.34,
+        "min_investment": 10.0,
+        "sector": "Mixed (Green + ICT)"
+    },
+    {
+        "id": "fund_003",
+        "name": "ICT Innovation Fund",
+        "description": "An aggressive growth fund targeting cutting-edge technology startups and digital infrastructure.",
+        "risk_level": "Aggressive",
+        "annual_return_mock": 14.8,
+        "volatility_mock": 22.0,
+        "nav": 256.78,
+        "min_investment": 10.0,
+        "sector": "ICT & Technology"
+    }
+]
+
+
+class CatalogSnapshot:
+    __slots__ = ('version', 'funds', 'loaded_at')
+
+    def __init__(self, version, funds):
+        self.version = version
+        self.funds = MappingProxyType({fund['id']: MappingProxyType(dict(fund)) for fund in funds})
+        self.loaded_at = time.time()
+
+
+class FundCatalog:
+    def __init__(self, store, poll_interval=30.0, on_change=None):
+        """on_change(snapshot) runs after every swap; its exceptions are logged, not raised."""
+        self.store = store
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+
+        self._snapshot = CatalogSnapshot(0, DEFAULT_FUNDS)
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"polls": 0, "reloads": 0, "poll_errors": 0, "subscriber_errors": 0}
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def funds(self):
+        """Read-only {fund_id: fund} of the current snapshot."""
+        return self._snapshot.funds
+
+    def load(self):
+        """Initial load; seeds an empty catalog with DEFAULT_FUNDS."""
+        if self.store.catalog_version() is None:
+            self.store.put_funds(DEFAULT_FUNDS, 1)
+        self.refresh()
+
+    def refresh(self):
+        """Reload if the stored version differs from the snapshot. Returns True when it swapped."""
+        with self._refresh_lock:
+            self._stats["polls"] += 1
+            version = self.store.catalog_version()
+            if version is None or version == self._snapshot.version:
+                return False
+            # Funds are read after the version, so the snapshot is at least as new as its number
+            snapshot = CatalogSnapshot(version, self.store.get_funds())
+            self._snapshot = snapshot
+            self._stats["reloads"] += 1
+        if self.on_change is not None:
+            try:
+                self.on_change(snapshot)
+            except Exception as e:
+                # The swap already happened; a failing subscriber must not look like a failed reload
+                self._stats["subscriber_errors"] += 1
+                print(f"Fund catalog: on_change failed for version {version}: {e}")
+        return True
+
+    def publish(self, funds):
+        """Write changed funds under a new version and load them here right away."""
+        version = max(int(time.time() * 1000), self._snapshot.version + 1)
+        self.store.put_funds(funds, version)
+        self.refresh()
+        return self._snapshot
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fund-catalog', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the last snapshot until the database answers again
+                self._stats["poll_errors"] += 1
+                print(f"Fund catalog: poll failed: {e}")
+
+    def stats(self):
+        snapshot = self._snapshot
+        return dict(self._stats, version=snapshot.version, funds=len(snapshot.funds),
+                    loaded_at=snapshot.loaded_at)
@@ -0,0 +1,58 @@
+"""
+DÍA - Response Encoding
+=======================
+Content negotiation for API responses: JSON by default, MessagePack for
+clients that ask for it with `Accept: application/msgpack`.
+
+It is installed as the app's JSON provider, so every `jsonify(...)` call,
+including error handlers and admission rejections, encodes the same
+response structure in whichever format the client prefers. Values JSON
+would stringify (datetimes, UUIDs, decimals) are converted the same way,
+so both formats carry identical data.
+
+MessagePack bodies of at least `compress_min_bytes` are gzip-compressed
+when the client sends `Accept-Encoding: gzip`. JSON responses are left as
+they were.
+"""
+
+import gzip
+
+import msgpack
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+OFFERED = ('application/json',) + MSGPACK_MIMETYPES
+
+
+def wants_msgpack():
+    if not has_request_context():
+        return False
+    # JSON wins ties, so */* and missing Accept headers keep getting JSON
+    return request.accept_mimetypes.best_match(OFFERED) in MSGPACK_MIMETYPES
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    compress_min_bytes = 1400
+    compress_level = 6
+
+    def packb(self, obj):
+        return msgpack.packb(obj, default=self.default, use_bin_type=True)
+
+    def response(self, *args, **kwargs):
+        if not wants_msgpack():
+            response = super().response(*args, **kwargs)
+            response.vary.add('Accept')
+            return response
+
+        if args and kwargs:
+            raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+        obj = (args[0] if len(args) == 1 else list(args)) if args else (kwargs or None)
+
+        body = self.packb(obj)
+        response = self._app.response_class(body, mimetype=MSGPACK_MIMETYPES[0])
+        response.vary.update(('Accept', 'Accept-Encoding'))
+        if len(body) >= self.compress_min_bytes and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.set_data(gzip.compress(body, self.compress_level))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,74 @@
+"""
+DÍA - Transaction Export
+========================
+Generators that turn a stream of transaction rows into CSV or NDJSON
+chunks, optionally gzip-compressed on the fly.
+
+Rows are encoded in batches, so the response is a series of reasonably
+sized chunks rather than one write per row. Nothing holds more than one
+batch, so memory stays flat regardless of history length.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+EXPORT_FIELDS = ('transaction_id', 'created_at', 'type', 'amount', 'currency', 'fund_id', 'fund_name')
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_record(row, funds):
+    fund = funds.get(row['fund_id'])
+    return {
+        "transaction_id": row['transaction_id'],
+        "created_at": row['created_at'].isoformat() if row['created_at'] else None,
+        "type": row['type'],
+        "amount": round(row['amount'], 2),
+        "currency": "AZN",
+        "fund_id": row['fund_id'],
+        "fund_name": fund['name'] if fund else None,
+    }
+
+
+def encode(rows, format, funds, batch_size=500):
+    """Yield text chunks of `batch_size` encoded rows (CSV starts with a header chunk)."""
+    buffer = io.StringIO()
+    writer = None
+    if format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+
+    pending = 0
+    for row in rows:
+        record = export_record(row, funds)
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(record, separators=(',', ':')))
+            buffer.write('\n')
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress text chunks into one gzip stream, yielding the bytes for each chunk as it goes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        # Sync flush so each batch reaches the client instead of sitting in the compressor
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
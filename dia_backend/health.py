@@ -0,0 +1,145 @@
+"""
+DÍA - Health Prober
+===================
+Runs health checks on a background thread and keeps the last result in
+memory, so liveness and readiness endpoints answer without touching the
+database.
+
+Each check is a callable that returns a dict with a "status" of "ok",
+"degraded" or "failing" plus any details; an exception counts as failing.
+A check only makes the instance unready after `failure_threshold`
+consecutive failing probes, and it becomes ready again after
+`recovery_threshold` consecutive passing ones, so a single slow probe does
+not flap it out of rotation.
+
+Liveness only asks whether the process is still making progress: once
+running, the prober loop must have started a probe within `stall_after`
+seconds.
+"""
+
+import threading
+import time
+
+
+class ErrorRate:
+    """Counts responses per probe window; the prober reads and resets it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def record(self, status_code):
+        with self._lock:
+            self._requests += 1
+            if status_code >= 500:
+                self._errors += 1
+
+    def take(self):
+        with self._lock:
+            requests, errors = self._requests, self._errors
+            self._requests = self._errors = 0
+        return requests, errors
+
+
+class HealthProber:
+    def __init__(self, checks, interval=5.0, failure_threshold=2, recovery_threshold=1, stall_after=60.0):
+        self.checks = checks
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.recovery_threshold = recovery_threshold
+        self.stall_after = stall_after
+
+        self._results = {}
+        self._streaks = {name: 0 for name in checks}
+        # Every check starts unready; its first passing probe admits it
+        self._failing = set(checks)
+        self._probes = 0
+        self._last_started = None
+        self._last_finished = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe()
+            self._stop.wait(self.interval)
+
+    def probe(self):
+        """Run every check once and update the cached state."""
+        self._last_started = time.monotonic()
+        results = {}
+        for name, check in self.checks.items():
+            started = time.perf_counter()
+            try:
+                result = dict(check())
+            except Exception as e:
+                result = {"status": "failing", "error": str(e) or e.__class__.__name__}
+            result["probe_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            results[name] = result
+
+        with self._lock:
+            for name, result in results.items():
+                failing = result["status"] == "failing"
+                # Streak counts consecutive probes in the opposite state to the current one
+                if failing == (name in self._failing):
+                    self._streaks[name] = 0
+                else:
+                    self._streaks[name] += 1
+                    threshold = self.failure_threshold if failing else self.recovery_threshold
+                    if self._streaks[name] >= threshold:
+                        if failing:
+                            self._failing.add(name)
+                        else:
+                            self._failing.discard(name)
+                        self._streaks[name] = 0
+            self._results = results
+            self._probes += 1
+            self._last_finished = time.time()
+
+    # -------------------------------------------------------------------------
+    # Cached answers
+    # -------------------------------------------------------------------------
+
+    def live(self):
+        started = self._last_started
+        return started is None or time.monotonic() - started < self.stall_after
+
+    def ready(self):
+        """(ready, reason) from the last probe; not ready until the first probe has run."""
+        with self._lock:
+            if not self._probes:
+                return False, "starting"
+            if self._failing:
+                return False, "failing: " + ", ".join(sorted(self._failing))
+        return True, "ok"
+
+    def status(self):
+        """'healthy', 'degraded' or 'unhealthy' plus per-check results."""
+        ready, reason = self.ready()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+            last_probe = self._last_finished
+        if not ready:
+            overall = "unhealthy"
+        elif any(result["status"] != "ok" for result in results.values()):
+            overall = "degraded"
+        else:
+            overall = "healthy"
+        return {
+            "status": overall,
+            "ready": ready,
+            "reason": reason,
+            "checks": results,
+            "last_probe_age_s": round(time.time() - last_probe, 3) if last_probe else None,
+        }
@@ -0,0 +1,373 @@
+"""
+DÍA - Write-Behind Transaction Journal
+======================================
+Rows in the `transactions` table are history, not balance state, so the
+money endpoints hand them to this journal instead of inserting them inline.
+A background flusher drains the queue and writes the rows in per-partition
+(per-user) UNLOGGED batches.
+
+Durability modes:
+- sync:   insert inline before the request returns (previous behaviour)
+- async:  acknowledge once queued; rows still queued are lost on a crash
+- spool:  append to a local spool file before acknowledging; the spool is
+          replayed on startup and cut down to the rows still unwritten once
+          everything in it has been flushed
+
+Rows whose batch failed are kept and retried by the flusher every
+`retry_interval` seconds until they are written; in spool mode they also stay
+in the spool, so they survive a restart. Rows still unwritten at shutdown are
+reported.
+
+The queue is bounded. When it is full, callers block for up to
+`enqueue_timeout` seconds and then write the row inline themselves, so a
+slow database pushes back on request handlers instead of growing memory.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from cassandra.query import BatchStatement, BatchType
+
+MODES = ('sync', 'async', 'spool')
+
+INSERT_TRANSACTION_CQL = """
+    INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at, units)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_STOP = object()
+
+
+class TransactionJournal:
+    def __init__(self, mode='async', flush_size=100, flush_interval=0.05,
+                 max_queue=10000, enqueue_timeout=1.0, spool_path=None,
+                 max_retries=3, retry_interval=5.0):
+        if mode not in MODES:
+            raise ValueError(f"Invalid journal mode '{mode}'. Must be one of: {MODES}")
+        if mode == 'spool' and not spool_path:
+            raise ValueError("Journal mode 'spool' requires a spool_path")
+
+        self.mode = mode
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.spool_path = spool_path
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._session = None
+        self._insert = None
+        self._thread = None
+        self._spool_lock = threading.Lock()
+        self._spool_file = None
+        self._spool_pending = 0
+        self._spool_lines = 0
+        self._failed = []
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "inline_writes": 0,
+            "backpressure_waits": 0,
+            "failed": 0,
+            "replayed": 0,
+            "retry_attempts": 0,
+            "retried": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def start(self, session):
+        """Prepare statements, replay any spool and start the flusher thread."""
+        self._session = session
+        self._insert = session.prepare(INSERT_TRANSACTION_CQL)
+
+        if self.mode == 'sync':
+            return
+
+        if self.mode == 'spool':
+            self._replay_spool()
+            self._spool_file = open(self.spool_path, 'a', encoding='utf-8')
+
+        self._thread = threading.Thread(target=self._run, name='transaction-journal', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=10.0):
+        """Drain everything still queued, then stop the flusher."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"Transaction journal did not drain within {timeout}s "
+                  f"({self._queue.qsize()} entries left)")
+        elif self._failed:
+            kept = "kept in the spool" if self.mode == 'spool' else "LOST"
+            print(f"Transaction journal: {len(self._failed)} entries still unwritten at shutdown ({kept})")
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+
+    # -------------------------------------------------------------------------
+    # Producer side
+    # -------------------------------------------------------------------------
+
+    def record(self, transaction_id, user_id, type, amount, fund_id, created_at=None, units=None):
+        """Record one transaction row according to the durability mode."""
+        entry = (transaction_id, user_id, type, amount, fund_id, created_at or datetime.now(), units)
+
+        if self.mode == 'sync' or self._thread is None:
+            self._write_inline(entry)
+            return
+
+        if self.mode == 'spool':
+            self._append_to_spool(entry)
+
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._bump("backpressure_waits")
+            try:
+                self._queue.put(entry, timeout=self.enqueue_timeout)
+            except queue.Full:
+                try:
+                    self._write_inline(entry)
+                except Exception as e:
+                    # Acknowledged like a queued row: the flusher retries it
+                    print(f"Transaction journal: inline write failed, keeping entry for retry: {e}")
+                    self._spool_done(1, [entry])
+                else:
+                    self._spool_done(1)
+                return
+        self._bump("enqueued")
+
+    def _write_inline(self, entry):
+        self._session.execute(self._insert, entry)
+        self._bump("inline_writes")
+        self._bump("written")
+
+    # -------------------------------------------------------------------------
+    # Flusher
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        next_retry = time.monotonic() + self.retry_interval
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._spool_done(len(batch), self._flush_safely(batch))
+            if stopping:
+                self._drain()
+                if self._failed:
+                    self._retry_failed()
+                return
+            if self._failed and time.monotonic() >= next_retry:
+                self._retry_failed()
+                next_retry = time.monotonic() + self.retry_interval
+
+    def _collect(self):
+        """Wait for up to flush_size entries or flush_interval, whichever is first."""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return [], False
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.flush_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is not _STOP:
+                    batch.append(entry)
+            if not batch:
+                return
+            self._spool_done(len(batch), self._flush_safely(batch))
+
+    def _flush_safely(self, entries):
+        # The flusher thread must survive anything a batch throws at it,
+        # otherwise producers end up blocking on a queue nobody drains.
+        try:
+            return self._flush(entries)
+        except Exception as e:
+            print(f"Transaction journal: failed to flush {len(entries)} entries: {e}")
+            return entries
+
+    def _retry_failed(self):
+        # Other threads only append to _failed, so the snapshot stays a prefix
+        with self._spool_lock:
+            retrying = list(self._failed)
+        self._bump("retry_attempts", len(retrying))
+        still_failed = []
+        for start in range(0, len(retrying), self.flush_size):
+            still_failed.extend(self._flush_safely(retrying[start:start + self.flush_size]))
+        with self._spool_lock:
+            self._failed = self._failed[len(retrying):] + still_failed
+        self._bump("retried", len(retrying) - len(still_failed))
+        self._spool_done(0)
+
+    def _flush(self, entries):
+        """Write entries in per-user batches; returns the entries whose batch failed."""
+        partitions = defaultdict(list)
+        for entry in entries:
+            partitions[entry[1]].append(entry)
+
+        futures = []
+        for user_entries in partitions.values():
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for entry in user_entries:
+                batch.add(self._insert, entry)
+            futures.append((batch, user_entries, self._session.execute_async(batch)))
+
+        failed = []
+        for batch, user_entries, future in futures:
+            if not self._await_batch(batch, len(user_entries), future):
+                failed.extend(user_entries)
+        return failed
+
+    def _await_batch(self, batch, size, future):
+        for attempt in range(self.max_retries + 1):
+            try:
+                future.result()
+                self._bump("batches")
+                self._bump("written", size)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Transaction journal: batch of {size} failed after "
+                          f"{attempt + 1} attempts, keeping it for retry: {e}")
+                    return False
+                time.sleep(min(0.1 * (2 ** attempt), 2.0))
+                future = self._session.execute_async(batch)
+
+    # -------------------------------------------------------------------------
+    # Spool file
+    # -------------------------------------------------------------------------
+
+    def _spool_line(self, entry):
+        transaction_id, user_id, type, amount, fund_id, created_at, units = entry
+        return json.dumps({
+            "transaction_id": transaction_id,
+            "user_id": user_id,
+            "type": type,
+            "amount": amount,
+            "fund_id": fund_id,
+            "created_at": created_at.isoformat(),
+            "units": units
+        })
+
+    def _append_to_spool(self, entry):
+        line = self._spool_line(entry)
+        with self._spool_lock:
+            self._spool_file.write(line + "\n")
+            self._spool_file.flush()
+            os.fsync(self._spool_file.fileno())
+            self._spool_pending += 1
+            self._spool_lines += 1
+
+    def _spool_done(self, count, failed=()):
+        """Mark count entries attempted; failed ones join the retry list in every mode."""
+        with self._spool_lock:
+            self._failed.extend(failed)
+            self._bump("failed", len(failed))
+            if self.mode != 'spool' or self._spool_file is None:
+                return
+            self._spool_pending = max(0, self._spool_pending - count)
+            # Once every acknowledged row has been attempted, the spool only
+            # needs the ones still waiting for a retry
+            if self._spool_pending == 0 and self._spool_lines > len(self._failed):
+                self._rewrite_spool(self._failed)
+
+    def _rewrite_spool(self, entries):
+        # Caller holds _spool_lock, or the flusher has not started yet
+        spool = self._spool_file or open(self.spool_path, 'w', encoding='utf-8')
+        spool.truncate(0)
+        spool.seek(0)
+        spool.writelines(self._spool_line(entry) + "\n" for entry in entries)
+        spool.flush()
+        os.fsync(spool.fileno())
+        if spool is not self._spool_file:
+            spool.close()
+        self._spool_lines = len(entries)
+
+    def _replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+
+        entries = []
+        with open(self.spool_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # Torn final line from a crash mid-write
+                    continue
+                entries.append((row['transaction_id'], row['user_id'], row['type'],
+                                row['amount'], row['fund_id'],
+                                datetime.fromisoformat(row['created_at']),
+                                # Spools written before units were recorded
+                                row.get('units')))
+
+        # Inserts are keyed by (user_id, created_at, transaction_id), so
+        # replaying rows that were already written is harmless.
+        for start in range(0, len(entries), self.flush_size):
+            self._failed.extend(self._flush_safely(entries[start:start + self.flush_size]))
+        self._bump("failed", len(self._failed))
+        self._bump("replayed", len(entries) - len(self._failed))
+        if entries:
+            print(f"Transaction journal: replayed {len(entries)} spooled entries"
+                  f" ({len(self._failed)} left for retry)")
+
+        self._rewrite_spool(self._failed)
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def _bump(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "mode": self.mode,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "spool_pending": self._spool_pending,
+            "retrying": len(self._failed),
+        })
+        return stats
@@ -0,0 +1,411 @@
+"""
+DÍA - Schema Migrations
+=======================
+Versioned Cassandra schema changes.
+
+Migrations live in `migrations/` as numbered Python files
+(`0001_initial.py`, `0002_....py`). Each one defines a `STATEMENTS` list of
+CQL statements and may define `upgrade(session)` for data changes, which
+runs after the statements. Applied versions are recorded in the
+`schema_version` table together with a checksum of the file.
+
+Startup only reads the current version (one single-partition query) and
+skips all DDL when the schema is current. When it is behind, one process
+takes the `schema_lock` lease and applies the pending migrations while the
+others wait for the version to catch up. The holder renews the lease every
+`LOCK_RENEW_INTERVAL` seconds for as long as it is migrating, so waiters
+keep waiting on a live holder however long its migrations take, and take
+over within `LOCK_TTL` seconds of a holder that died.
+
+Usage:
+    python migrate.py status     # show applied and pending migrations
+    python migrate.py dry-run    # print what apply would execute
+    python migrate.py apply      # apply pending migrations
+    python migrate.py verify     # check applied checksums and tables
+"""
+
+import hashlib
+import importlib.util
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from cassandra import InvalidRequest
+
+import cassandra_config
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+SCOPE = 'dia'
+LOCK_NAME = 'schema'
+LOCK_TTL = 60
+LOCK_RENEW_INTERVAL = LOCK_TTL / 3
+
+BOOTSTRAP_STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            scope text,
+            version int,
+            name text,
+            checksum text,
+            applied_at timestamp,
+            applied_by text,
+            PRIMARY KEY (scope, version)
+        ) WITH CLUSTERING ORDER BY (version DESC)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS schema_lock (
+            lock_name text PRIMARY KEY,
+            owner text,
+            acquired_at timestamp
+        )
+    """,
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, 'rb') as f:
+            self.checksum = hashlib.sha256(f.read()).hexdigest()[:16]
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            spec = importlib.util.spec_from_file_location(f"migration_{self.version:04d}", self.path)
+            self._module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self._module)
+        return self._module
+
+    @property
+    def statements(self):
+        return [statement.strip() for statement in getattr(self.module, 'STATEMENTS', [])]
+
+    def run(self, session):
+        for statement in self.statements:
+            session.execute(statement)
+        upgrade = getattr(self.module, 'upgrade', None)
+        if upgrade is not None:
+            upgrade(session)
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Migrations on disk, ordered by version."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = re.match(r'^(\d{4})_(\w+)\.py$', filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2),
+                                        os.path.join(directory, filename)))
+
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+# =============================================================================
+# VERSION TRACKING
+# =============================================================================
+
+def ensure_keyspace(session, keyspace, profile):
+    session.execute("""
+        CREATE KEYSPACE IF NOT EXISTS %s
+        WITH replication = %s
+    """ % (keyspace, cassandra_config.keyspace_replication(profile)))
+    session.set_keyspace(keyspace)
+    for statement in BOOTSTRAP_STATEMENTS:
+        session.execute(statement)
+
+
+def current_version(session):
+    """Latest applied version, 0 when nothing is applied. Raises InvalidRequest
+    when the keyspace or the schema_version table does not exist yet."""
+    row = session.execute(
+        "SELECT version FROM schema_version WHERE scope = %s LIMIT 1",
+        [SCOPE]
+    ).one()
+    return row.version if row else 0
+
+
+def applied_migrations(session):
+    rows = session.execute(
+        "SELECT version, name, checksum, applied_at, applied_by FROM schema_version WHERE scope = %s",
+        [SCOPE]
+    )
+    return {row.version: row for row in rows}
+
+
+def _record(session, migration, owner):
+    session.execute(
+        """INSERT INTO schema_version (scope, version, name, checksum, applied_at, applied_by)
+           VALUES (%s, %s, %s, %s, %s, %s)""",
+        [SCOPE, migration.version, migration.name, migration.checksum, datetime.now(), owner]
+    )
+
+
+# =============================================================================
+# LOCKING
+# =============================================================================
+
+def acquire_lock(session, owner):
+    result = session.execute(
+        """INSERT INTO schema_lock (lock_name, owner, acquired_at) VALUES (%s, %s, %s)
+           IF NOT EXISTS USING TTL %s""",
+        [LOCK_NAME, owner, datetime.now(), LOCK_TTL]
+    )
+    return result.was_applied
+
+
+def renew_lock(session, owner):
+    """Extend the lease; False when it has lapsed and the lock is gone or someone else's."""
+    result = session.execute(
+        """UPDATE schema_lock USING TTL %s SET owner = %s, acquired_at = %s
+           WHERE lock_name = %s IF owner = %s""",
+        [LOCK_TTL, owner, datetime.now(), LOCK_NAME, owner]
+    )
+    return result.was_applied
+
+
+def lock_holder(session):
+    row = session.execute(
+        "SELECT owner FROM schema_lock WHERE lock_name = %s",
+        [LOCK_NAME]
+    ).one()
+    return row.owner if row else None
+
+
+def release_lock(session, owner):
+    session.execute(
+        "DELETE FROM schema_lock WHERE lock_name = %s IF owner = %s",
+        [LOCK_NAME, owner]
+    )
+
+
+def _owner():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LockLease:
+    """Renews the schema lock from a background thread while migrations run."""
+
+    def __init__(self, session, owner, interval=LOCK_RENEW_INTERVAL):
+        self.session = session
+        self.owner = owner
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='schema-lock-lease', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not renew_lock(self.session, self.owner):
+                    self.lost = True
+                    return
+            except Exception as e:
+                # The lease has LOCK_TTL to spare; try again next interval
+                print(f"Could not renew the schema lock: {e}")
+
+    def check(self):
+        if self.lost:
+            raise MigrationError("Lost the schema lock; another process may be migrating")
+
+
+# =============================================================================
+# COMMANDS
+# =============================================================================
+
+def pending_migrations(session, migrations):
+    try:
+        version = current_version(session)
+    except InvalidRequest:
+        version = 0
+    return [migration for migration in migrations if migration.version > version]
+
+
+def apply(session, keyspace, profile, migrations=None, wait_timeout=None):
+    """
+    Apply pending migrations under the schema lock, renewing its lease while
+    they run. If another process holds the lock, wait until it has brought the
+    schema to the latest version, or take over once its lease lapses.
+    wait_timeout caps that wait (None waits as long as the holder is alive).
+    Returns the migrations this process applied.
+    """
+    migrations = discover() if migrations is None else migrations
+    latest = migrations[-1].version if migrations else 0
+    ensure_keyspace(session, keyspace, profile)
+
+    owner = _owner()
+    deadline = None if wait_timeout is None else time.monotonic() + wait_timeout
+    while not acquire_lock(session, owner):
+        if current_version(session) >= latest:
+            return []
+        if deadline is not None and time.monotonic() > deadline:
+            raise MigrationError(f"Timed out waiting for the schema lock after {wait_timeout}s")
+        print(f"Schema migration in progress on {lock_holder(session) or 'another process'}, waiting...")
+        time.sleep(2)
+
+    applied = []
+    try:
+        with LockLease(session, owner) as lease:
+            for migration in pending_migrations(session, migrations):
+                lease.check()
+                print(f"Applying migration {migration!r}...")
+                migration.run(session)
+                _record(session, migration, owner)
+                applied.append(migration)
+    finally:
+        release_lock(session, owner)
+    return applied
+
+
+def dry_run(session, migrations=None):
+    migrations = discover() if migrations is None else migrations
+    pending = pending_migrations(session, migrations)
+    for migration in pending:
+        print(f"-- {migration!r} (checksum {migration.checksum})")
+        for statement in migration.statements:
+            print(statement + ";\n")
+        if getattr(migration.module, 'upgrade', None) is not None:
+            print(f"-- then runs {migration!r}.upgrade(session)\n")
+    return pending
+
+
+def verify(session, keyspace, migrations=None):
+    """Return a list of problems: checksum drift, unknown or missing versions, missing tables."""
+    migrations = discover() if migrations is None else migrations
+    problems = []
+    try:
+        applied = applied_migrations(session)
+    except InvalidRequest:
+        return ["schema_version table does not exist; run `python migrate.py apply`"]
+
+    on_disk = {migration.version: migration for migration in migrations}
+    for version, row in sorted(applied.items()):
+        migration = on_disk.get(version)
+        if migration is None:
+            problems.append(f"Applied version {version} ({row.name}) has no migration file")
+        elif migration.checksum != row.checksum:
+            problems.append(f"Migration {migration!r} changed after it was applied "
+                            f"({row.checksum} -> {migration.checksum})")
+    for version, migration in sorted(on_disk.items()):
+        if version not in applied:
+            problems.append(f"Migration {migration!r} is not applied")
+
+    tables = set(session.cluster.metadata.keyspaces[keyspace].tables) \
+        if keyspace in session.cluster.metadata.keyspaces else set()
+    for version, migration in sorted(on_disk.items()):
+        if version not in applied:
+            continue
+        for statement in migration.statements:
+            match = re.match(r'CREATE TABLE IF NOT EXISTS (\w+)', statement, re.IGNORECASE)
+            if match and match.group(1) not in tables:
+                problems.append(f"Table {match.group(1)} from {migration!r} is missing")
+    return problems
+
+
+def startup(session, keyspace, profile, apply_pending=True):
+    """
+    Fast startup check. When the schema is current this is a single read and
+    no DDL is issued. Otherwise pending migrations are applied (or, with
+    apply_pending=False, startup fails).
+    """
+    migrations = discover()
+    latest = migrations[-1].version if migrations else 0
+
+    try:
+        session.set_keyspace(keyspace)
+        version = current_version(session)
+    except InvalidRequest:
+        version = 0
+
+    if version == latest:
+        print(f"Schema is current (version {version})")
+        return
+    if version > latest:
+        raise MigrationError(f"Database schema version {version} is newer than this build ({latest})")
+    if not apply_pending:
+        raise MigrationError(f"Database schema version {version} is behind this build ({latest}); "
+                             f"run `python migrate.py apply`")
+
+    applied = apply(session, keyspace, profile, migrations)
+    print(f"Schema migrated to version {latest} ({len(applied)} migrations applied here)")
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv):
+    commands = ('status', 'dry-run', 'apply', 'verify')
+    if len(argv) != 1 or argv[0] not in commands:
+        print(__doc__)
+        return 2
+
+    keyspace = os.environ.get('CASSANDRA_KEYSPACE', 'dia_keyspace')
+    profile = cassandra_config.load_profile()
+    cluster = cassandra_config.build_cluster(profile)
+    session = cluster.connect()
+    try:
+        session.set_keyspace(keyspace)
+    except InvalidRequest:
+        pass
+
+    try:
+        command = argv[0]
+        migrations = discover()
+        if command == 'status':
+            try:
+                applied = applied_migrations(session)
+            except InvalidRequest:
+                applied = {}
+            for migration in migrations:
+                row = applied.get(migration.version)
+                state = f"applied {row.applied_at:%Y-%m-%d %H:%M} by {row.applied_by}" if row else "pending"
+                print(f"{migration!r:40} {state}")
+        elif command == 'dry-run':
+            if not dry_run(session, migrations):
+                print("Nothing to apply.")
+        elif command == 'apply':
+            applied = apply(session, keyspace, profile, migrations)
+            print(f"Applied {len(applied)} migrations." if applied else "Schema already current.")
+        elif command == 'verify':
+            problems = verify(session, keyspace, migrations)
+            for problem in problems:
+                print(f"PROBLEM: {problem}")
+            if problems:
+                return 1
+            print("Schema verified.")
+    except MigrationError as e:
+        print(f"Migration failed: {e}")
+        return 1
+    finally:
+        cluster.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,116 @@
+"""
+Initial schema: users, auth tokens, portfolios, transaction history,
+recurring deposit schedules and the spare change jar.
+
+Every statement uses IF NOT EXISTS so this also adopts databases created by
+the old init_database() bootstrap.
+"""
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id text PRIMARY KEY,
+            username text,
+            password_hash text,
+            risk_profile text,
+            created_at timestamp
+        )
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_username ON users (username)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS portfolios (
+            user_id text PRIMARY KEY,
+            total_value double,
+            fund_id text,
+            fund_name text,
+            invested_amount double,
+            last_24hr_change double
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS auth_tokens (
+            auth_token text PRIMARY KEY,
+            user_id text,
+            created_at timestamp
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id text,
+            user_id text,
+            type text,
+            amount double,
+            fund_id text,
+            created_at timestamp,
+            PRIMARY KEY (user_id, created_at, transaction_id)
+        ) WITH CLUSTERING ORDER BY (created_at DESC, transaction_id ASC)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS schedules (
+            user_id text,
+            schedule_id text,
+            amount double,
+            fund_id text,
+            frequency text,
+            day_of_month int,
+            next_run_at timestamp,
+            active boolean,
+            created_at timestamp,
+            PRIMARY KEY (user_id, schedule_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS schedule_due (
+            bucket bigint,
+            shard int,
+            due_at timestamp,
+            schedule_id text,
+            user_id text,
+            PRIMARY KEY ((bucket, shard), due_at, schedule_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS schedule_claims (
+            bucket bigint,
+            shard int,
+            owner text,
+            claimed_at timestamp,
+            done boolean,
+            PRIMARY KEY ((bucket, shard))
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS roundup_jars (
+            user_id text,
+            fund_id text,
+            pending_minor counter,
+            swipes counter,
+            PRIMARY KEY (user_id, fund_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS roundup_jar_index (
+            bucket bigint,
+            shard int,
+            user_id text,
+            PRIMARY KEY ((bucket, shard), user_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS roundup_sweep_claims (
+            bucket bigint,
+            shard int,
+            owner text,
+            claimed_at timestamp,
+            PRIMARY KEY ((bucket, shard))
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS roundup_jar_locks (
+            user_id text PRIMARY KEY,
+            owner text
+        )
+    """,
+]
@@ -0,0 +1,73 @@
+"""
+Multi-fund holdings.
+
+Adds the holdings table, clustered by fund inside each user's partition, with
+the portfolio-level columns kept as statics so a whole portfolio is one
+partition read. Existing single-fund portfolios rows are copied in; the
+portfolios table is left in place, unused, for rollback.
+"""
+
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS holdings (
+            user_id text,
+            fund_id text,
+            units double,
+            cost_basis double,
+            updated_at timestamp,
+            total_value double static,
+            last_24hr_change double static,
+            PRIMARY KEY (user_id, fund_id)
+        )
+    """,
+]
+
+# NAV per unit when the holdings model was introduced. Existing balances are
+# converted to units at these prices; later NAV changes do not affect this.
+NAV_AT_MIGRATION = {
+    "fund_001": 124.56,
+    "fund_002": 187.34,
+    "fund_003": 256.78,
+}
+
+PAGE_SIZE = 1000
+
+
+def upgrade(session):
+    insert_holding = session.prepare(
+        """INSERT INTO holdings (user_id, fund_id, units, cost_basis, total_value, last_24hr_change)
+           VALUES (?, ?, ?, ?, ?, ?)""")
+    insert_empty = session.prepare(
+        "INSERT INTO holdings (user_id, total_value, last_24hr_change) VALUES (?, ?, ?)")
+
+    def flush(holdings, empty):
+        execute_concurrent_with_args(session, insert_holding, holdings, concurrency=64)
+        execute_concurrent_with_args(session, insert_empty, empty, concurrency=64)
+
+    # Written a page at a time so memory stays flat however many portfolios there are
+    funded = unfunded = 0
+    holdings = []
+    empty = []
+    statement = SimpleStatement("SELECT * FROM portfolios", fetch_size=PAGE_SIZE)
+    for row in session.execute(statement):
+        total_value = row.total_value or 0.0
+        nav = NAV_AT_MIGRATION.get(row.fund_id)
+        if nav and total_value > 0:
+            holdings.append((row.user_id, row.fund_id, total_value / nav,
+                             row.invested_amount or 0.0, total_value, row.last_24hr_change or 0.0))
+        else:
+            empty.append((row.user_id, 0.0, row.last_24hr_change or 0.0))
+        if len(holdings) + len(empty) >= PAGE_SIZE:
+            flush(holdings, empty)
+            funded += len(holdings)
+            unfunded += len(empty)
+            holdings = []
+            empty = []
+
+    flush(holdings, empty)
+    funded += len(holdings)
+    unfunded += len(empty)
+    print(f"Migrated {funded} funded and {unfunded} empty portfolios into holdings")
@@ -0,0 +1,63 @@
+"""
+Fund catalog.
+
+Moves the fund list out of the code into the funds table. catalog_version
+holds one row per catalog; every change to funds bumps it, and API
+processes poll that single row to know when to reload. The three launch
+funds are seeded as version 1.
+"""
+
+from datetime import datetime
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS funds (
+            fund_id text PRIMARY KEY,
+            name text,
+            description text,
+            risk_level text,
+            sector text,
+            nav double,
+            annual_return_mock double,
+            volatility_mock double,
+            min_investment double,
+            updated_at timestamp
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            catalog text PRIMARY KEY,
+            version bigint,
+            updated_at timestamp
+        )
+    """,
+]
+
+# The catalog as it shipped in app.py before this migration
+SEED_FUNDS = [
+    ("fund_001", "Energy Transition Fund",
+     "A conservative fund focused on stable renewable energy infrastructure investments in the Caspian region.",
+     "Conservative", "Green Energy", 124.56, 6.5, 5.0, 10.0),
+    ("fund_002", "Balanced Green Fund",
+     "A diversified portfolio combining green energy assets with emerging ICT opportunities.",
+     "Moderate", "Mixed (Green + ICT)", 187.34, 9.2, 10.0, 10.0),
+    ("fund_003", "ICT Innovation Fund",
+     "An aggressive growth fund targeting cutting-edge technology startups and digital infrastructure.",
+     "Aggressive", "ICT & Technology", 256.78, 14.8, 22.0, 10.0),
+]
+
+
+def upgrade(session):
+    insert = session.prepare(
+        """INSERT INTO funds (fund_id, name, description, risk_level, sector, nav,
+                              annual_return_mock, volatility_mock, min_investment, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+           IF NOT EXISTS""")
+    now = datetime.now()
+    for fund in SEED_FUNDS:
+        session.execute(insert, fund + (now,))
+    session.execute(
+        "INSERT INTO catalog_version (catalog, version, updated_at) VALUES ('funds', 1, %s) IF NOT EXISTS",
+        [now]
+    )
+    print(f"Seeded {len(SEED_FUNDS)} funds into the catalog")
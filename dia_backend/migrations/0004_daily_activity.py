@@ -0,0 +1,33 @@
+"""
+Daily activity rollups.
+
+daily_activity holds counters per user, day, transaction type and fund,
+incremented by the write path from the moment this migration is applied.
+daily_activity_history holds the same figures for earlier transactions,
+written idempotently by `python rollups.py backfill`. Readers add the two.
+"""
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS daily_activity (
+            user_id text,
+            day date,
+            type text,
+            fund_id text,
+            count counter,
+            amount_minor counter,
+            PRIMARY KEY (user_id, day, type, fund_id)
+        ) WITH CLUSTERING ORDER BY (day DESC, type ASC, fund_id ASC)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS daily_activity_history (
+            user_id text,
+            day date,
+            type text,
+            fund_id text,
+            count bigint,
+            amount_minor bigint,
+            PRIMARY KEY (user_id, day, type, fund_id)
+        ) WITH CLUSTERING ORDER BY (day DESC, type ASC, fund_id ASC)
+    """,
+]
@@ -0,0 +1,51 @@
+"""
+Idempotent round-up jar sweeps.
+
+roundup_jar_sweeps keeps, per user and fund, the running total taken out of
+the jar plus the latest sweep. The jar counters are no longer decremented:
+what is pending is the counter minus swept_minor. applied_operations holds
+one row per sweep that reached the portfolio, written in the same logged
+batch as the position's units, so an interrupted sweep can tell whether its
+investment happened however many writes the position has had since.
+roundup_sweep_claims.done marks buckets whose users have all been swept.
+"""
+
+from cassandra import InvalidRequest
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS roundup_jar_sweeps (
+            user_id text,
+            fund_id text,
+            swept_minor bigint,
+            swept_swipes bigint,
+            sweep_id text,
+            sweep_minor bigint,
+            invested boolean,
+            PRIMARY KEY (user_id, fund_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS applied_operations (
+            user_id text,
+            operation_id text,
+            fund_id text,
+            applied_at timestamp,
+            PRIMARY KEY (user_id, operation_id)
+        )
+    """,
+]
+
+COLUMNS = [
+    ("roundup_sweep_claims", "done", "boolean"),
+]
+
+
+def upgrade(session):
+    for table, column, type in COLUMNS:
+        try:
+            session.execute(f"ALTER TABLE {table} ADD {column} {type}")
+        except InvalidRequest as e:
+            # Re-run after a partial apply: the column is already there
+            if 'conflicts with an existing column' not in str(e) and 'already exists' not in str(e):
+                raise
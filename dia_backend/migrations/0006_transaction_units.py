@@ -0,0 +1,18 @@
+"""
+Fund units on transaction rows.
+
+Money movements record the units they bought or sold next to the AZN
+amount, so reconciliation can check holdings units against the ledger
+without knowing historical NAVs. Rows written before this have no units.
+"""
+
+from cassandra import InvalidRequest
+
+
+def upgrade(session):
+    try:
+        session.execute("ALTER TABLE transactions ADD units double")
+    except InvalidRequest as e:
+        # Re-run after a partial apply: the column is already there
+        if 'conflicts with an existing column' not in str(e) and 'already exists' not in str(e):
+            raise
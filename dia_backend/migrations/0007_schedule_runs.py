@@ -0,0 +1,45 @@
+"""
+Schedule time zones and run tracking.
+
+schedules gains the IANA time zone its hour and minute are read in; rows
+without one keep running on UTC. schedule_runs records an occurrence from
+the moment its schedule is advanced until its deposit succeeds, so a failed
+or interrupted deposit is retried instead of skipped, and reported once it
+has used up its attempts. schedule_due.occurrence marks the jobs that retry
+such a run.
+"""
+
+from cassandra import InvalidRequest
+
+STATEMENTS = [
+    """
+        CREATE TABLE IF NOT EXISTS schedule_runs (
+            user_id text,
+            schedule_id text,
+            due_at timestamp,
+            run_id text,
+            attempts int,
+            status text,
+            error text,
+            updated_at timestamp,
+            PRIMARY KEY (user_id, schedule_id, due_at)
+        )
+    """,
+]
+
+COLUMNS = [
+    ("schedules", "timezone", "text"),
+    ("schedules", "hour", "int"),
+    ("schedules", "minute", "int"),
+    ("schedule_due", "occurrence", "timestamp"),
+]
+
+
+def upgrade(session):
+    for table, column, type in COLUMNS:
+        try:
+            session.execute(f"ALTER TABLE {table} ADD {column} {type}")
+        except InvalidRequest as e:
+            # Re-run after a partial apply: the column is already there
+            if 'conflicts with an existing column' not in str(e) and 'already exists' not in str(e):
+                raise
@@ -0,0 +1,314 @@
+"""
+DÍA - Bulk User Onboarding
+==========================
+Creates accounts in bulk from a partner bank's user file.
+
+The file (CSV with a `username,password,risk_profile` header, or NDJSON
+with the same keys; either may be gzipped) is streamed in batches. For each
+batch the pipeline:
+
+1. validates records and drops usernames already seen in this file
+   (in-memory set, no storage round trip)
+2. checks the remaining usernames against storage in one bulk lookup
+3. hashes passwords in parallel on a process pool (bcrypt is CPU-bound)
+4. writes users and their empty portfolios with bounded concurrent inserts
+5. checkpoints how many records are done
+
+User IDs are derived from the source file and record number, so a batch
+that was partly written before a crash is recognized on resume instead of
+being reported as taken usernames; recovered users whose portfolio was not
+written yet get an empty one. Rejected records are appended to a
+`.rejects.csv` file next to the checkpoint, which is cut back to the
+checkpoint on resume so a rerun batch does not list its rejects twice.
+
+Hashing workers are started with forkserver (spawn where that is not
+available): the API runs onboarding inside a process whose driver, journal
+and scheduler threads may hold locks that a forked child would inherit.
+
+Usage:
+    python onboarding.py users.csv [--checkpoint users.checkpoint] [--batch-size 1000]
+                                   [--workers N] [--concurrency 64] [--rounds 12]
+
+Storage is chosen with STORAGE_BACKEND like the API (cassandra or sqlite).
+Rerunning with the same checkpoint resumes where the last run stopped.
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import bcrypt
+
+VALID_RISK_PROFILES = ('Conservative', 'Moderate', 'Aggressive')
+
+
+def hash_password(password, rounds=12):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _hash_batch(passwords, rounds):
+    # Runs in a worker process: one task per slice keeps pickling overhead low
+    return [hash_password(password, rounds) for password in passwords]
+
+
+def read_records(path):
+    """Yield user dicts from a CSV or NDJSON file, optionally gzipped."""
+    opener = gzip.open if path.endswith('.gz') else open
+    name = path[:-3] if path.endswith('.gz') else path
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if name.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def source_fingerprint(path):
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}"
+
+
+def derived_user_id(source, index):
+    return "user_" + hashlib.sha1(f"{source}#{index}".encode('utf-8')).hexdigest()[:12]
+
+
+class BulkOnboarding:
+    def __init__(self, store, checkpoint_path, batch_size=1000, workers=None, concurrency=64,
+                 rounds=12, progress_interval=5.0, log=print):
+        self.store = store
+        self.checkpoint_path = checkpoint_path
+        self.rejects_path = os.path.splitext(checkpoint_path)[0] + '.rejects.csv'
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 2
+        self.concurrency = concurrency
+        self.rounds = rounds
+        self.progress_interval = progress_interval
+        self.log = log
+
+        self._stop = threading.Event()
+        self.state = None
+
+    # -------------------------------------------------------------------------
+    # Checkpoints
+    # -------------------------------------------------------------------------
+
+    def load_checkpoint(self, source):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            if state["source"] != source:
+                raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to {state['source']}, not {source}")
+            return state
+        return {
+            "source": source,
+            "records_done": 0,
+            "counts": {"created": 0, "recovered": 0, "duplicate_in_file": 0,
+                       "username_taken": 0, "invalid": 0, "failed": 0},
+            "finished": False,
+            "started_at": datetime.now().isoformat(),
+        }
+
+    def _save_checkpoint(self):
+        self.state["updated_at"] = datetime.now().isoformat()
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def _trim_rejects(self, records_done):
+        """Drop reject rows of records after the checkpoint; their batch is processed again."""
+        if not os.path.exists(self.rejects_path):
+            return
+        temporary = self.rejects_path + '.tmp'
+        with open(self.rejects_path, newline='') as source, open(temporary, 'w', newline='') as target:
+            writer = csv.writer(target)
+            for row in csv.reader(source):
+                if row and int(row[0]) < records_done:
+                    writer.writerow(row)
+        os.replace(temporary, self.rejects_path)
+
+    # -------------------------------------------------------------------------
+    # Pipeline
+    # -------------------------------------------------------------------------
+
+    def stop(self):
+        """Finish the current batch, checkpoint and return."""
+        self._stop.set()
+
+    def run(self, path):
+        source = source_fingerprint(path)
+        self.state = self.load_checkpoint(source)
+        if self.state["finished"]:
+            self.log(f"{path} was already onboarded: {self.state['counts']}")
+            return self.state
+
+        skip = self.state["records_done"]
+        if skip:
+            self.log(f"Resuming {path} after record {skip}")
+        self._trim_rejects(skip)
+
+        seen = set()
+        started = time.monotonic()
+        last_report = started
+        done_this_run = 0
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context()) as pool, \
+                open(self.rejects_path, 'a', newline='') as rejects_file:
+            batch = []
+            for index, record in enumerate(read_records(path)):
+                if index < skip:
+                    # Usernames from finished batches still count as seen in this file
+                    seen.add((record.get('username') or '').strip())
+                    continue
+                batch.append((index, record))
+                if len(batch) >= self.batch_size:
+                    self._process(batch, source, seen, pool, rejects_file)
+                    done_this_run += len(batch)
+                    batch = []
+                    if time.monotonic() - last_report >= self.progress_interval:
+                        last_report = time.monotonic()
+                        self._report(done_this_run, started)
+                    if self._stop.is_set():
+                        self.log("Stopped; rerun to resume from the checkpoint")
+                        return self.state
+            if batch:
+                self._process(batch, source, seen, pool, rejects_file)
+                done_this_run += len(batch)
+
+        self.state["finished"] = True
+        self._save_checkpoint()
+        self._report(done_this_run, started)
+        return self.state
+
+    def _process(self, batch, source, seen, pool, rejects_file):
+        counts = self.state["counts"]
+        rejects = csv.writer(rejects_file)
+        created_at = datetime.now()
+
+        # 1. Validate and dedupe inside the file
+        candidates = []
+        for index, record in batch:
+            username = (record.get('username') or '').strip()
+            password = record.get('password') or ''
+            risk_profile = (record.get('risk_profile') or 'Moderate').strip()
+            if not username or not password or risk_profile not in VALID_RISK_PROFILES:
+                counts["invalid"] += 1
+                rejects.writerow([index, username, "invalid record"])
+                continue
+            if username in seen:
+                counts["duplicate_in_file"] += 1
+                rejects.writerow([index, username, "duplicate username in file"])
+                continue
+            seen.add(username)
+            candidates.append((index, username, password, risk_profile))
+
+        # 2. One bulk lookup against storage
+        existing = self.store.existing_usernames([c[1] for c in candidates], self.concurrency) \
+            if candidates else {}
+        pending = []
+        recovered = []
+        for index, username, password, risk_profile in candidates:
+            user_id = derived_user_id(source, index)
+            owner = existing.get(username)
+            if owner == user_id:
+                # Written by an earlier run that crashed before its checkpoint
+                recovered.append(user_id)
+            elif owner is not None:
+                counts["username_taken"] += 1
+                rejects.writerow([index, username, "username already exists"])
+            else:
+                pending.append((index, user_id, username, password, risk_profile))
+
+        if recovered:
+            # The user and portfolio inserts are separate; finish the ones that lost the second
+            missing = [user_id for user_id in recovered if not self.store.get_holdings(user_id)["exists"]]
+            if missing:
+                self.store.create_portfolios(missing, self.concurrency)
+            counts["recovered"] += len(recovered)
+
+        # 3. Hash on the process pool, a slice per worker
+        if pending:
+            passwords = [p[3] for p in pending]
+            size = max(1, -(-len(passwords) // self.workers))
+            slices = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+            hashes = [h for part in pool.map(_hash_batch, slices, [self.rounds] * len(slices)) for h in part]
+
+            # 4. Bounded concurrent inserts
+            users = [(user_id, username, password_hash, risk_profile, created_at)
+                     for (_, user_id, username, _, risk_profile), password_hash in zip(pending, hashes)]
+            failed = self.store.create_users(users, self.concurrency)
+            for index, user_id, username, _, _ in pending:
+                if user_id in failed:
+                    counts["failed"] += 1
+                    rejects.writerow([index, username, failed[user_id]])
+                else:
+                    counts["created"] += 1
+
+        # 5. Everything up to the end of this batch is done; rejects are durable first
+        rejects_file.flush()
+        os.fsync(rejects_file.fileno())
+        self.state["records_done"] = batch[-1][0] + 1
+        self._save_checkpoint()
+
+    def _report(self, done_this_run, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.log(f"{self.state['records_done']} records processed "
+                 f"({done_this_run / elapsed:.0f}/s this run): {self.state['counts']}")
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def open_cli_store():
+    import storage
+
+    backend = os.environ.get('STORAGE_BACKEND', 'cassandra')
+    if backend == 'memory':
+        raise SystemExit("The memory backend is per process; use cassandra or sqlite for onboarding")
+    store = storage.open_store(backend)
+    if backend == 'cassandra':
+        import cassandra_config
+
+        cluster = cassandra_config.build_cluster(cassandra_config.load_profile())
+        session = cluster.connect(os.environ.get('CASSANDRA_KEYSPACE', 'dia_keyspace'))
+        store.attach(session)
+    return store
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Bulk-create user accounts from a partner file.")
+    parser.add_argument('path')
+    parser.add_argument('--checkpoint')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args(argv)
+
+    job = BulkOnboarding(open_cli_store(), args.checkpoint or args.path + '.checkpoint',
+                         batch_size=args.batch_size, workers=args.workers,
+                         concurrency=args.concurrency, rounds=args.rounds)
+    state = job.run(args.path)
+    return 0 if state["finished"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+"""
+DÍA - Portfolio Read Cache
+==========================
+Bounded LRU cache with a TTL for per-user portfolio state.
+
+Reads populate it; the money endpoints write the state they just persisted
+back into it (write-through), so a process always reads its own writes.
+
+A read takes `generation()` before it goes to storage and hands it to
+`put()`. Every update or invalidation of a user moves that user's
+generation forward, so a read that started before a write cannot put its
+older state over the newer one.
+
+With several worker processes, each one has its own cache. Writers can
+broadcast the user_id they changed to the other workers over UDP so those
+drop their copy; without broadcast, other workers may serve a value up to
+the TTL old.
+"""
+
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+
+class PortfolioCache:
+    def __init__(self, max_entries=10000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        # user_id -> generation of the last write; trimmed like the entries,
+        # with anything trimmed counted as changed at _changed_floor
+        self._changed = OrderedDict()
+        self._changed_floor = 0
+        self._broadcaster = None
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "updates": 0,
+            "invalidations": 0,
+            "remote_invalidations": 0,
+            "stale_puts": 0,
+        }
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires, value = entry
+            if expires < now:
+                del self._entries[user_id]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._stats["hits"] += 1
+            return value
+
+    def generation(self):
+        """Take before reading from storage; pass the result to put()."""
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id, value, generation):
+        """Cache a value read from storage, unless the user changed since `generation`."""
+        with self._lock:
+            if self._changed.get(user_id, self._changed_floor) > generation:
+                self._stats["stale_puts"] += 1
+                return
+            self._store(user_id, value)
+
+    def update(self, user_id, value):
+        """Write-through after a money movement; tells peers to drop their copy."""
+        with self._lock:
+            self._mark_changed(user_id)
+            self._store(user_id, value)
+            self._stats["updates"] += 1
+        if self._broadcaster is not None:
+            self._broadcaster.send(user_id)
+
+    def invalidate(self, user_id, broadcast=True):
+        with self._lock:
+            self._mark_changed(user_id)
+            self._entries.pop(user_id, None)
+            self._stats["invalidations"] += 1
+        if broadcast and self._broadcaster is not None:
+            self._broadcaster.send(user_id)
+
+    def _store(self, user_id, value):
+        self._entries[user_id] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _mark_changed(self, user_id):
+        self._generation += 1
+        self._changed[user_id] = self._generation
+        self._changed.move_to_end(user_id)
+        while len(self._changed) > self.max_entries:
+            _, self._changed_floor = self._changed.popitem(last=False)
+
+    def _remote_invalidate(self, user_id):
+        with self._lock:
+            self._mark_changed(user_id)
+            self._entries.pop(user_id, None)
+            self._stats["remote_invalidations"] += 1
+
+    def enable_broadcast(self, listen, peers):
+        """
+        listen: "host:port" to receive invalidations on.
+        peers:  ["host:port", ...] to send invalidations to.
+        """
+        self._broadcaster = InvalidationBroadcaster(listen, peers, self._remote_invalidate)
+        self._broadcaster.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["broadcast"] = self._broadcaster is not None
+        return stats
+
+
+def _address(value):
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+class InvalidationBroadcaster:
+    """Fire-and-forget UDP invalidations between worker processes."""
+
+    def __init__(self, listen, peers, on_invalidate):
+        self.listen = _address(listen)
+        self.peers = [_address(peer) for peer in peers if peer and peer != listen]
+        self.on_invalidate = on_invalidate
+        self._send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread = None
+
+    def start(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        receiver.bind(self.listen)
+        self._thread = threading.Thread(target=self._receive, args=(receiver,),
+                                        name='portfolio-cache-invalidations', daemon=True)
+        self._thread.start()
+
+    def send(self, user_id):
+        message = user_id.encode('utf-8')
+        for peer in self.peers:
+            try:
+                self._send_socket.sendto(message, peer)
+            except OSError:
+                # A lost invalidation only costs staleness up to the TTL
+                pass
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                message, _ = receiver.recvfrom(512)
+            except OSError:
+                return
+            self.on_invalidate(message.decode('utf-8', 'replace'))
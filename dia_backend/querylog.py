@@ -0,0 +1,240 @@
+"""
+DÍA - Slow Query Log
+====================
+Records Cassandra statements that exceed a latency threshold, and captures
+server-side traces for a sampled fraction of API requests.
+
+It hooks the driver with a request init listener, so every statement on
+the session is seen, whether it was issued by a request handler, the
+journal, the scheduler or the jar. Nothing on the request path blocks.
+The listener only adds a callback, and slow entries and trace fetches are
+handed to a background thread.
+
+Bound values are never recorded. A slow entry holds:
+
+- the statement template with string and numeric literals replaced by `?`
+- the parameter shape (column name and CQL type for prepared statements,
+  the placeholder count for simple ones)
+- latency, coordinator, retry count and the API endpoint that issued it
+
+Sampled requests run every statement with tracing on. Their trace events
+(with descriptions redacted the same way) are kept in a ring buffer.
+"""
+
+import contextvars
+import json
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from cassandra.query import BatchStatement, BoundStatement
+
+# Endpoint name and sampling decision for the request being served
+_request = contextvars.ContextVar('query_log_request', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\b[0-9a-f]{8}-[0-9a-f-]{27}\b", re.IGNORECASE)
+
+_STOP = object()
+
+
+def redact(cql):
+    """Statement text with string, numeric and UUID literals replaced by `?`."""
+    return _LITERALS.sub('?', ' '.join(cql.split()))
+
+
+def describe_statement(statement):
+    """(redacted statement text, parameter shape) for a driver statement."""
+    if isinstance(statement, BoundStatement):
+        prepared = statement.prepared_statement
+        shape = [f"{column.name} {column.type.typename}" for column in prepared.column_metadata or ()]
+        return redact(prepared.query_string), shape
+    if isinstance(statement, BatchStatement):
+        return f"BATCH ({len(statement._statements_and_parameters)} statements)", []
+    text = getattr(statement, 'query_string', str(statement))
+    return redact(text), ['?'] * text.count('%s')
+
+
+class QueryLog:
+    def __init__(self, threshold_ms=100.0, sample_rate=0.0, max_entries=500, max_traces=100,
+                 trace_wait=2.0, max_pending=1000):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.trace_wait = trace_wait
+
+        self._slow = deque(maxlen=max_entries)
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+        self._stats = {
+            "statements": 0,
+            "slow": 0,
+            "traced": 0,
+            "traces_fetched": 0,
+            "traces_failed": 0,
+            "dropped": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Request scope
+    # -------------------------------------------------------------------------
+
+    def begin_request(self, endpoint):
+        """Tag statements issued by this request and decide whether it is traced."""
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        return _request.set((endpoint, sampled))
+
+    def end_request(self, token):
+        _request.reset(token)
+
+    def init_app(self, app):
+        @app.before_request
+        def _begin():
+            from flask import g, request
+            g.query_log_token = self.begin_request(request.endpoint)
+
+        @app.teardown_request
+        def _end(exc):
+            from flask import g
+            token = g.pop('query_log_token', None)
+            if token is not None:
+                self.end_request(token)
+
+    # -------------------------------------------------------------------------
+    # Driver hook
+    # -------------------------------------------------------------------------
+
+    def attach(self, session):
+        session.add_request_init_listener(self._on_request)
+        self._thread = threading.Thread(target=self._run, name='query-log', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=2.0):
+        if self._thread is not None:
+            self._offer(_STOP)
+            self._thread.join(timeout)
+
+    def _on_request(self, future):
+        # Client thread, before the request is sent: keep this cheap
+        context = _request.get()
+        endpoint, sampled = context if context else (None, False)
+        if sampled:
+            future.message.tracing = True
+        started = time.perf_counter()
+        done = []
+
+        def finish(_):
+            # Paged results call back once per page; the first page is the latency that matters
+            if done:
+                return
+            done.append(True)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._stats["statements"] += 1
+            if elapsed >= self.threshold or sampled:
+                self._offer((future, endpoint, elapsed, sampled))
+
+        future.add_callbacks(finish, finish)
+
+    def _offer(self, item):
+        try:
+            self._pending.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+
+    # -------------------------------------------------------------------------
+    # Background recording
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is _STOP:
+                return
+            try:
+                self._record(*item)
+            except Exception as e:
+                print(f"Query log: failed to record statement: {e}")
+
+    def _record(self, future, endpoint, elapsed, sampled):
+        statement, shape = describe_statement(future.query)
+        coordinator = future.coordinator_host or (future.attempted_hosts[-1] if future.attempted_hosts else None)
+        entry = {
+            "statement": statement,
+            "parameters": shape,
+            "latency_ms": round(elapsed * 1000, 2),
+            "coordinator": str(coordinator) if coordinator else None,
+            "retries": getattr(future, '_query_retries', 0),
+            "endpoint": endpoint,
+            "at": time.time(),
+        }
+
+        if elapsed >= self.threshold:
+            with self._lock:
+                self._slow.append(entry)
+                self._stats["slow"] += 1
+            print(f"slow_query {json.dumps(entry)}")
+
+        if sampled:
+            with self._lock:
+                self._stats["traced"] += 1
+            self._fetch_trace(future, entry)
+
+    def _fetch_trace(self, future, entry):
+        try:
+            # Trace rows are written asynchronously by the server; this polls system_traces
+            trace = future.get_query_trace(max_wait=self.trace_wait)
+        except Exception:
+            trace = None
+        if trace is None:
+            with self._lock:
+                self._stats["traces_failed"] += 1
+            return
+
+        record = dict(entry)
+        record.update({
+            "trace_id": str(trace.trace_id),
+            "duration_us": trace.duration.total_seconds() * 1e6 if trace.duration else None,
+            "events": [
+                {
+                    "description": redact(event.description or ''),
+                    "source": str(event.source),
+                    "source_elapsed_us": event.source_elapsed.total_seconds() * 1e6 if event.source_elapsed else None,
+                    "thread": event.thread_name,
+                }
+                for event in trace.events
+            ],
+        })
+        with self._lock:
+            self._traces.append(record)
+            self._stats["traces_fetched"] += 1
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def slow_queries(self, limit=100, endpoint=None):
+        """Most recent slow statements first."""
+        with self._lock:
+            entries = list(self._slow)
+        entries = [e for e in reversed(entries) if endpoint is None or e["endpoint"] == endpoint]
+        return entries[:limit]
+
+    def traces(self, limit=20, endpoint=None):
+        with self._lock:
+            records = list(self._traces)
+        records = [r for r in reversed(records) if endpoint is None or r["endpoint"] == endpoint]
+        return records[:limit]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["threshold_ms"] = self.threshold * 1000
+        stats["sample_rate"] = self.sample_rate
+        stats["pending"] = self._pending.qsize()
+        return stats
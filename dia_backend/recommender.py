@@ -0,0 +1,204 @@
+"""
+DÍA - Fund Allocation Engine
+============================
+Mean-variance blends across the fund catalog, one per risk profile.
+
+From each fund's monthly return history the engine estimates annual
+expected returns and the covariance matrix, scores every long-only blend on
+a weight grid in one vectorized pass, and keeps the efficient frontier (the
+lowest-volatility blend for each level of return). A risk profile picks the
+frontier point that maximizes `return - risk_aversion / 2 * variance`.
+
+The work happens in `update(funds)`, which is cheap to call repeatedly: it
+fingerprints the catalog (funds, return assumptions, NAV, history) and only
+recomputes when that changes. Requests read the precomputed snapshot.
+
+Funds may carry a `return_history` list of monthly returns. Funds without
+one get a deterministic synthetic history from `annual_return_mock` and
+`volatility_mock`, driven by a shared market factor so the funds are
+correlated.
+"""
+
+import hashlib
+import itertools
+import json
+import math
+import threading
+import time
+import zlib
+
+import numpy as np
+
+RISK_AVERSION = {
+    "Conservative": 12.0,
+    "Moderate": 5.0,
+    "Aggressive": 1.5,
+}
+
+HISTORY_MONTHS = 60
+MARKET_CORRELATION = 0.6
+MARKET_SEED = 2024
+
+
+def synthetic_history(fund, months=HISTORY_MONTHS, market=None):
+    """Monthly returns with the fund's annual mean and volatility (both in percent)."""
+    mean = fund['annual_return_mock'] / 100 / 12
+    volatility = fund.get('volatility_mock', fund['annual_return_mock']) / 100 / math.sqrt(12)
+    if market is None:
+        market = np.random.default_rng(MARKET_SEED).standard_normal(months)
+    own = np.random.default_rng(zlib.crc32(fund['id'].encode('utf-8'))).standard_normal(months)
+    shocks = MARKET_CORRELATION * market + math.sqrt(1 - MARKET_CORRELATION ** 2) * own
+    # Standardize so the sample matches the stated assumptions exactly
+    shocks = (shocks - shocks.mean()) / shocks.std()
+    return mean + volatility * shocks
+
+
+def simplex_grid(n, max_points=200000):
+    """All long-only weight vectors on the finest grid with at most max_points rows."""
+    if n == 1:
+        return np.ones((1, 1))
+    steps = 100
+    while math.comb(steps + n - 1, n - 1) > max_points:
+        steps //= 2
+    # Stars and bars: each choice of n-1 dividers among steps+n-1 slots is one blend
+    dividers = np.array(list(itertools.combinations(range(steps + n - 1), n - 1)))
+    edges = np.hstack([np.full((len(dividers), 1), -1), dividers,
+                       np.full((len(dividers), 1), steps + n - 1)])
+    return (np.diff(edges, axis=1) - 1) / steps
+
+
+def efficient_frontier(mu, cov, grid):
+    """(weights, returns, volatilities) of the efficient blends, ordered by volatility."""
+    returns = grid @ mu
+    variances = np.einsum('ij,jk,ik->i', grid, cov, grid)
+    order = np.lexsort((-returns, variances))
+    # A blend is efficient when no less volatile blend returns as much
+    best_so_far = np.maximum.accumulate(returns[order])
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = returns[order][1:] > best_so_far[:-1]
+    efficient = order[keep]
+    return grid[efficient], returns[efficient], np.sqrt(np.maximum(variances[efficient], 0.0))
+
+
+class RecommendationEngine:
+    def __init__(self, risk_aversion=None, max_grid_points=200000, frontier_points=25):
+        self.risk_aversion = dict(risk_aversion or RISK_AVERSION)
+        self.max_grid_points = max_grid_points
+        self.frontier_points = frontier_points
+
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stats = {"recomputes": 0, "updates_skipped": 0, "last_compute_ms": 0.0}
+
+    def update(self, funds):
+        """Recompute the frontier if the catalog changed. Returns True when it did."""
+        fingerprint = self._fingerprint(funds)
+        with self._lock:
+            if self._snapshot is not None and self._snapshot["fingerprint"] == fingerprint:
+                self._stats["updates_skipped"] += 1
+                return False
+            started = time.perf_counter()
+            snapshot = self._compute(funds)
+            snapshot["fingerprint"] = fingerprint
+            # Readers hold a reference to the old snapshot, so a plain swap is safe
+            self._snapshot = snapshot
+            self._stats["recomputes"] += 1
+            self._stats["last_compute_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+    def allocation(self, risk_profile):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return snapshot["profiles"].get(risk_profile)
+
+    def allocations(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return {
+            "profiles": snapshot["profiles"],
+            "frontier": snapshot["frontier"],
+            "fund_statistics": snapshot["fund_statistics"],
+        }
+
+    def market(self):
+        """(fund_ids, annual mu, annual cov, fingerprint) behind the current snapshot."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return snapshot["fund_ids"], snapshot["mu"], snapshot["cov"], snapshot["fingerprint"]
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["funds"] = len(self._snapshot["fund_ids"]) if self._snapshot else 0
+        return stats
+
+    # -------------------------------------------------------------------------
+
+    def _fingerprint(self, funds):
+        relevant = [
+            [fund['id'], fund['annual_return_mock'], fund.get('volatility_mock'),
+             fund.get('nav'), fund.get('return_history')]
+            for fund in sorted(funds, key=lambda fund: fund['id'])
+        ]
+        encoded = json.dumps([relevant, self.risk_aversion], sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _compute(self, funds):
+        funds = sorted(funds, key=lambda fund: fund['id'])
+        fund_ids = [fund['id'] for fund in funds]
+
+        market = np.random.default_rng(MARKET_SEED).standard_normal(HISTORY_MONTHS)
+        histories = []
+        for fund in funds:
+            if fund.get('return_history'):
+                histories.append(np.asarray(fund['return_history'], dtype=float))
+            else:
+                histories.append(synthetic_history(fund, market=market))
+        # Align on the most recent months all funds have
+        months = min(len(history) for history in histories)
+        returns = np.vstack([history[-months:] for history in histories])
+
+        mu = returns.mean(axis=1) * 12
+        cov = np.atleast_2d(np.cov(returns)) * 12
+        weights, frontier_returns, frontier_vols = efficient_frontier(
+            mu, cov, simplex_grid(len(funds), self.max_grid_points))
+
+        profiles = {}
+        for profile, aversion in self.risk_aversion.items():
+            utility = frontier_returns - aversion / 2 * frontier_vols ** 2
+            best = int(np.argmax(utility))
+            profiles[profile] = self._describe(fund_ids, weights[best],
+                                               frontier_returns[best], frontier_vols[best])
+            profiles[profile]["risk_aversion"] = aversion
+
+        picks = np.unique(np.linspace(0, len(weights) - 1,
+                                      min(self.frontier_points, len(weights))).astype(int))
+        frontier = [self._describe(fund_ids, weights[i], frontier_returns[i], frontier_vols[i])
+                    for i in picks]
+
+        return {
+            "fund_ids": fund_ids,
+            "mu": mu,
+            "cov": cov,
+            "profiles": profiles,
+            "frontier": frontier,
+            "fund_statistics": [
+                {
+                    "fund_id": fund_id,
+                    "expected_annual_return": round(float(mu[i]) * 100, 2),
+                    "annual_volatility": round(math.sqrt(max(float(cov[i, i]), 0.0)) * 100, 2),
+                }
+                for i, fund_id in enumerate(fund_ids)
+            ],
+        }
+
+    @staticmethod
+    def _describe(fund_ids, weights, expected_return, volatility):
+        return {
+            "weights": {fund_id: round(float(weight), 4)
+                        for fund_id, weight in zip(fund_ids, weights) if weight > 0},
+            "expected_annual_return": round(float(expected_return) * 100, 2),
+            "annual_volatility": round(float(volatility) * 100, 2),
+        }
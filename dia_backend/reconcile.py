@@ -0,0 +1,351 @@
+"""
+DÍA - Portfolio Reconciliation
+==============================
+Finds holdings whose units have drifted from the transaction ledger.
+
+Each money movement updates a user's holdings with a read-modify-write and
+records a transaction row carrying the fund units it bought or sold. The
+portfolio value is always rebuilt from units at the current NAV, so units
+are the balance that matters, and the only one the ledger can vouch for
+(it does not record historical NAVs). This job recomputes each position as
+
+    ledger_units = sum(units of roundup/deposit rows) - sum(units of withdraw rows)
+
+per user and fund, and reports every position where it differs from the
+stored units by more than the tolerance. Positions with ledger rows written
+before transactions recorded units (migration 6) cannot be checked and are
+counted as legacy.
+
+Both tables are partitioned by user_id, so one token range holds complete
+users in each. The Murmur3 ring is split into `workers * ranges_per_worker`
+ranges, which are scanned with token-restricted paged queries on a process
+pool (one driver session per worker process). Users with a holdings or
+ledger write inside the grace window are skipped because the write-behind
+journal may not have flushed their latest rows yet.
+
+Completed ranges are checkpointed, and their discrepancies appended to the
+report, so an interrupted run resumes with the ranges it had not finished.
+
+Usage:
+    python reconcile.py run [--workers N] [--ranges-per-worker 8] [--report reconcile.ndjson]
+                            [--checkpoint reconcile.checkpoint] [--tolerance 1e-6] [--grace 300]
+                            [--repairs repairs.ndjson]
+    python reconcile.py apply repairs.ndjson   # set units to the ledger balance
+
+`apply` uses a conditional update on the units it observed, so a position
+that changed since the scan is left alone and reported. Repaired portfolios
+get their stored total revalued at the catalog NAVs.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+import cassandra_config
+
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+OUTFLOW_TYPES = ('withdraw',)
+FETCH_SIZE = 5000
+
+
+def token_ranges(count):
+    """Split the Murmur3 ring into `count` contiguous (start, end] ranges."""
+    span = (MAX_TOKEN - MIN_TOKEN) // count
+    bounds = [MIN_TOKEN + span * i for i in range(count)] + [MAX_TOKEN]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# =============================================================================
+# WORKER
+# =============================================================================
+
+# One cluster connection per worker process (the driver is not fork-safe)
+_session = None
+
+
+def _connect_worker(keyspace):
+    global _session
+    cluster = cassandra_config.build_cluster(cassandra_config.load_profile())
+    _session = cluster.connect(keyspace)
+
+
+def scan_range(index, start, end, tolerance, cutoff):
+    """Reconcile every user whose token falls in (start, end]. Runs in a worker process."""
+    started = time.perf_counter()
+    stored = {}
+    last_write = {}
+    holdings = SimpleStatement(
+        """SELECT user_id, fund_id, units, updated_at FROM holdings
+           WHERE token(user_id) > %s AND token(user_id) <= %s""",
+        fetch_size=FETCH_SIZE
+    )
+    for row in _session.execute(holdings, [start, end]):
+        # A partition with only static columns yields one row with no fund
+        if row.fund_id is not None:
+            stored[(row.user_id, row.fund_id)] = row.units or 0.0
+        if row.updated_at and (row.user_id not in last_write or row.updated_at > last_write[row.user_id]):
+            last_write[row.user_id] = row.updated_at
+
+    ledger = {}
+    counts = {}
+    legacy = set()
+    transactions = SimpleStatement(
+        """SELECT user_id, type, fund_id, units, created_at FROM transactions
+           WHERE token(user_id) > %s AND token(user_id) <= %s""",
+        fetch_size=FETCH_SIZE
+    )
+    for row in _session.execute(transactions, [start, end]):
+        key = (row.user_id, row.fund_id)
+        counts[key] = counts.get(key, 0) + 1
+        if row.units is None:
+            legacy.add(key)
+        else:
+            ledger[key] = ledger.get(key, 0.0) + (-row.units if row.type in OUTFLOW_TYPES else row.units)
+        if row.created_at and (row.user_id not in last_write or row.created_at > last_write[row.user_id]):
+            last_write[row.user_id] = row.created_at
+
+    discrepancies = []
+    skipped = 0
+    positions = stored.keys() | counts.keys()
+    for key in positions:
+        user_id, fund_id = key
+        if last_write.get(user_id) and last_write[user_id] >= cutoff:
+            skipped += 1
+            continue
+        if key in legacy:
+            continue
+        stored_units = stored.get(key)
+        ledger_units = ledger.get(key, 0.0)
+        if abs((stored_units or 0.0) - ledger_units) > tolerance:
+            discrepancies.append({
+                "range": index,
+                "user_id": user_id,
+                "fund_id": fund_id,
+                # None: ledger rows without a holding; otherwise the exact stored double for the conditional repair
+                "stored_units": stored_units,
+                "ledger_units": ledger_units,
+                "difference_units": (stored_units or 0.0) - ledger_units,
+                "transactions": counts.get(key, 0)
+            })
+
+    return index, discrepancies, {
+        "users": len({user_id for user_id, _ in positions}),
+        "positions": len(positions),
+        "transactions": sum(counts.values()),
+        "skipped_recent": skipped,
+        "legacy": len(legacy),
+        "seconds": time.perf_counter() - started
+    }
+
+
+# =============================================================================
+# COORDINATOR
+# =============================================================================
+
+class Reconciliation:
+    def __init__(self, keyspace, report_path, checkpoint_path, workers=None, ranges_per_worker=8,
+                 tolerance=1e-6, grace=300, log=print):
+        self.keyspace = keyspace
+        self.report_path = report_path
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers or os.cpu_count() or 2
+        self.ranges_per_worker = ranges_per_worker
+        self.tolerance = tolerance
+        self.grace = grace
+        self.log = log
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        return {
+            "ranges": self.workers * self.ranges_per_worker,
+            "done": [],
+            "totals": {"users": 0, "positions": 0, "transactions": 0, "skipped_recent": 0, "legacy": 0,
+                       "discrepancies": 0},
+            # Grace cutoff is fixed for the whole run, including resumes
+            "cutoff": (datetime.now() - timedelta(seconds=self.grace)).isoformat(),
+            "started_at": datetime.now().isoformat(),
+            "finished": False
+        }
+
+    def _save_checkpoint(self, state):
+        state["updated_at"] = datetime.now().isoformat()
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def _trim_report(self, done):
+        """Drop report lines from ranges that were not checkpointed before an interruption."""
+        if not os.path.exists(self.report_path):
+            return
+        temporary = self.report_path + '.tmp'
+        with open(self.report_path) as source, open(temporary, 'w') as target:
+            for line in source:
+                if line.strip() and json.loads(line)["range"] in done:
+                    target.write(line)
+        os.replace(temporary, self.report_path)
+
+    def run(self):
+        state = self.load_checkpoint()
+        if state["finished"]:
+            self.log(f"Already finished: {state['totals']}")
+            return state
+
+        ranges = token_ranges(state["ranges"])
+        done = set(state["done"])
+        self._trim_report(done)
+        pending = [(index, start, end) for index, (start, end) in enumerate(ranges) if index not in done]
+        if done:
+            self.log(f"Resuming: {len(done)}/{len(ranges)} ranges already reconciled")
+
+        cutoff = datetime.fromisoformat(state["cutoff"])
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_connect_worker,
+                                 initargs=(self.keyspace,)) as pool, \
+                open(self.report_path, 'a') as report:
+            futures = [pool.submit(scan_range, index, start, end, self.tolerance, cutoff)
+                       for index, start, end in pending]
+            for future in as_completed(futures):
+                index, discrepancies, stats = future.result()
+                for discrepancy in discrepancies:
+                    report.write(json.dumps(discrepancy) + '\n')
+                report.flush()
+                os.fsync(report.fileno())
+
+                # Report lines are durable before the range is marked done
+                state["done"].append(index)
+                for key in ("users", "positions", "transactions", "skipped_recent", "legacy"):
+                    state["totals"][key] += stats[key]
+                state["totals"]["discrepancies"] += len(discrepancies)
+                self._save_checkpoint(state)
+
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.log(f"{len(state['done'])}/{len(ranges)} ranges, "
+                         f"{state['totals']['users']} users ({state['totals']['users'] / elapsed:.0f}/s this run), "
+                         f"{state['totals']['discrepancies']} discrepancies")
+
+        state["finished"] = True
+        self._save_checkpoint(state)
+        return state
+
+
+def write_repairs(report_path, repairs_path):
+    """Repair set from a report: positions whose units should be set to the ledger balance."""
+    written = 0
+    with open(report_path) as report, open(repairs_path, 'w') as repairs:
+        for line in report:
+            discrepancy = json.loads(line)
+            if discrepancy["stored_units"] is None:
+                # No holding row at all: needs a look, not an automatic insert
+                continue
+            repairs.write(json.dumps({
+                "user_id": discrepancy["user_id"],
+                "fund_id": discrepancy["fund_id"],
+                "expected_units": discrepancy["stored_units"],
+                "units": discrepancy["ledger_units"]
+            }) + '\n')
+            written += 1
+    return written
+
+
+def revalue(session, user_ids, navs, concurrency=32):
+    """Rewrite each portfolio's stored total as units x NAV, unless it changed meanwhile."""
+    select = session.prepare("SELECT fund_id, units, total_value FROM holdings WHERE user_id = ?")
+    update = session.prepare("UPDATE holdings SET total_value = ? WHERE user_id = ? IF total_value = ?")
+    updates = []
+    for user_id in user_ids:
+        rows = list(session.execute(select, [user_id]))
+        if not rows:
+            continue
+        total = sum((row.units or 0.0) * navs.get(row.fund_id, 0.0) for row in rows if row.fund_id is not None)
+        updates.append((total, user_id, rows[0].total_value))
+    # A money movement since the read recomputed the total itself
+    execute_concurrent_with_args(session, update, updates, concurrency=concurrency, raise_on_first_error=False)
+
+
+def apply_repairs(session, repairs_path, concurrency=32):
+    """Conditionally set each position's units. Returns (applied, [(user_id, fund_id) that changed since the scan])."""
+    with open(repairs_path) as f:
+        repairs = [json.loads(line) for line in f if line.strip()]
+
+    # LWT on the units read by the scan: positions written since then keep their value
+    update = session.prepare("UPDATE holdings SET units = ? WHERE user_id = ? AND fund_id = ? IF units = ?")
+    results = execute_concurrent_with_args(
+        session, update,
+        [(repair["units"], repair["user_id"], repair["fund_id"], repair["expected_units"]) for repair in repairs],
+        concurrency=concurrency, raise_on_first_error=False
+    )
+    applied = 0
+    repaired_users = set()
+    conflicts = []
+    for repair, (success, result) in zip(repairs, results):
+        if success and result.was_applied:
+            applied += 1
+            repaired_users.add(repair["user_id"])
+        else:
+            conflicts.append((repair["user_id"], repair["fund_id"]))
+
+    if repaired_users:
+        navs = {row.fund_id: row.nav for row in session.execute("SELECT fund_id, nav FROM funds")}
+        revalue(session, repaired_users, navs, concurrency)
+    return applied, conflicts
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Reconcile portfolio totals against the transaction ledger.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run')
+    run.add_argument('--workers', type=int, default=None)
+    run.add_argument('--ranges-per-worker', type=int, default=8)
+    run.add_argument('--report', default='reconcile.ndjson')
+    run.add_argument('--checkpoint', default='reconcile.checkpoint')
+    run.add_argument('--tolerance', type=float, default=1e-6, help="allowed difference in fund units")
+    run.add_argument('--grace', type=int, default=300, help="skip users written in the last N seconds")
+    run.add_argument('--repairs', help="also write a repair set to this file")
+
+    apply = commands.add_parser('apply')
+    apply.add_argument('repairs')
+    args = parser.parse_args(argv)
+
+    keyspace = os.environ.get('CASSANDRA_KEYSPACE', 'dia_keyspace')
+    if args.command == 'run':
+        job = Reconciliation(keyspace, args.report, args.checkpoint, workers=args.workers,
+                             ranges_per_worker=args.ranges_per_worker, tolerance=args.tolerance,
+                             grace=args.grace)
+        state = job.run()
+        print(f"Reconciled: {state['totals']}")
+        if args.repairs:
+            print(f"Wrote {write_repairs(args.report, args.repairs)} repairs to {args.repairs}")
+        return 1 if state["totals"]["discrepancies"] else 0
+
+    cluster = cassandra_config.build_cluster(cassandra_config.load_profile())
+    try:
+        session = cluster.connect(keyspace)
+        applied, conflicts = apply_repairs(session, args.repairs)
+        print(f"Applied {applied} repairs")
+        for user_id, fund_id in conflicts:
+            print(f"SKIPPED: {user_id} {fund_id} changed since the scan or the update failed")
+    finally:
+        cluster.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,188 @@
+"""
+DÍA - Daily Activity Backfill
+=============================
+Fills the daily activity rollups for transactions written before the write
+path started counting them.
+
+With the cassandra backend, `add_transaction` increments the
+`daily_activity` counters from the moment migration 4 is applied. Earlier
+transactions are aggregated here, per user, day, type and fund, and written
+to `daily_activity_history`. Counters cannot be written idempotently, so
+history rows are plain upserts: rerunning the backfill rewrites the same
+values instead of adding them twice. Readers add the two tables.
+
+Only transactions created before the cutoff are aggregated. It defaults to
+the time migration 4 was recorded in schema_version; pass `--before` if the
+counting code was deployed later than the migration. The cutoff is stored
+in the checkpoint, so a resumed run uses the same one.
+
+The ring is scanned in token ranges (one range holds complete users), and
+finished ranges are checkpointed.
+
+With the sqlite backend the rollup table is rebuilt from the transactions
+table in one write transaction. The memory backend keeps its rollups
+in-process and needs no backfill.
+
+Usage:
+    python rollups.py backfill [--ranges 64] [--checkpoint rollups.checkpoint]
+                               [--before 2024-05-01T00:00:00] [--concurrency 64]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+import cassandra_config
+import migrate
+from reconcile import FETCH_SIZE, token_ranges
+from storage import open_store, to_minor
+
+ROLLUP_MIGRATION = 4
+
+
+def aggregate_range(session, start, end, cutoff):
+    """{(user_id, day, type, fund_id): [count, amount_minor]} for transactions in (start, end] before cutoff."""
+    rollups = {}
+    transactions = SimpleStatement(
+        """SELECT user_id, type, amount, fund_id, created_at FROM transactions
+           WHERE token(user_id) > %s AND token(user_id) <= %s""",
+        fetch_size=FETCH_SIZE
+    )
+    for row in session.execute(transactions, [start, end]):
+        if row.created_at is None or row.created_at >= cutoff:
+            continue
+        key = (row.user_id, row.created_at.date(), row.type, row.fund_id or '')
+        counts = rollups.setdefault(key, [0, 0])
+        counts[0] += 1
+        counts[1] += to_minor(row.amount)
+    return rollups
+
+
+class Backfill:
+    def __init__(self, session, checkpoint_path, ranges=64, before=None, concurrency=64, log=print):
+        self.session = session
+        self.checkpoint_path = checkpoint_path
+        self.ranges = ranges
+        self.before = before
+        self.concurrency = concurrency
+        self.log = log
+
+    def default_cutoff(self):
+        applied = migrate.applied_migrations(self.session).get(ROLLUP_MIGRATION)
+        if applied is None:
+            raise RuntimeError(f"Migration {ROLLUP_MIGRATION} is not applied; run `python migrate.py apply` first")
+        return applied.applied_at
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        return {
+            "ranges": self.ranges,
+            "done": [],
+            "totals": {"transactions": 0, "rows": 0},
+            "cutoff": (self.before or self.default_cutoff()).isoformat(),
+            "started_at": datetime.now().isoformat(),
+            "finished": False
+        }
+
+    def _save_checkpoint(self, state):
+        state["updated_at"] = datetime.now().isoformat()
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def run(self):
+        state = self.load_checkpoint()
+        if state["finished"]:
+            self.log(f"Already finished: {state['totals']}")
+            return state
+
+        ranges = token_ranges(state["ranges"])
+        done = set(state["done"])
+        if done:
+            self.log(f"Resuming: {len(done)}/{len(ranges)} ranges already backfilled")
+
+        cutoff = datetime.fromisoformat(state["cutoff"])
+        self.log(f"Backfilling transactions created before {cutoff.isoformat()}")
+        insert = self.session.prepare(
+            """INSERT INTO daily_activity_history (user_id, day, type, fund_id, count, amount_minor)
+               VALUES (?, ?, ?, ?, ?, ?)""")
+        started = time.monotonic()
+        for index, (start, end) in enumerate(ranges):
+            if index in done:
+                continue
+            rollups = aggregate_range(self.session, start, end, cutoff)
+            results = execute_concurrent_with_args(
+                self.session, insert,
+                [key + tuple(counts) for key, counts in rollups.items()],
+                concurrency=self.concurrency, raise_on_first_error=False
+            )
+            failed = [result for success, result in results if not success]
+            if failed:
+                # Leave the range unmarked; a rerun rewrites it
+                raise RuntimeError(f"Range {index}: {len(failed)} rollup writes failed, first: {failed[0]}")
+
+            state["done"].append(index)
+            state["totals"]["transactions"] += sum(counts[0] for counts in rollups.values())
+            state["totals"]["rows"] += len(rollups)
+            self._save_checkpoint(state)
+
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.log(f"{len(state['done'])}/{len(ranges)} ranges, "
+                     f"{state['totals']['transactions']} transactions "
+                     f"({state['totals']['transactions'] / elapsed:.0f}/s this run), "
+                     f"{state['totals']['rows']} rollup rows")
+
+        state["finished"] = True
+        self._save_checkpoint(state)
+        return state
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Backfill daily activity rollups from the transaction ledger.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backfill = commands.add_parser('backfill')
+    backfill.add_argument('--ranges', type=int, default=64)
+    backfill.add_argument('--checkpoint', default='rollups.checkpoint')
+    backfill.add_argument('--before', type=datetime.fromisoformat, default=None,
+                          help="aggregate transactions created before this time (default: when migration 4 ran)")
+    backfill.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    backend = os.environ.get('STORAGE_BACKEND', 'cassandra')
+    if backend != 'cassandra':
+        store = open_store(backend)
+        store.rebuild_activity()
+        print(f"Rebuilt daily activity rollups for the {backend} backend")
+        return 0
+
+    keyspace = os.environ.get('CASSANDRA_KEYSPACE', 'dia_keyspace')
+    cluster = cassandra_config.build_cluster(cassandra_config.load_profile())
+    try:
+        session = cluster.connect(keyspace)
+        job = Backfill(session, args.checkpoint, ranges=args.ranges, before=args.before,
+                       concurrency=args.concurrency)
+        state = job.run()
+        print(f"Backfilled: {state['totals']}")
+    finally:
+        cluster.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,372 @@
+"""
+DÍA - Round-Up Accumulation Buffer ("Spare Change Jar")
+=======================================================
+Card swipes add their round-up to a per-user jar instead of investing a few
+qəpik at a time. A jar is invested ("swept") when either
+
+- its total reaches the threshold (checked right after the swipe), or
+- the time window since a swipe has passed (background sweeper).
+
+Storage (Cassandra):
+- roundup_jars:         counters in minor units (qəpik), one partition per
+                        user, one row per fund; they only ever grow
+- roundup_jar_sweeps:   per user and fund, the total swept so far and the
+                        latest sweep; pending = counter - swept
+- roundup_jar_index:    (hour bucket, shard) -> users who swiped in that hour,
+                        so the sweeper only reads jars that can be due
+- roundup_sweep_claims: lease rows so one instance sweeps a given bucket,
+                        marked done once every user in it has been swept
+- roundup_jar_locks:    short LWT lock around a single user's sweep
+
+A swipe is two blind writes (counter + index) and two single-partition reads.
+Portfolio and transaction writes happen once per sweep.
+
+Sweeps are idempotent. Counter updates cannot be retried safely, so a sweep
+never decrements the jar. It first records the sweep (id and amount) with a
+conditional write on roundup_jar_sweeps, then invests with that sweep id,
+which is recorded in applied_operations together with the new units and used
+as the transaction id, and finally marks the sweep invested. A sweep
+interrupted in between is finished by the next one for that user: if its id
+is in applied_operations only the mark is written, otherwise the recorded
+amount is invested.
+"""
+
+import os
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MINOR_UNITS = 100
+
+
+def to_minor(amount):
+    return int(round(amount * MINOR_UNITS))
+
+
+def from_minor(minor):
+    return minor / MINOR_UNITS
+
+
+class RoundupJar:
+    def __init__(self, invest, threshold=5.0, window=86400, bucket_seconds=3600,
+                 shards=16, concurrency=16, poll_interval=30.0, catchup=86400,
+                 lock_seconds=30, claim_lease=600, instance_id=None):
+        """
+        invest(user_id, amount, fund_id, sweep_id) turns swept change into a
+        real investment and returns a tuple starting with (old_value,
+        new_value). It must record sweep_id in applied_operations in the
+        same write as the new units (see Store.update_holding).
+        """
+        self.invest = invest
+        self.threshold = threshold
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.shards = shards
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.catchup = catchup
+        self.lock_seconds = lock_seconds
+        self.claim_lease = claim_lease
+        self.instance_id = instance_id or f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._session = None
+        self._statements = {}
+        self._thread = None
+        self._stop = threading.Event()
+        # (bucket, shard) -> when to look at it again; inf once it is done
+        self._bucket_retry_at = {}
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "swipes": 0,
+            "threshold_sweeps": 0,
+            "window_sweeps": 0,
+            "swept_amount_minor": 0,
+            "lock_conflicts": 0,
+            "sweep_failures": 0,
+            "recovered_sweeps": 0,
+            "bucket_retries": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def attach(self, session):
+        self._session = session
+        prepare = session.prepare
+        self._statements = {
+            "add": prepare(
+                """UPDATE roundup_jars SET pending_minor = pending_minor + ?, swipes = swipes + 1
+                   WHERE user_id = ? AND fund_id = ?"""),
+            "select": prepare(
+                "SELECT fund_id, pending_minor, swipes FROM roundup_jars WHERE user_id = ?"),
+            "select_swept": prepare(
+                """SELECT fund_id, swept_minor, swept_swipes, sweep_id, sweep_minor, invested
+                   FROM roundup_jar_sweeps WHERE user_id = ?"""),
+            "first_sweep": prepare(
+                """INSERT INTO roundup_jar_sweeps (user_id, fund_id, swept_minor, swept_swipes,
+                                                   sweep_id, sweep_minor, invested)
+                   VALUES (?, ?, ?, ?, ?, ?, false) IF NOT EXISTS"""),
+            "next_sweep": prepare(
+                """UPDATE roundup_jar_sweeps SET swept_minor = ?, swept_swipes = ?, sweep_id = ?,
+                                                 sweep_minor = ?, invested = false
+                   WHERE user_id = ? AND fund_id = ? IF sweep_id = ?"""),
+            "invested": prepare(
+                """UPDATE roundup_jar_sweeps SET invested = true
+                   WHERE user_id = ? AND fund_id = ? IF sweep_id = ?"""),
+            "applied": prepare(
+                "SELECT operation_id FROM applied_operations WHERE user_id = ? AND operation_id = ?"),
+            "index": prepare(
+                "INSERT INTO roundup_jar_index (bucket, shard, user_id) VALUES (?, ?, ?)"),
+            "select_index": prepare(
+                "SELECT user_id FROM roundup_jar_index WHERE bucket = ? AND shard = ?"),
+            "lock": prepare(
+                """INSERT INTO roundup_jar_locks (user_id, owner) VALUES (?, ?)
+                   IF NOT EXISTS USING TTL ?"""),
+            "unlock": prepare(
+                "DELETE FROM roundup_jar_locks WHERE user_id = ? IF owner = ?"),
+            "claim": prepare(
+                """INSERT INTO roundup_sweep_claims (bucket, shard, owner, claimed_at, done)
+                   VALUES (?, ?, ?, ?, false) IF NOT EXISTS USING TTL ?"""),
+            "claim_done": prepare(
+                """INSERT INTO roundup_sweep_claims (bucket, shard, owner, claimed_at, done)
+                   VALUES (?, ?, ?, ?, true) USING TTL ?"""),
+        }
+
+    def start(self, session):
+        self.attach(session)
+        self._thread = threading.Thread(target=self._run, name='roundup-sweeper', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    # -------------------------------------------------------------------------
+    # Swipe path
+    # -------------------------------------------------------------------------
+
+    def add(self, user_id, amount, fund_id):
+        """
+        Drop a round-up into the jar. Sweeps immediately once the jar reaches
+        the threshold. Returns (jar, sweep) where sweep is None unless the
+        jar was invested by this call.
+
+        The round-up is counted before the sweep, so a failed sweep does not
+        fail the call: a client retry would count it twice. The sweep marker
+        lets the next sweep of this user pick it up.
+        """
+        minor = to_minor(amount)
+        self._session.execute(self._statements["add"], [minor, user_id, fund_id])
+        bucket = int(time.time()) // self.bucket_seconds
+        self._session.execute(self._statements["index"],
+                              [bucket, self._shard(user_id), user_id])
+        self._bump("swipes")
+
+        jar = self.pending(user_id)
+        sweep = None
+        if jar["pending_amount"] >= self.threshold:
+            _, sweep = self._sweep_quietly(user_id)
+            if sweep is not None:
+                self._bump("threshold_sweeps")
+                jar = self.pending(user_id)
+        return jar, sweep
+
+    def pending(self, user_id):
+        """Current jar contents: the user's counters minus what has been swept."""
+        swept = {row.fund_id: row for row in self._session.execute(self._statements["select_swept"], [user_id])}
+        funds = []
+        total_minor = 0
+        total_swipes = 0
+        for row in self._session.execute(self._statements["select"], [user_id]):
+            minor, swipes = self._due(row, swept.get(row.fund_id))
+            if minor <= 0:
+                continue
+            funds.append({
+                "fund_id": row.fund_id,
+                "pending_amount": from_minor(minor),
+                "swipes": swipes
+            })
+            total_minor += minor
+            total_swipes += swipes
+        return {
+            "pending_amount": from_minor(total_minor),
+            "swipes": total_swipes,
+            "funds": funds,
+            "threshold": self.threshold,
+            "window_seconds": self.window
+        }
+
+    # -------------------------------------------------------------------------
+    # Sweeping
+    # -------------------------------------------------------------------------
+
+    def sweep_user(self, user_id):
+        """
+        Invest everything in one user's jar. Returns a summary, or None when
+        another sweep holds the jar or there is nothing to invest.
+        """
+        locked = self._session.execute(self._statements["lock"],
+                                       [user_id, self.instance_id, self.lock_seconds])
+        if not locked.was_applied:
+            self._bump("lock_conflicts")
+            return None
+
+        try:
+            invested = []
+            old_value = new_value = None
+            swept = {row.fund_id: row for row in self._session.execute(self._statements["select_swept"], [user_id])}
+            for row in self._session.execute(self._statements["select"], [user_id]):
+                marker = swept.get(row.fund_id)
+                if marker is not None and not marker.invested:
+                    # A previous sweep stopped before it was marked invested
+                    result = self._finish(user_id, row.fund_id, marker.sweep_id, marker.sweep_minor)
+                    self._bump("recovered_sweeps")
+                    if result is not None:
+                        if old_value is None:
+                            old_value = result[0]
+                        new_value = result[1]
+                        invested.append({"fund_id": row.fund_id, "amount": from_minor(marker.sweep_minor),
+                                         "swipes": 0})
+
+                # Swipes that land during the sweep stay above swept_minor for the next one
+                minor, swipes = self._due(row, marker)
+                if minor <= 0:
+                    continue
+                sweep_id = f"sweep_{uuid.uuid4().hex[:12]}"
+                if not self._begin(user_id, row.fund_id, marker, minor, swipes, sweep_id):
+                    self._bump("lock_conflicts")
+                    continue
+                result = self._finish(user_id, row.fund_id, sweep_id, minor)
+                if old_value is None:
+                    old_value = result[0]
+                new_value = result[1]
+                invested.append({"fund_id": row.fund_id, "amount": from_minor(minor), "swipes": swipes})
+                self._bump("swept_amount_minor", minor)
+        finally:
+            self._session.execute(self._statements["unlock"], [user_id, self.instance_id])
+
+        if not invested:
+            return None
+        return {
+            "invested": invested,
+            "amount": sum(item["amount"] for item in invested),
+            "previous_value": old_value,
+            "new_total_value": new_value
+        }
+
+    @staticmethod
+    def _due(row, marker):
+        """(qəpik, swipes) in the jar for one fund: counters minus what has been swept."""
+        if marker is None:
+            return row.pending_minor or 0, row.swipes or 0
+        return ((row.pending_minor or 0) - (marker.swept_minor or 0),
+                (row.swipes or 0) - (marker.swept_swipes or 0))
+
+    def _begin(self, user_id, fund_id, marker, minor, swipes, sweep_id):
+        """Record a sweep of `minor` before investing it. False if another sweep got there first."""
+        if marker is None:
+            result = self._session.execute(self._statements["first_sweep"], [
+                user_id, fund_id, minor, swipes, sweep_id, minor
+            ])
+        else:
+            result = self._session.execute(self._statements["next_sweep"], [
+                (marker.swept_minor or 0) + minor, (marker.swept_swipes or 0) + swipes, sweep_id, minor,
+                user_id, fund_id, marker.sweep_id
+            ])
+        return result.was_applied
+
+    def _finish(self, user_id, fund_id, sweep_id, minor):
+        """Invest a recorded sweep unless it was already applied, then mark it invested."""
+        applied = self._session.execute(self._statements["applied"], [user_id, sweep_id]).one()
+        result = None
+        if applied is None:
+            result = self.invest(user_id, from_minor(minor), fund_id, sweep_id)
+        self._session.execute(self._statements["invested"], [user_id, fund_id, sweep_id])
+        return result
+
+    def _run(self):
+        executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                      thread_name_prefix='roundup-sweep')
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._sweep_due_buckets(executor)
+                except Exception as e:
+                    print(f"Round-up sweeper failed: {e}")
+                self._stop.wait(self.poll_interval)
+        finally:
+            executor.shutdown(wait=True)
+
+    def _sweep_due_buckets(self, executor):
+        now = time.time()
+        # A bucket is due once its last second is older than the window
+        last_due = int(now - self.window) // self.bucket_seconds - 1
+        first_due = int(now - self.window - self.catchup) // self.bucket_seconds
+        self._bucket_retry_at = {key: at for key, at in self._bucket_retry_at.items() if key[0] >= first_due}
+
+        for bucket in range(first_due, last_due + 1):
+            for shard in range(self.shards):
+                key = (bucket, shard)
+                if self._bucket_retry_at.get(key, 0) > now:
+                    continue
+                # The claim is a lease: if this instance dies or a user fails, it lapses and the bucket is retried
+                claimed = self._session.execute(self._statements["claim"], [
+                    bucket, shard, self.instance_id, datetime.utcnow(), self.claim_lease
+                ])
+                if not claimed.was_applied:
+                    done = claimed.one().done
+                    self._bucket_retry_at[key] = float('inf') if done else now + self.claim_lease
+                    continue
+                users = [row.user_id for row in
+                         self._session.execute(self._statements["select_index"], [bucket, shard])]
+                failed = 0
+                for ok, result in executor.map(self._sweep_quietly, users):
+                    if not ok:
+                        failed += 1
+                    elif result is not None:
+                        self._bump("window_sweeps")
+                if failed:
+                    self._bump("bucket_retries")
+                    self._bucket_retry_at[key] = now + self.claim_lease
+                    continue
+                self._session.execute(self._statements["claim_done"], [
+                    bucket, shard, self.instance_id, datetime.utcnow(), self.catchup * 2
+                ])
+                self._bucket_retry_at[key] = float('inf')
+
+    def _sweep_quietly(self, user_id):
+        """(ok, sweep summary or None)."""
+        try:
+            return True, self.sweep_user(user_id)
+        except Exception as e:
+            self._bump("sweep_failures")
+            print(f"Round-up sweep for {user_id} failed: {e}")
+            return False, None
+
+    def _shard(self, user_id):
+        return zlib.crc32(user_id.encode('utf-8')) % self.shards
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def _bump(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "threshold": self.threshold,
+            "window_seconds": self.window,
+        })
+        return stats
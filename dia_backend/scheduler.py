@@ -0,0 +1,735 @@
+"""
+DÍA - Recurring Auto-Invest Scheduler
+=====================================
+Runs scheduled deposits such as "invest 20 AZN every Monday".
+
+Storage (Cassandra):
+- schedules:        the user's schedules, one partition per user
+- schedule_due:     due jobs partitioned by (minute bucket, shard)
+- schedule_claims:  lease rows that decide which instance reads a
+                    (bucket, shard) partition
+
+Each instance polls the buckets from a short catch-up window behind "now" up
+to a small lookahead, claims unclaimed (bucket, shard) partitions with a
+lightweight transaction, pages their jobs into an in-process hierarchical
+timing wheel, and runs the jobs whose time has come a wheel slot at a time:
+the claims of a poll and the schedule reads, conditional advances and
+bookkeeping writes of a slot are issued concurrently (up to
+`io_concurrency` in flight), and only the deposits themselves go to a
+bounded worker pool.
+
+Before a job's deposit runs, its schedule row is advanced to the next run
+with a conditional update (`IF next_run_at = <due_at>`). Only the instance
+that wins that update executes the deposit, so several backends can run the
+scheduler at once and a bucket re-read after a lease expiry never pays twice.
+
+The winner then records the occurrence in schedule_runs together with a
+retry job, and deletes the run once its deposit succeeds. A deposit that
+fails, or never finishes because the instance died, is picked up by the
+retry job: it claims the next attempt with a conditional update on the
+attempt count, and skips the deposit if the run's id is already in
+applied_operations, which the deposit writes together with the new units. Runs that use up `max_attempts` stay in schedule_runs as failed
+and are listed with their schedule.
+
+Each schedule keeps the IANA time zone its hour and minute were given in,
+and later occurrences are computed on that zone's wall clock. Schedules
+created before time zones were stored run on UTC. All stored timestamps are
+naive UTC, matching how the driver stores them.
+"""
+
+import calendar
+import os
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+BUCKET_SECONDS = 60
+
+
+def epoch_seconds(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+def bucket_for(dt):
+    return int(epoch_seconds(dt)) // BUCKET_SECONDS
+
+
+def shard_for(schedule_id, shards):
+    return zlib.crc32(schedule_id.encode('utf-8')) % shards
+
+
+def _add_month(dt, day_of_month):
+    year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    last_day = calendar.monthrange(year, month)[1]
+    return dt.replace(year=year, month=month, day=min(day_of_month, last_day))
+
+
+def first_run(frequency, now, hour=9, minute=0, weekday=None, day_of_month=None):
+    """First occurrence strictly after `now` for a new schedule."""
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if frequency == 'daily':
+        if candidate <= now:
+            candidate += timedelta(days=1)
+    elif frequency == 'weekly':
+        weekday = now.weekday() if weekday is None else weekday
+        candidate += timedelta(days=(weekday - now.weekday()) % 7)
+        if candidate <= now:
+            candidate += timedelta(days=7)
+    elif frequency == 'monthly':
+        day_of_month = now.day if day_of_month is None else day_of_month
+        last_day = calendar.monthrange(now.year, now.month)[1]
+        candidate = candidate.replace(day=min(day_of_month, last_day))
+        if candidate <= now:
+            candidate = _add_month(candidate, day_of_month)
+    else:
+        raise ValueError(f"Invalid frequency '{frequency}'. Must be one of: {FREQUENCIES}")
+    return candidate
+
+
+def to_utc(local, zone):
+    """Naive wall-clock time in `zone` to naive UTC."""
+    return local.replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(utc, zone):
+    """Naive UTC to naive wall-clock time in `zone`."""
+    return utc.replace(tzinfo=timezone.utc).astimezone(zone).replace(tzinfo=None)
+
+
+def next_run(frequency, due_at, day_of_month=None, zone=None, hour=None, minute=None):
+    """
+    The occurrence after `due_at` (naive UTC). With a zone, the step is taken
+    on that zone's wall clock at `hour`:`minute`, so daylight saving changes
+    do not move the local time.
+    """
+    if zone is None:
+        return _step(frequency, due_at, day_of_month)
+    local = _step(frequency, to_local(due_at, zone), day_of_month)
+    if hour is not None:
+        local = local.replace(hour=hour, minute=minute or 0)
+    return to_utc(local, zone)
+
+
+def _step(frequency, dt, day_of_month):
+    if frequency == 'daily':
+        return dt + timedelta(days=1)
+    if frequency == 'weekly':
+        return dt + timedelta(days=7)
+    return _add_month(dt, day_of_month or dt.day)
+
+
+def schedule_zone(schedule):
+    """ZoneInfo for a schedule row; None for rows created before time zones were stored."""
+    return ZoneInfo(schedule.timezone) if schedule.timezone else None
+
+
+def schedule_day(schedule):
+    """
+    Day of month a monthly schedule runs on. Rows created without one ran
+    first on their creation day, so that is the day to keep after short months.
+    """
+    if schedule.frequency != 'monthly':
+        return None
+    if schedule.day_of_month is not None:
+        return schedule.day_of_month
+    created = schedule.created_at
+    zone = schedule_zone(schedule)
+    return (to_local(created, zone) if zone is not None else created).day
+
+
+# =============================================================================
+# TIMING WHEEL
+# =============================================================================
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel.
+
+    Level 0 has `slots[0]` slots of `tick` seconds each; every higher level's
+    slot spans one full revolution of the level below. Adding and expiring a
+    timer are O(1); timers in higher levels cascade down as time advances.
+    Timers beyond the top level's range wait in an overflow list.
+    """
+
+    def __init__(self, tick=1.0, slots=(60, 60, 24), now=None):
+        self.tick = tick
+        self.slots = slots
+        self.spans = []
+        span = 1
+        for count in slots:
+            self.spans.append(span)
+            span *= count
+        self.horizon = span
+        self.levels = [[[] for _ in range(count)] for count in slots]
+        self.overflow = []
+        self.current = int((time.time() if now is None else now) / tick)
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def add(self, when, item):
+        """Schedule `item` at epoch seconds `when`. Returns False if already due."""
+        target = int(when / self.tick)
+        with self._lock:
+            if target <= self.current:
+                return False
+            self._place(target, item)
+            self.size += 1
+            return True
+
+    def _place(self, target, item):
+        delta = target - self.current
+        for level, span in enumerate(self.spans):
+            if delta < span * self.slots[level]:
+                index = (target // span) % self.slots[level]
+                self.levels[level][index].append((target, item))
+                return
+        self.overflow.append((target, item))
+
+    def advance(self, now):
+        """Move the wheel to epoch seconds `now` and return the expired items."""
+        target = int(now / self.tick)
+        expired = []
+        with self._lock:
+            while self.current < target:
+                self.current += 1
+                self._cascade()
+                slot = self.levels[0][self.current % self.slots[0]]
+                if slot:
+                    expired.extend(item for _, item in slot)
+                    slot.clear()
+            self.size -= len(expired)
+        return expired
+
+    def _cascade(self):
+        for level in range(1, len(self.slots)):
+            if self.current % self.spans[level]:
+                break
+            index = (self.current // self.spans[level]) % self.slots[level]
+            entries = self.levels[level][index]
+            self.levels[level][index] = []
+            for target, item in entries:
+                self._place(target, item)
+        else:
+            if self.overflow and self.current % self.horizon == 0:
+                entries, self.overflow = self.overflow, []
+                for target, item in entries:
+                    self._place(target, item)
+
+    def __len__(self):
+        return self.size
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class Scheduler:
+    def __init__(self, execute_deposit, shards=16, concurrency=64, poll_interval=1.0,
+                 lookahead=120, catchup=3600, lease_seconds=300, fetch_size=5000,
+                 max_attempts=3, retry_delay=300, io_concurrency=256, instance_id=None):
+        """
+        execute_deposit(user_id, amount, fund_id, run_id) performs one deposit
+        and raises on failure. It must record run_id in applied_operations in
+        the same write as the units (see Store.update_holding), which is how a
+        retry tells that an interrupted deposit already happened.
+        """
+        self.execute_deposit = execute_deposit
+        self.shards = shards
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lookahead = lookahead
+        self.catchup = catchup
+        self.lease_seconds = lease_seconds
+        self.fetch_size = fetch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.io_concurrency = io_concurrency
+        self.instance_id = instance_id or f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self.wheel = TimingWheel(tick=1.0)
+        self._session = None
+        self._statements = {}
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._thread = None
+        self._stop = threading.Event()
+
+        # (bucket, shard) -> retry-after epoch for claims lost to another instance
+        self._lost_claims = {}
+        self._won_claims = set()
+        # (bucket, shard) -> number of jobs loaded but not yet finished
+        self._outstanding = {}
+        # Partitions with a job that failed before its schedule advanced: left
+        # unfinished so they are claimed and read again once the lease lapses
+        self._reopen = set()
+        self._outstanding_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "claims_won": 0,
+            "claims_lost": 0,
+            "jobs_loaded": 0,
+            "jobs_executed": 0,
+            "jobs_skipped": 0,
+            "jobs_failed": 0,
+            "retries": 0,
+            "runs_recovered": 0,
+            "runs_failed": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def attach(self, session):
+        """Prepare statements so schedules can be managed without running the poller."""
+        self._session = session
+        prepare = session.prepare
+        self._statements = {
+            "insert_schedule": prepare(
+                """INSERT INTO schedules (user_id, schedule_id, amount, fund_id, frequency,
+                   day_of_month, timezone, hour, minute, next_run_at, active, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""),
+            "insert_due": prepare(
+                """INSERT INTO schedule_due (bucket, shard, due_at, schedule_id, user_id, occurrence)
+                   VALUES (?, ?, ?, ?, ?, ?)"""),
+            "delete_due": prepare(
+                "DELETE FROM schedule_due WHERE bucket = ? AND shard = ? AND due_at = ? AND schedule_id = ?"),
+            "select_due": prepare(
+                """SELECT due_at, schedule_id, user_id, occurrence FROM schedule_due
+                   WHERE bucket = ? AND shard = ?"""),
+            "select_schedule": prepare(
+                "SELECT * FROM schedules WHERE user_id = ? AND schedule_id = ?"),
+            "select_user_schedules": prepare(
+                "SELECT * FROM schedules WHERE user_id = ?"),
+            "cancel_schedule": prepare(
+                "UPDATE schedules SET active = false WHERE user_id = ? AND schedule_id = ? IF EXISTS"),
+            "advance_schedule": prepare(
+                """UPDATE schedules SET next_run_at = ? WHERE user_id = ? AND schedule_id = ?
+                   IF next_run_at = ? AND active = true"""),
+            "insert_run": prepare(
+                """INSERT INTO schedule_runs (user_id, schedule_id, due_at, run_id, attempts, status, updated_at)
+                   VALUES (?, ?, ?, ?, 1, 'pending', ?)"""),
+            "select_run": prepare(
+                "SELECT * FROM schedule_runs WHERE user_id = ? AND schedule_id = ? AND due_at = ?"),
+            "select_user_runs": prepare(
+                "SELECT schedule_id, due_at, attempts, status FROM schedule_runs WHERE user_id = ?"),
+            "claim_attempt": prepare(
+                """UPDATE schedule_runs SET attempts = ?, updated_at = ?
+                   WHERE user_id = ? AND schedule_id = ? AND due_at = ?
+                   IF attempts = ? AND status = 'pending'"""),
+            "fail_attempt": prepare(
+                """UPDATE schedule_runs SET status = ?, error = ?, updated_at = ?
+                   WHERE user_id = ? AND schedule_id = ? AND due_at = ?"""),
+            "delete_run": prepare(
+                "DELETE FROM schedule_runs WHERE user_id = ? AND schedule_id = ? AND due_at = ?"),
+            "applied": prepare(
+                "SELECT operation_id FROM applied_operations WHERE user_id = ? AND operation_id = ?"),
+            "claim": prepare(
+                """INSERT INTO schedule_claims (bucket, shard, owner, claimed_at, done)
+                   VALUES (?, ?, ?, ?, false) IF NOT EXISTS USING TTL ?"""),
+            "finish_claim": prepare(
+                """UPDATE schedule_claims USING TTL ? SET done = true
+                   WHERE bucket = ? AND shard = ?"""),
+        }
+
+    def start(self, session):
+        self.attach(session)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                            thread_name_prefix='scheduler-worker')
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+    # -------------------------------------------------------------------------
+    # Schedule management (called from request handlers)
+    # -------------------------------------------------------------------------
+
+    def create(self, user_id, amount, fund_id, frequency, hour=9, minute=0,
+               weekday=None, day_of_month=None, time_zone='UTC'):
+        """hour, minute, weekday and day_of_month are read on `time_zone`'s wall clock."""
+        zone = ZoneInfo(time_zone)
+        now = datetime.utcnow()
+        local_now = to_local(now, zone)
+        if frequency == 'monthly' and day_of_month is None:
+            # Stored, so a schedule started on the 31st is not pulled to the 28th by February
+            day_of_month = local_now.day
+        due_at = to_utc(first_run(frequency, local_now, hour, minute, weekday, day_of_month), zone)
+        # Partitions inside the lookahead may already have been read by an
+        # instance; start from the first occurrence that cannot have been.
+        while due_at < now + timedelta(seconds=self.lookahead + BUCKET_SECONDS):
+            due_at = next_run(frequency, due_at, day_of_month, zone, hour, minute)
+        schedule_id = f"sched_{uuid.uuid4().hex[:12]}"
+        self._session.execute(self._statements["insert_schedule"], [
+            user_id, schedule_id, amount, fund_id, frequency,
+            day_of_month if frequency == 'monthly' else None, time_zone, hour, minute,
+            due_at, True, now
+        ])
+        self._enqueue_due(schedule_id, user_id, due_at)
+        return {
+            "schedule_id": schedule_id,
+            "amount": amount,
+            "fund_id": fund_id,
+            "frequency": frequency,
+            "timezone": time_zone,
+            "next_run_at": due_at.isoformat() + "Z",
+            "active": True,
+            "failed_runs": []
+        }
+
+    def list_for_user(self, user_id):
+        """The user's schedules, each with the occurrences whose deposit ran out of attempts."""
+        failed_runs = {}
+        for run in self._session.execute(self._statements["select_user_runs"], [user_id]):
+            if run.status == 'failed':
+                failed_runs.setdefault(run.schedule_id, []).append({
+                    "due_at": run.due_at.isoformat() + "Z",
+                    "attempts": run.attempts
+                })
+        rows = self._session.execute(self._statements["select_user_schedules"], [user_id])
+        return [{
+            "schedule_id": row.schedule_id,
+            "amount": row.amount,
+            "fund_id": row.fund_id,
+            "frequency": row.frequency,
+            "timezone": row.timezone or 'UTC',
+            "next_run_at": row.next_run_at.isoformat() + "Z" if row.next_run_at else None,
+            "active": row.active,
+            "failed_runs": failed_runs.get(row.schedule_id, [])
+        } for row in rows]
+
+    def cancel(self, user_id, schedule_id):
+        """Deactivate a schedule. Returns False if it does not exist."""
+        result = self._session.execute(self._statements["cancel_schedule"],
+                                       [user_id, schedule_id])
+        return result.was_applied
+
+    def _enqueue_due(self, schedule_id, user_id, due_at, occurrence=None):
+        self._session.execute(self._statements["insert_due"], [
+            bucket_for(due_at), shard_for(schedule_id, self.shards), due_at, schedule_id, user_id,
+            occurrence
+        ])
+
+    def _retry_delay(self):
+        # Like create(): past the partitions an instance may already have read
+        return max(self.retry_delay, self.lookahead + BUCKET_SECONDS)
+
+    def _enqueue_retry(self, schedule_id, user_id, occurrence):
+        retry_at = datetime.utcnow() + timedelta(seconds=self._retry_delay())
+        self._enqueue_due(schedule_id, user_id, retry_at, occurrence)
+
+    # -------------------------------------------------------------------------
+    # Poll loop
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Scheduler poll failed: {e}")
+            self._dispatch(self.wheel.advance(time.time()))
+            self._stop.wait(self.poll_interval)
+
+    def _poll(self):
+        now = time.time()
+        first_bucket = int(now - self.catchup) // BUCKET_SECONDS
+        last_bucket = int(now + self.lookahead) // BUCKET_SECONDS
+
+        # Forget claims that have fallen out of the catch-up window
+        self._won_claims = {key for key in self._won_claims if key[0] >= first_bucket}
+        self._lost_claims = {key: retry for key, retry in self._lost_claims.items()
+                             if key[0] >= first_bucket}
+        with self._outstanding_lock:
+            reopen, self._reopen = self._reopen, set()
+        for key in reopen:
+            self._won_claims.discard(key)
+            self._lost_claims[key] = now + self.lease_seconds
+
+        keys = [(bucket, shard)
+                for bucket in range(first_bucket, last_bucket + 1)
+                for shard in range(self.shards)
+                if (bucket, shard) not in self._won_claims and self._lost_claims.get((bucket, shard), 0) <= now]
+        for key, claim in zip(keys, self._claim_all(keys)):
+            if claim == 'won':
+                self._won_claims.add(key)
+                self._lost_claims.pop(key, None)
+                self._load_partition(*key)
+            elif claim == 'done':
+                self._lost_claims[key] = float('inf')
+            else:
+                # Re-try once the other instance's lease could have expired
+                self._lost_claims[key] = now + self.lease_seconds
+
+        with self._outstanding_lock:
+            pending = list(self._outstanding)
+        for bucket, shard in pending:
+            self._maybe_finish(bucket, shard)
+
+    def _claim_all(self, keys):
+        """'won', 'done' or 'lost' for each (bucket, shard), claimed concurrently."""
+        claimed_at = datetime.utcnow()
+        results = execute_concurrent_with_args(
+            self._session, self._statements["claim"],
+            [(bucket, shard, self.instance_id, claimed_at, self.lease_seconds) for bucket, shard in keys],
+            concurrency=self.io_concurrency, raise_on_first_error=False
+        )
+        claims = []
+        for success, result in results:
+            if not success:
+                print(f"Scheduler claim failed: {result}")
+                claims.append('lost')
+            elif result.was_applied:
+                self._bump("claims_won")
+                claims.append('won')
+            else:
+                self._bump("claims_lost")
+                existing = result.one()
+                claims.append('done' if existing is not None and getattr(existing, 'done', False) else 'lost')
+        return claims
+
+    def _load_partition(self, bucket, shard):
+        statement = self._statements["select_due"].bind([bucket, shard])
+        statement.fetch_size = self.fetch_size
+        with self._outstanding_lock:
+            self._outstanding[(bucket, shard)] = 0
+
+        for row in self._session.execute(statement):
+            self._load_job(bucket, shard, row.due_at, row.schedule_id, row.user_id, row.occurrence)
+
+        self._maybe_finish(bucket, shard)
+
+    def _load_job(self, bucket, shard, due_at, schedule_id, user_id, occurrence=None):
+        job = (bucket, shard, due_at, schedule_id, user_id, occurrence)
+        with self._outstanding_lock:
+            self._outstanding[(bucket, shard)] = self._outstanding.get((bucket, shard), 0) + 1
+        self._bump("jobs_loaded")
+        if not self.wheel.add(epoch_seconds(due_at), job):
+            # Already due (catch-up); run on the next dispatch
+            self._dispatch([job])
+
+    # -------------------------------------------------------------------------
+    # Execution
+    # -------------------------------------------------------------------------
+
+    def _dispatch(self, jobs):
+        runs = [job for job in jobs if job[5] is None]
+        for start in range(0, len(runs), self.io_concurrency * 4):
+            self._execute_batch(runs[start:start + self.io_concurrency * 4])
+        for job in jobs:
+            if job[5] is not None:
+                self._submit(self._run_retry, job)
+
+    def _submit(self, fn, *args):
+        # Blocks the poll loop when all workers are busy, which is the
+        # backpressure we want: no unbounded executor queue.
+        self._slots.acquire()
+        self._executor.submit(fn, *args)
+
+    def _concurrent(self, statements):
+        """[(success, result)] for [(statement, params)], io_concurrency in flight."""
+        if not statements:
+            return []
+        return execute_concurrent(self._session, statements, concurrency=self.io_concurrency,
+                                  raise_on_first_error=False)
+
+    def _execute_batch(self, jobs):
+        """Advance the schedules of a slot's due jobs together, then hand the deposits to the pool."""
+        reads = self._concurrent([(self._statements["select_schedule"], (job[4], job[3])) for job in jobs])
+        writes = []
+        done = []
+        advancing = []
+        for job, (success, result) in zip(jobs, reads):
+            bucket, shard, due_at, schedule_id, user_id, _ = job
+            if not success:
+                self._job_failed(job, result)
+                continue
+            schedule = result.one()
+            if not schedule or not schedule.active or schedule.next_run_at != due_at:
+                # Cancelled, or already handled by another instance
+                writes.append((self._statements["delete_due"], (bucket, shard, due_at, schedule_id)))
+                done.append(job)
+                self._bump("jobs_skipped")
+                continue
+            following = next_run(schedule.frequency, due_at, schedule_day(schedule),
+                                 schedule_zone(schedule), schedule.hour, schedule.minute)
+            advancing.append((job, schedule, following))
+
+        advances = self._concurrent([
+            (self._statements["advance_schedule"], (following, job[4], job[3], job[2]))
+            for job, _, following in advancing
+        ])
+        won = []
+        now = datetime.utcnow()
+        retry_at = now + timedelta(seconds=self._retry_delay())
+        for (job, schedule, following), (success, result) in zip(advancing, advances):
+            bucket, shard, due_at, schedule_id, user_id, _ = job
+            if not success:
+                self._job_failed(job, result)
+                continue
+            if not result.was_applied:
+                done.append(job)
+                self._bump("jobs_skipped")
+                continue
+            # Record the run and its retry before paying, so neither a failed
+            # deposit nor a crash loses the occurrence
+            run_id = f"run_{uuid.uuid4().hex[:12]}"
+            writes.extend([
+                (self._statements["insert_run"], (user_id, schedule_id, due_at, run_id, now)),
+                (self._statements["insert_due"], (bucket_for(retry_at), shard_for(schedule_id, self.shards),
+                                                  retry_at, schedule_id, user_id, due_at)),
+                (self._statements["insert_due"], (bucket_for(following), shard_for(schedule_id, self.shards),
+                                                  following, schedule_id, user_id, None)),
+                (self._statements["delete_due"], (bucket, shard, due_at, schedule_id)),
+            ])
+            won.append((job, schedule, run_id))
+
+        for (statement, params), (success, result) in zip(writes, self._concurrent(writes)):
+            if not success:
+                # The schedule has advanced, so the deposit still goes ahead
+                print(f"Scheduler bookkeeping write for {params} failed: {result}")
+        for job in done:
+            self._job_done(job)
+        for job, schedule, run_id in won:
+            self._submit(self._run_deposit, job, schedule, run_id)
+
+    def _run_deposit(self, job, schedule, run_id):
+        try:
+            self._deposit(schedule, job[2], run_id, 1)
+        except Exception as e:
+            self._bump("jobs_failed")
+            print(f"Scheduled deposit {job[3]} for {job[4]} failed: {e}")
+        finally:
+            self._slots.release()
+            self._job_done(job)
+
+    def _run_retry(self, job):
+        bucket, shard, due_at, schedule_id, user_id, occurrence = job
+        try:
+            self._retry(bucket, shard, due_at, schedule_id, user_id, occurrence)
+        except Exception as e:
+            self._bump("jobs_failed")
+            print(f"Scheduled deposit {schedule_id} for {user_id} failed: {e}")
+        finally:
+            self._slots.release()
+            self._job_done(job)
+
+    def _job_failed(self, job, error):
+        """A job that failed before its schedule advanced; its partition is read again later."""
+        self._bump("jobs_failed")
+        print(f"Scheduled deposit {job[3]} for {job[4]} failed: {error}")
+        with self._outstanding_lock:
+            self._reopen.add((job[0], job[1]))
+        self._job_done(job)
+
+    def _job_done(self, job):
+        bucket, shard = job[0], job[1]
+        with self._outstanding_lock:
+            self._outstanding[(bucket, shard)] -= 1
+        self._maybe_finish(bucket, shard)
+
+    def _retry(self, bucket, shard, retry_at, schedule_id, user_id, due_at):
+        """Run the next attempt of the occurrence at `due_at`, if it is still unpaid."""
+        self._session.execute(self._statements["delete_due"],
+                              [bucket, shard, retry_at, schedule_id])
+        run = self._session.execute(self._statements["select_run"],
+                                    [user_id, schedule_id, due_at]).one()
+        schedule = self._session.execute(self._statements["select_schedule"],
+                                         [user_id, schedule_id]).one()
+        if run is None or run.status != 'pending' or schedule is None:
+            # Paid, already reported, or the schedule is gone
+            self._bump("jobs_skipped")
+            return
+
+        applied = self._session.execute(self._statements["applied"], [user_id, run.run_id]).one()
+        if applied is not None:
+            # The last attempt paid but died before deleting its run
+            self._session.execute(self._statements["delete_run"], [user_id, schedule_id, due_at])
+            self._bump("runs_recovered")
+            return
+
+        if run.attempts >= self.max_attempts:
+            self._fail_run(user_id, schedule_id, due_at, run.error or "interrupted", 'failed')
+            return
+
+        attempt = run.attempts + 1
+        claimed = self._session.execute(self._statements["claim_attempt"], [
+            attempt, datetime.utcnow(), user_id, schedule_id, due_at, run.attempts
+        ])
+        if not claimed.was_applied:
+            self._bump("jobs_skipped")
+            return
+        self._bump("retries")
+        # The next retry also reports the run as failed once attempts are used up
+        self._enqueue_retry(schedule_id, user_id, due_at)
+        self._deposit(schedule, due_at, run.run_id, attempt)
+
+    def _deposit(self, schedule, due_at, run_id, attempt):
+        user_id, schedule_id = schedule.user_id, schedule.schedule_id
+        try:
+            self.execute_deposit(user_id, schedule.amount, schedule.fund_id, run_id)
+        except Exception as e:
+            self._fail_run(user_id, schedule_id, due_at, str(e) or e.__class__.__name__,
+                           'failed' if attempt >= self.max_attempts else 'pending')
+            raise
+        # Not waited for: a run left behind is found paid in applied_operations by its retry
+        self._session.execute_async(self._statements["delete_run"], [user_id, schedule_id, due_at])
+        self._bump("jobs_executed")
+
+    def _fail_run(self, user_id, schedule_id, due_at, error, status):
+        self._session.execute(self._statements["fail_attempt"], [
+            status, error, datetime.utcnow(), user_id, schedule_id, due_at
+        ])
+        if status == 'failed':
+            self._bump("runs_failed")
+            print(f"Scheduled deposit {schedule_id} for {user_id} due {due_at.isoformat()}Z "
+                  f"failed after {self.max_attempts} attempts: {error}")
+
+    def _maybe_finish(self, bucket, shard):
+        key = (bucket, shard)
+        with self._outstanding_lock:
+            if self._outstanding.get(key) != 0:
+                return
+            # Leave the partition open while new jobs can still land in it
+            if (bucket + 1) * BUCKET_SECONDS > time.time():
+                return
+            del self._outstanding[key]
+            if key in self._reopen:
+                # Not marked done: its lease lapses and it is read again
+                return
+        # Keep the marker past the catch-up window so nobody re-reads it
+        self._session.execute(self._statements["finish_claim"],
+                              [self.catchup * 2, bucket, shard])
+
+    # -------------------------------------------------------------------------
+    # Metrics
+    # -------------------------------------------------------------------------
+
+    def _bump(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "instance_id": self.instance_id,
+            "wheel_size": len(self.wheel),
+            "claimed_partitions": len(self._won_claims),
+        })
+        return stats
@@ -0,0 +1,102 @@
+"""
+DÍA - Single-Flight Read Coalescing
+===================================
+Concurrent identical reads share one database call.
+
+The first caller for a key (the leader) runs the read on its own thread.
+Callers that arrive while it is in flight wait for the leader's result
+instead of issuing the same query, and an exception raised by the leader
+is raised in every waiter too. Nothing is cached: once the call returns the
+key is free, and the next caller starts a fresh read.
+
+Keys are tuples whose first element names the kind of read (for example
+`("holdings", user_id)`); statistics and default timeouts are per kind.
+Waiters give up after the timeout and raise CoalescedTimeout; the leader
+itself is bounded only by the driver's request timeout.
+
+Only use this for reads whose result may be a few milliseconds old.
+Read-modify-write paths must do their own read.
+"""
+
+import threading
+import time
+
+
+class CoalescedTimeout(TimeoutError):
+    def __init__(self, key, timeout):
+        super().__init__(f"Timed out after {timeout}s waiting for in-flight read {key!r}")
+        self.key = key
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters', 'started')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.started = time.monotonic()
+
+
+class SingleFlight:
+    def __init__(self, timeout=5.0, timeouts=None):
+        """timeouts: {kind: seconds} overriding the default wait for that kind of read."""
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def do(self, key, fn, *args, timeout=None):
+        """fn(*args), shared with every concurrent caller using the same key."""
+        kind = key[0] if isinstance(key, tuple) else key
+        with self._lock:
+            stats = self._stats.setdefault(kind, {"calls": 0, "executed": 0, "coalesced": 0,
+                                                  "timeouts": 0, "errors": 0})
+            stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                stats["executed"] += 1
+            else:
+                call.waiters += 1
+                stats["coalesced"] += 1
+
+        if leader:
+            try:
+                call.result = fn(*args)
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    stats["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if timeout is None:
+            timeout = self.timeouts.get(kind, self.timeout)
+        if not call.done.wait(timeout):
+            with self._lock:
+                stats["timeouts"] += 1
+            raise CoalescedTimeout(key, timeout)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            by_kind = {kind: dict(stats) for kind, stats in self._stats.items()}
+            inflight = len(self._calls)
+            oldest = min((call.started for call in self._calls.values()), default=None)
+        for stats in by_kind.values():
+            stats["coalesced_ratio"] = round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0
+        return {
+            "inflight": inflight,
+            "oldest_inflight_ms": round((time.monotonic() - oldest) * 1000, 2) if oldest is not None else None,
+            "by_kind": by_kind,
+        }
@@ -0,0 +1,921 @@
+"""
+DÍA - Storage Backends
+======================
+One repository interface for users, auth tokens, portfolios (holdings),
+transactions, daily activity rollups and the fund catalog, with three
+backends:
+
+- cassandra: the production store (keyspace from migrations/, transaction
+  rows written behind the request by the journal)
+- sqlite:    a single file in WAL mode, for demos and single-node installs
+- memory:    process-local dicts, for development and tests
+
+The Flask app picks one with `STORAGE_BACKEND` (see `open_store`). Every
+backend returns plain dicts, and portfolio state has the same shape
+everywhere:
+
+    {"exists", "funds": {fund_id: {"units", "cost_basis"}}, "total_value", "last_24hr_change"}
+
+Scheduled deposits and the spare change jar keep their own Cassandra tables
+and are only available with the cassandra backend.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
+from cassandra.query import BatchStatement, BatchType, SimpleStatement
+
+BACKENDS = ('cassandra', 'sqlite', 'memory')
+
+# Columns of a fund in the catalog; "id" is the fund_id
+FUND_FIELDS = ('id', 'name', 'description', 'risk_level', 'sector', 'nav',
+               'annual_return_mock', 'volatility_mock', 'min_investment')
+
+
+def to_minor(amount):
+    """AZN to integer qəpik, the unit rollup amounts are kept in."""
+    return int(round(amount * 100))
+
+
+def merge_activity(rows):
+    """Sum activity rows that share (day, type, fund_id)."""
+    merged = {}
+    for row in rows:
+        key = (row["day"], row["type"], row["fund_id"])
+        if key in merged:
+            merged[key]["count"] += row["count"]
+            merged[key]["amount_minor"] += row["amount_minor"]
+        else:
+            merged[key] = dict(row)
+    return list(merged.values())
+
+
+def empty_state():
+    return {"exists": False, "funds": {}, "total_value": 0.0, "last_24hr_change": 0.0}
+
+
+class Store:
+    """Repository interface. Methods raise on storage errors; lookups return None when missing."""
+
+    name = None
+
+    # Users
+    def create_user(self, user_id, username, password_hash, risk_profile, created_at):
+        """Insert a user and an empty portfolio. Returns False if the username is taken."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_user_by_username(self, username):
+        raise NotImplementedError
+
+    def existing_usernames(self, usernames, concurrency=64):
+        """{username: user_id} for the given usernames that are already taken."""
+        raise NotImplementedError
+
+    def create_users(self, users, concurrency=64):
+        """
+        Bulk create_user for [(user_id, username, password_hash, risk_profile, created_at)].
+        Returns {user_id: error message} for the rows that failed.
+        """
+        raise NotImplementedError
+
+    def create_portfolios(self, user_ids, concurrency=64):
+        """Empty portfolios for existing users that lack one; users that have one are left alone."""
+        raise NotImplementedError
+
+    # Tokens
+    def create_token(self, token, user_id, created_at):
+        raise NotImplementedError
+
+    def get_token_user(self, token):
+        raise NotImplementedError
+
+    # Portfolios
+    def get_holdings(self, user_id):
+        raise NotImplementedError
+
+    def update_holding(self, user_id, fund_id, units, cost_basis, total_value, last_24hr_change, updated_at,
+                       operation_id=None):
+        """
+        Set one fund position and the portfolio totals together. operation_id
+        (cassandra only, like the jar) is recorded in applied_operations in
+        the same logged batch, so a retry can tell the write happened.
+        """
+        raise NotImplementedError
+
+    def apply_withdrawal(self, user_id, positions, total_value, updated_at):
+        """positions: [(fund_id, units, cost_basis)], written atomically with the new total."""
+        raise NotImplementedError
+
+    def portfolio_totals(self):
+        """[(user_id, total_value)] for every portfolio."""
+        raise NotImplementedError
+
+    # Transactions
+    def add_transaction(self, transaction_id, user_id, type, amount, fund_id, created_at, units=None):
+        """
+        Record a transaction and count it in the user's daily activity rollup.
+        units is the number of fund units bought or sold; reconciliation checks holdings against it.
+        """
+        raise NotImplementedError
+
+    def transactions_since(self, user_id, since):
+        """A user's transactions at or after `since`, newest first."""
+        raise NotImplementedError
+
+    def iter_transactions(self, user_id, page_size=500):
+        """Generator over a user's whole history, newest first, holding one page in memory."""
+        raise NotImplementedError
+
+    # Daily activity rollups
+    def daily_activity(self, user_id, since):
+        """[{"day", "type", "fund_id", "count", "amount_minor"}] for days on or after the date `since`."""
+        raise NotImplementedError
+
+    def rebuild_activity(self):
+        """Recompute every rollup from the transactions table."""
+        raise NotImplementedError
+
+    # Fund catalog
+    def catalog_version(self):
+        """Current catalog version, or None if the catalog has never been written."""
+        raise NotImplementedError
+
+    def get_funds(self):
+        """Every fund as a dict of FUND_FIELDS."""
+        raise NotImplementedError
+
+    def put_funds(self, funds, version):
+        """Upsert funds, then publish them by setting the catalog version."""
+        raise NotImplementedError
+
+    # Health
+    def ping(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# =============================================================================
+# CASSANDRA
+# =============================================================================
+
+class CassandraStore(Store):
+    name = 'cassandra'
+
+    def __init__(self, journal=None):
+        """Transaction rows go through `journal.record` when given, else inline inserts."""
+        self.journal = journal
+        self.session = None
+        self._count_activity = None
+
+    def attach(self, session):
+        self.session = session
+        self._count_activity = session.prepare(
+            """UPDATE daily_activity SET count = count + 1, amount_minor = amount_minor + ?
+               WHERE user_id = ? AND day = ? AND type = ? AND fund_id = ?""")
+
+    def create_user(self, user_id, username, password_hash, risk_profile, created_at):
+        existing = self.session.execute(
+            "SELECT user_id FROM users WHERE username = %s ALLOW FILTERING",
+            [username]
+        ).one()
+        if existing:
+            return False
+
+        self.session.execute(
+            """INSERT INTO users (user_id, username, password_hash, risk_profile, created_at)
+               VALUES (%s, %s, %s, %s, %s)""",
+            [user_id, username, password_hash, risk_profile, created_at]
+        )
+        # Empty portfolio: static columns of the holdings partition
+        self.session.execute(
+            "INSERT INTO holdings (user_id, total_value, last_24hr_change) VALUES (%s, %s, %s)",
+            [user_id, 0.0, 0.0]
+        )
+        return True
+
+    def get_user(self, user_id):
+        row = self.session.execute(
+            "SELECT user_id, username, risk_profile FROM users WHERE user_id = %s",
+            [user_id]
+        ).one()
+        return row._asdict() if row else None
+
+    def get_user_by_username(self, username):
+        row = self.session.execute(
+            "SELECT user_id, username, password_hash, risk_profile FROM users WHERE username = %s ALLOW FILTERING",
+            [username]
+        ).one()
+        return row._asdict() if row else None
+
+    def existing_usernames(self, usernames, concurrency=64):
+        # Secondary index lookups, many in flight at once
+        select = self.session.prepare("SELECT user_id, username FROM users WHERE username = ?")
+        results = execute_concurrent_with_args(self.session, select, [(name,) for name in usernames],
+                                               concurrency=concurrency)
+        existing = {}
+        for success, rows in results:
+            if not success:
+                raise rows
+            for row in rows:
+                existing[row.username] = row.user_id
+        return existing
+
+    def create_users(self, users, concurrency=64):
+        insert_user = self.session.prepare(
+            """INSERT INTO users (user_id, username, password_hash, risk_profile, created_at)
+               VALUES (?, ?, ?, ?, ?)""")
+        insert_portfolio = self.session.prepare(
+            "INSERT INTO holdings (user_id, total_value, last_24hr_change) VALUES (?, 0, 0)")
+
+        statements = []
+        for user in users:
+            statements.append((insert_user, user))
+            statements.append((insert_portfolio, (user[0],)))
+        # Bounded number of async inserts in flight; failures are collected, not raised
+        results = execute_concurrent(self.session, statements, concurrency=concurrency,
+                                     raise_on_first_error=False)
+        failed = {}
+        for (statement, params), (success, result) in zip(statements, results):
+            if not success:
+                failed[params[0]] = str(result)
+        return failed
+
+    def create_portfolios(self, user_ids, concurrency=64):
+        # Only the statics are written, so an existing portfolio keeps its totals
+        insert_portfolio = self.session.prepare(
+            "INSERT INTO holdings (user_id, total_value, last_24hr_change) VALUES (?, 0, 0) IF NOT EXISTS")
+        results = execute_concurrent_with_args(self.session, insert_portfolio,
+                                               [(user_id,) for user_id in user_ids],
+                                               concurrency=concurrency)
+        for success, result in results:
+            if not success:
+                raise result
+
+    def create_token(self, token, user_id, created_at):
+        self.session.execute(
+            "INSERT INTO auth_tokens (auth_token, user_id, created_at) VALUES (%s, %s, %s)",
+            [token, user_id, created_at]
+        )
+
+    def get_token_user(self, token):
+        row = self.session.execute(
+            "SELECT user_id FROM auth_tokens WHERE auth_token = %s",
+            [token]
+        ).one()
+        return row.user_id if row else None
+
+    def get_holdings(self, user_id):
+        # Per-fund rows plus statics from one partition
+        rows = self.session.execute(
+            "SELECT * FROM holdings WHERE user_id = %s",
+            [user_id]
+        )
+        state = empty_state()
+        for row in rows:
+            state["exists"] = True
+            state["total_value"] = row.total_value or 0.0
+            state["last_24hr_change"] = row.last_24hr_change or 0.0
+            # A partition with only static columns yields one row with no fund
+            if row.fund_id is not None and row.units:
+                state["funds"][row.fund_id] = {"units": row.units, "cost_basis": row.cost_basis or 0.0}
+        return state
+
+    def update_holding(self, user_id, fund_id, units, cost_basis, total_value, last_24hr_change, updated_at,
+                       operation_id=None):
+        if operation_id is not None:
+            # Logged batch across the two tables: the operation is recorded if and only if the units changed
+            batch = BatchStatement(batch_type=BatchType.LOGGED)
+            batch.add(
+                """UPDATE holdings SET units = %s, cost_basis = %s, updated_at = %s,
+                   total_value = %s, last_24hr_change = %s WHERE user_id = %s AND fund_id = %s""",
+                [units, cost_basis, updated_at, total_value, last_24hr_change, user_id, fund_id]
+            )
+            batch.add(
+                """INSERT INTO applied_operations (user_id, operation_id, fund_id, applied_at)
+                   VALUES (%s, %s, %s, %s)""",
+                [user_id, operation_id, fund_id, updated_at]
+            )
+            self.session.execute(batch)
+            return
+        self.session.execute(
+            """UPDATE holdings SET units = %s, cost_basis = %s, updated_at = %s,
+               total_value = %s, last_24hr_change = %s WHERE user_id = %s AND fund_id = %s""",
+            [units, cost_basis, updated_at, total_value, last_24hr_change, user_id, fund_id]
+        )
+
+    def apply_withdrawal(self, user_id, positions, total_value, updated_at):
+        # Single-partition batch: every holding and the static total change together
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+        for fund_id, units, cost_basis in positions:
+            batch.add(
+                """UPDATE holdings SET units = %s, cost_basis = %s, updated_at = %s
+                   WHERE user_id = %s AND fund_id = %s""",
+                [units, cost_basis, updated_at, user_id, fund_id]
+            )
+        batch.add(
+            "UPDATE holdings SET total_value = %s WHERE user_id = %s",
+            [total_value, user_id]
+        )
+        self.session.execute(batch)
+
+    def portfolio_totals(self):
+        # Static portfolio totals only: one row per partition
+        rows = self.session.execute(
+            "SELECT DISTINCT user_id, total_value FROM holdings"
+        )
+        return [(row.user_id, row.total_value or 0.0) for row in rows]
+
+    def add_transaction(self, transaction_id, user_id, type, amount, fund_id, created_at, units=None):
+        # Counters are not idempotent, so they are bumped here once rather than by journal retries
+        future = self.session.execute_async(
+            self._count_activity,
+            [to_minor(amount), user_id, created_at.date(), type, fund_id or '']
+        )
+        future.add_errback(lambda e: print(f"Daily activity: failed to count {transaction_id}: {e}"))
+
+        if self.journal is not None:
+            self.journal.record(transaction_id, user_id, type, amount, fund_id, created_at, units)
+            return
+        self.session.execute(
+            """INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at, units)
+               VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            [transaction_id, user_id, type, amount, fund_id, created_at, units]
+        )
+
+    def transactions_since(self, user_id, since):
+        rows = self.session.execute(
+            """SELECT transaction_id, type, amount, fund_id, created_at FROM transactions
+               WHERE user_id = %s AND created_at >= %s""",
+            [user_id, since]
+        )
+        return [row._asdict() for row in rows]
+
+    def iter_transactions(self, user_id, page_size=500):
+        # The driver fetches the next page only when iteration reaches it
+        statement = SimpleStatement(
+            """SELECT transaction_id, type, amount, fund_id, created_at FROM transactions
+               WHERE user_id = %s""",
+            fetch_size=page_size
+        )
+        for row in self.session.execute(statement, [user_id]):
+            yield row._asdict()
+
+    def daily_activity(self, user_id, since):
+        # Live counters plus backfilled history: two single-partition slices
+        rows = []
+        for table in ('daily_activity', 'daily_activity_history'):
+            for row in self.session.execute(
+                f"""SELECT day, type, fund_id, count, amount_minor FROM {table}
+                    WHERE user_id = %s AND day >= %s""",
+                [user_id, since]
+            ):
+                rows.append({"day": row.day.date(), "type": row.type, "fund_id": row.fund_id or None,
+                             "count": row.count or 0, "amount_minor": row.amount_minor or 0})
+        return merge_activity(rows)
+
+    def rebuild_activity(self):
+        raise NotImplementedError("Cassandra rollups are backfilled with `python rollups.py backfill`")
+
+    def catalog_version(self):
+        row = self.session.execute(
+            "SELECT version FROM catalog_version WHERE catalog = 'funds'"
+        ).one()
+        return row.version if row else None
+
+    def get_funds(self):
+        rows = self.session.execute(
+            f"SELECT fund_id, {', '.join(FUND_FIELDS[1:])} FROM funds"
+        )
+        return [dict(zip(FUND_FIELDS, row)) for row in rows]
+
+    def put_funds(self, funds, version):
+        now = datetime.now()
+        for fund in funds:
+            self.session.execute(
+                f"""INSERT INTO funds (fund_id, {', '.join(FUND_FIELDS[1:])}, updated_at)
+                    VALUES ({', '.join(['%s'] * (len(FUND_FIELDS) + 1))})""",
+                [fund[field] for field in FUND_FIELDS] + [now]
+            )
+        # Written last: pollers only reload once every fund row is in place
+        self.session.execute(
+            "INSERT INTO catalog_version (catalog, version, updated_at) VALUES ('funds', %s, %s)",
+            [version, now]
+        )
+
+    def ping(self):
+        self.session.execute("SELECT now() FROM system.local")
+
+
+# =============================================================================
+# SQLITE
+# =============================================================================
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        risk_profile TEXT,
+        created_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS auth_tokens (
+        auth_token TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        created_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS portfolios (
+        user_id TEXT PRIMARY KEY,
+        total_value REAL NOT NULL DEFAULT 0,
+        last_24hr_change REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS holdings (
+        user_id TEXT NOT NULL,
+        fund_id TEXT NOT NULL,
+        units REAL NOT NULL,
+        cost_basis REAL NOT NULL,
+        updated_at TEXT,
+        PRIMARY KEY (user_id, fund_id)
+    );
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        fund_id TEXT,
+        created_at TEXT NOT NULL,
+        units REAL
+    );
+    CREATE INDEX IF NOT EXISTS transactions_by_user ON transactions (user_id, created_at);
+    CREATE TABLE IF NOT EXISTS funds (
+        fund_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        risk_level TEXT,
+        sector TEXT,
+        nav REAL NOT NULL,
+        annual_return_mock REAL,
+        volatility_mock REAL,
+        min_investment REAL,
+        updated_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        catalog TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        updated_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS daily_activity (
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        type TEXT NOT NULL,
+        fund_id TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        amount_minor INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, type, fund_id)
+    );
+"""
+
+
+class SQLiteStore(Store):
+    """
+    One connection per thread on a WAL-mode database file, so readers never
+    block the writer. Multi-statement writes run in IMMEDIATE transactions.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path='dia.sqlite3', busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+            # Files created before transactions recorded units
+            if 'units' not in {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}:
+                conn.execute("ALTER TABLE transactions ADD COLUMN units REAL")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, statements):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in statements:
+                conn.execute(sql, params)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def create_user(self, user_id, username, password_hash, risk_profile, created_at):
+        try:
+            self._write([
+                ("""INSERT INTO users (user_id, username, password_hash, risk_profile, created_at)
+                    VALUES (?, ?, ?, ?, ?)""",
+                 (user_id, username, password_hash, risk_profile, created_at.isoformat())),
+                ("INSERT INTO portfolios (user_id, total_value, last_24hr_change) VALUES (?, 0, 0)",
+                 (user_id,)),
+            ])
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def get_user(self, user_id):
+        row = self._connection().execute(
+            "SELECT user_id, username, risk_profile FROM users WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_user_by_username(self, username):
+        row = self._connection().execute(
+            "SELECT user_id, username, password_hash, risk_profile FROM users WHERE username = ?",
+            (username,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def existing_usernames(self, usernames, concurrency=64):
+        usernames = list(usernames)
+        existing = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(usernames), 500):
+            chunk = usernames[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT user_id, username FROM users WHERE username IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            existing.update((row['username'], row['user_id']) for row in rows)
+        return existing
+
+    def create_users(self, users, concurrency=64):
+        conn = self._connection()
+        failed = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, username, password_hash, risk_profile, created_at in users:
+                try:
+                    conn.execute(
+                        """INSERT INTO users (user_id, username, password_hash, risk_profile, created_at)
+                           VALUES (?, ?, ?, ?, ?)""",
+                        (user_id, username, password_hash, risk_profile, created_at.isoformat())
+                    )
+                except sqlite3.IntegrityError as e:
+                    failed[user_id] = str(e)
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO portfolios (user_id, total_value, last_24hr_change) VALUES (?, 0, 0)",
+                    (user_id,)
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return failed
+
+    def create_portfolios(self, user_ids, concurrency=64):
+        self._write([
+            ("INSERT OR IGNORE INTO portfolios (user_id, total_value, last_24hr_change) VALUES (?, 0, 0)",
+             (user_id,))
+            for user_id in user_ids
+        ])
+
+    def create_token(self, token, user_id, created_at):
+        self._connection().execute(
+            "INSERT INTO auth_tokens (auth_token, user_id, created_at) VALUES (?, ?, ?)",
+            (token, user_id, created_at.isoformat())
+        )
+
+    def get_token_user(self, token):
+        row = self._connection().execute(
+            "SELECT user_id FROM auth_tokens WHERE auth_token = ?",
+            (token,)
+        ).fetchone()
+        return row['user_id'] if row else None
+
+    def get_holdings(self, user_id):
+        conn = self._connection()
+        state = empty_state()
+        portfolio = conn.execute(
+            "SELECT total_value, last_24hr_change FROM portfolios WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if portfolio is None:
+            return state
+        state["exists"] = True
+        state["total_value"] = portfolio['total_value']
+        state["last_24hr_change"] = portfolio['last_24hr_change']
+        for row in conn.execute(
+                "SELECT fund_id, units, cost_basis FROM holdings WHERE user_id = ? AND units > 0",
+                (user_id,)):
+            state["funds"][row['fund_id']] = {"units": row['units'], "cost_basis": row['cost_basis']}
+        return state
+
+    def update_holding(self, user_id, fund_id, units, cost_basis, total_value, last_24hr_change, updated_at,
+                       operation_id=None):
+        self._write([
+            ("""INSERT INTO holdings (user_id, fund_id, units, cost_basis, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, fund_id) DO UPDATE SET
+                units = excluded.units, cost_basis = excluded.cost_basis, updated_at = excluded.updated_at""",
+             (user_id, fund_id, units, cost_basis, updated_at.isoformat())),
+            ("""INSERT INTO portfolios (user_id, total_value, last_24hr_change) VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                total_value = excluded.total_value, last_24hr_change = excluded.last_24hr_change""",
+             (user_id, total_value, last_24hr_change)),
+        ])
+
+    def apply_withdrawal(self, user_id, positions, total_value, updated_at):
+        statements = [
+            ("UPDATE holdings SET units = ?, cost_basis = ?, updated_at = ? WHERE user_id = ? AND fund_id = ?",
+             (units, cost_basis, updated_at.isoformat(), user_id, fund_id))
+            for fund_id, units, cost_basis in positions
+        ]
+        statements.append(("UPDATE portfolios SET total_value = ? WHERE user_id = ?", (total_value, user_id)))
+        self._write(statements)
+
+    def portfolio_totals(self):
+        rows = self._connection().execute("SELECT user_id, total_value FROM portfolios")
+        return [(row['user_id'], row['total_value']) for row in rows]
+
+    def add_transaction(self, transaction_id, user_id, type, amount, fund_id, created_at, units=None):
+        self._write([
+            ("""INSERT INTO transactions (transaction_id, user_id, type, amount, fund_id, created_at, units)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+             (transaction_id, user_id, type, amount, fund_id, created_at.isoformat(), units)),
+            ("""INSERT INTO daily_activity (user_id, day, type, fund_id, count, amount_minor)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (user_id, day, type, fund_id)
+                DO UPDATE SET count = count + 1, amount_minor = amount_minor + excluded.amount_minor""",
+             (user_id, created_at.date().isoformat(), type, fund_id or '', to_minor(amount))),
+        ])
+
+    def transactions_since(self, user_id, since):
+        rows = self._connection().execute(
+            """SELECT transaction_id, type, amount, fund_id, created_at FROM transactions
+               WHERE user_id = ? AND created_at >= ? ORDER BY created_at DESC""",
+            (user_id, since.isoformat())
+        )
+        return [dict(row, created_at=datetime.fromisoformat(row['created_at'])) for row in rows]
+
+    def iter_transactions(self, user_id, page_size=500):
+        # A dedicated connection: the generator may outlive the request thread's next query
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(
+                """SELECT transaction_id, type, amount, fund_id, created_at FROM transactions
+                   WHERE user_id = ? ORDER BY created_at DESC""",
+                (user_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row, created_at=datetime.fromisoformat(row['created_at']))
+        finally:
+            conn.close()
+
+    def daily_activity(self, user_id, since):
+        rows = self._connection().execute(
+            """SELECT day, type, fund_id, count, amount_minor FROM daily_activity
+               WHERE user_id = ? AND day >= ?""",
+            (user_id, since.isoformat())
+        )
+        return [dict(row, day=date.fromisoformat(row['day']), fund_id=row['fund_id'] or None) for row in rows]
+
+    def rebuild_activity(self):
+        # Amounts are rounded to qəpik per row, as the write path does
+        self._write([
+            ("DELETE FROM daily_activity", ()),
+            ("""INSERT INTO daily_activity (user_id, day, type, fund_id, count, amount_minor)
+                SELECT user_id, substr(created_at, 1, 10), type, COALESCE(fund_id, ''),
+                       COUNT(*), SUM(CAST(ROUND(amount * 100) AS INTEGER))
+                FROM transactions GROUP BY 1, 2, 3, 4""", ()),
+        ])
+
+    def catalog_version(self):
+        row = self._connection().execute(
+            "SELECT version FROM catalog_version WHERE catalog = 'funds'"
+        ).fetchone()
+        return row['version'] if row else None
+
+    def get_funds(self):
+        rows = self._connection().execute(
+            f"SELECT fund_id, {', '.join(FUND_FIELDS[1:])} FROM funds"
+        )
+        return [dict(zip(FUND_FIELDS, row)) for row in rows]
+
+    def put_funds(self, funds, version):
+        now = datetime.now().isoformat()
+        statements = [
+            (f"""INSERT OR REPLACE INTO funds (fund_id, {', '.join(FUND_FIELDS[1:])}, updated_at)
+                 VALUES ({', '.join('?' * (len(FUND_FIELDS) + 1))})""",
+             [fund[field] for field in FUND_FIELDS] + [now])
+            for fund in funds
+        ]
+        statements.append((
+            "INSERT OR REPLACE INTO catalog_version (catalog, version, updated_at) VALUES ('funds', ?, ?)",
+            (version, now)
+        ))
+        self._write(statements)
+
+    def ping(self):
+        self._connection().execute("SELECT 1")
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# =============================================================================
+# MEMORY
+# =============================================================================
+
+class MemoryStore(Store):
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self._usernames = {}
+        self._tokens = {}
+        self._portfolios = {}
+        self._transactions = {}
+        self._funds = {}
+        self._catalog_version = None
+        self._activity = {}
+
+    def create_user(self, user_id, username, password_hash, risk_profile, created_at):
+        with self._lock:
+            if username in self._usernames:
+                return False
+            self._users[user_id] = {
+                "user_id": user_id,
+                "username": username,
+                "password_hash": password_hash,
+                "risk_profile": risk_profile,
+                "created_at": created_at
+            }
+            self._usernames[username] = user_id
+            self._portfolios[user_id] = {"funds": {}, "total_value": 0.0, "last_24hr_change": 0.0}
+        return True
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return {key: user[key] for key in ("user_id", "username", "risk_profile")} if user else None
+
+    def get_user_by_username(self, username):
+        with self._lock:
+            user = self._users.get(self._usernames.get(username))
+            return dict(user) if user else None
+
+    def existing_usernames(self, usernames, concurrency=64):
+        with self._lock:
+            return {name: self._usernames[name] for name in usernames if name in self._usernames}
+
+    def create_users(self, users, concurrency=64):
+        failed = {}
+        for user in users:
+            if not self.create_user(*user):
+                failed[user[0]] = "username already exists"
+        return failed
+
+    def create_portfolios(self, user_ids, concurrency=64):
+        with self._lock:
+            for user_id in user_ids:
+                self._portfolios.setdefault(user_id, {"funds": {}, "total_value": 0.0, "last_24hr_change": 0.0})
+
+    def create_token(self, token, user_id, created_at):
+        with self._lock:
+            self._tokens[token] = user_id
+
+    def get_token_user(self, token):
+        with self._lock:
+            return self._tokens.get(token)
+
+    def get_holdings(self, user_id):
+        with self._lock:
+            portfolio = self._portfolios.get(user_id)
+            if portfolio is None:
+                return empty_state()
+            return {
+                "exists": True,
+                "funds": {fund_id: dict(holding) for fund_id, holding in portfolio["funds"].items()
+                          if holding["units"]},
+                "total_value": portfolio["total_value"],
+                "last_24hr_change": portfolio["last_24hr_change"]
+            }
+
+    def update_holding(self, user_id, fund_id, units, cost_basis, total_value, last_24hr_change, updated_at,
+                       operation_id=None):
+        with self._lock:
+            portfolio = self._portfolios.setdefault(
+                user_id, {"funds": {}, "total_value": 0.0, "last_24hr_change": 0.0})
+            portfolio["funds"][fund_id] = {"units": units, "cost_basis": cost_basis}
+            portfolio["total_value"] = total_value
+            portfolio["last_24hr_change"] = last_24hr_change
+
+    def apply_withdrawal(self, user_id, positions, total_value, updated_at):
+        with self._lock:
+            portfolio = self._portfolios[user_id]
+            for fund_id, units, cost_basis in positions:
+                portfolio["funds"][fund_id] = {"units": units, "cost_basis": cost_basis}
+            portfolio["total_value"] = total_value
+
+    def portfolio_totals(self):
+        with self._lock:
+            return [(user_id, portfolio["total_value"]) for user_id, portfolio in self._portfolios.items()]
+
+    def add_transaction(self, transaction_id, user_id, type, amount, fund_id, created_at, units=None):
+        with self._lock:
+            self._transactions.setdefault(user_id, []).append({
+                "transaction_id": transaction_id,
+                "type": type,
+                "amount": amount,
+                "fund_id": fund_id,
+                "created_at": created_at,
+                "units": units
+            })
+            self._count_activity(user_id, type, amount, fund_id, created_at)
+
+    def _count_activity(self, user_id, type, amount, fund_id, created_at):
+        counts = self._activity.setdefault(user_id, {}).setdefault(
+            (created_at.date(), type, fund_id), [0, 0])
+        counts[0] += 1
+        counts[1] += to_minor(amount)
+
+    def transactions_since(self, user_id, since):
+        with self._lock:
+            rows = [dict(row) for row in self._transactions.get(user_id, []) if row["created_at"] >= since]
+        return sorted(rows, key=lambda row: row["created_at"], reverse=True)
+
+    def iter_transactions(self, user_id, page_size=500):
+        with self._lock:
+            rows = list(self._transactions.get(user_id, []))
+        for row in sorted(rows, key=lambda row: row["created_at"], reverse=True):
+            yield dict(row)
+
+    def daily_activity(self, user_id, since):
+        with self._lock:
+            return [
+                {"day": day, "type": type, "fund_id": fund_id, "count": count, "amount_minor": amount_minor}
+                for (day, type, fund_id), (count, amount_minor) in self._activity.get(user_id, {}).items()
+                if day >= since
+            ]
+
+    def rebuild_activity(self):
+        with self._lock:
+            self._activity = {}
+            for user_id, rows in self._transactions.items():
+                for row in rows:
+                    self._count_activity(user_id, row["type"], row["amount"], row["fund_id"], row["created_at"])
+
+    def catalog_version(self):
+        with self._lock:
+            return self._catalog_version
+
+    def get_funds(self):
+        with self._lock:
+            return [dict(fund) for fund in self._funds.values()]
+
+    def put_funds(self, funds, version):
+        with self._lock:
+            for fund in funds:
+                self._funds[fund['id']] = {field: fund[field] for field in FUND_FIELDS}
+            self._catalog_version = version
+
+    def ping(self):
+        pass
+
+
+def open_store(backend=None, journal=None, environ=None):
+    """Build the store selected by STORAGE_BACKEND (cassandra, sqlite or memory)."""
+    environ = os.environ if environ is None else environ
+    backend = backend or environ.get('STORAGE_BACKEND', 'cassandra')
+    if backend == 'cassandra':
+        return CassandraStore(journal=journal)
+    if backend == 'sqlite':
+        return SQLiteStore(environ.get('SQLITE_PATH', 'dia.sqlite3'))
+    if backend == 'memory':
+        return MemoryStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
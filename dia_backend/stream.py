@@ -0,0 +1,497 @@
+"""
+DÍA - Server-Sent Events Stream
+===============================
+Pushes portfolio deltas and leaderboard changes to connected clients, so
+they no longer have to poll `/api/user/<id>/portfolio` and `/api/leaderboard`.
+
+The stream is served by a dedicated asyncio worker on its own port
+(`STREAM_PORT`), next to the Flask app. An idle connection costs one
+coroutine and a socket, not a thread, so one instance can hold tens of
+thousands of them.
+
+- Publishing is thread-safe: Flask handlers, the scheduler and the jar
+  sweeper call `EventHub.publish`. The payload is serialized once by the
+  caller; the loop assigns the event ID and writes the same bytes to every
+  subscriber of the topic.
+- Topics: `user:<user_id>` (portfolio deltas) and `leaderboard`.
+- Recent events stay in a ring buffer. A client reconnecting with
+  `Last-Event-ID` gets what it missed; if that is no longer in the buffer
+  (or the server restarted) it gets a `reset` event and should refetch.
+- One timer writes a heartbeat comment to every connection. Clients that
+  stop reading are disconnected once their send buffer fills up; they
+  reconnect and resume.
+
+Event IDs are `<boot>-<sequence>` and only valid against the process that
+issued them.
+
+Each process has its own hub. With several worker processes, portfolio
+deltas are relayed to the other workers over UDP (`EventRelay`), so a
+client gets its events whichever worker made the write or serves its
+connection. Each worker keeps its own leaderboard watch, fed by the
+relayed deltas too.
+"""
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+LEADERBOARD_TOPIC = 'leaderboard'
+
+
+def user_topic(user_id):
+    return f"user:{user_id}"
+
+
+class EventHub:
+    def __init__(self, history=5000, heartbeat=15.0, max_buffer=65536, retry_ms=3000):
+        self.history = history
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self.retry_ms = retry_ms
+        self.boot = format(int(time.time()), 'x')
+
+        self._loop = None
+        self._sequence = 0
+        self._events = deque(maxlen=history)
+        self._subscribers = {}
+
+        self._stats = {
+            "connections": 0,
+            "peak_connections": 0,
+            "published": 0,
+            "delivered": 0,
+            "replayed": 0,
+            "resets": 0,
+            "dropped_slow": 0,
+        }
+
+    # -------------------------------------------------------------------------
+    # Publishing (any thread)
+    # -------------------------------------------------------------------------
+
+    def publish(self, topic, event, data):
+        """Queue an event for every subscriber of `topic`. No-op when the stream is not running."""
+        loop = self._loop
+        if loop is None:
+            return
+        body = json.dumps(data, separators=(',', ':'), default=str)
+        try:
+            loop.call_soon_threadsafe(self._dispatch, topic, event, body)
+        except RuntimeError:
+            # Loop closed during shutdown
+            pass
+
+    # -------------------------------------------------------------------------
+    # Event loop side
+    # -------------------------------------------------------------------------
+
+    def bind(self, loop):
+        self._loop = loop
+        loop.call_later(self.heartbeat, self._heartbeat)
+
+    def unbind(self):
+        self._loop = None
+
+    def _dispatch(self, topic, event, body):
+        self._sequence += 1
+        frame = (f"id: {self.boot}-{self._sequence}\nevent: {event}\n"
+                 f"data: {body}\n\n").encode('utf-8')
+        self._events.append((self._sequence, topic, frame))
+        self._stats["published"] += 1
+
+        for connection in list(self._subscribers.get(topic, ())):
+            self._send(connection, frame)
+
+    def _send(self, connection, frame):
+        transport = connection.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.max_buffer:
+            self._stats["dropped_slow"] += 1
+            transport.abort()
+            return
+        transport.write(frame)
+        self._stats["delivered"] += 1
+
+    def _heartbeat(self):
+        if self._loop is None:
+            return
+        frame = b": ping\n\n"
+        for connection in {c for members in self._subscribers.values() for c in members}:
+            self._send(connection, frame)
+        self._loop.call_later(self.heartbeat, self._heartbeat)
+
+    def subscribe(self, connection, last_event_id=None):
+        """
+        Register a connection and replay what it missed. Runs on the loop with
+        no await in between, so no event is delivered twice or skipped.
+        """
+        for topic in connection.topics:
+            self._subscribers.setdefault(topic, set()).add(connection)
+        self._stats["connections"] += 1
+        self._stats["peak_connections"] = max(self._stats["peak_connections"],
+                                              self._stats["connections"])
+
+        connection.transport.write(f"retry: {self.retry_ms}\n\n".encode('utf-8'))
+        if last_event_id:
+            self._replay(connection, last_event_id)
+
+    def unsubscribe(self, connection):
+        for topic in connection.topics:
+            members = self._subscribers.get(topic)
+            if members is not None:
+                members.discard(connection)
+                if not members:
+                    del self._subscribers[topic]
+        self._stats["connections"] -= 1
+
+    def _replay(self, connection, last_event_id):
+        boot, _, sequence = last_event_id.partition('-')
+        try:
+            sequence = int(sequence)
+        except ValueError:
+            sequence = -1
+
+        oldest = self._events[0][0] if self._events else self._sequence + 1
+        if boot != self.boot or sequence < oldest - 1 or sequence > self._sequence:
+            self._stats["resets"] += 1
+            connection.transport.write(b"event: reset\ndata: {}\n\n")
+            return
+
+        for event_sequence, topic, frame in self._events:
+            if event_sequence > sequence and topic in connection.topics:
+                connection.transport.write(frame)
+                self._stats["replayed"] += 1
+
+    def subscriber_count(self, topic):
+        return len(self._subscribers.get(topic, ()))
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            "running": self._loop is not None,
+            "buffered_events": len(self._events),
+            "last_event_id": f"{self.boot}-{self._sequence}",
+        })
+        return stats
+
+
+class _Connection:
+    __slots__ = ('transport', 'user_id', 'topics')
+
+    def __init__(self, transport, user_id, topics):
+        self.transport = transport
+        self.user_id = user_id
+        self.topics = topics
+
+
+class StreamServer:
+    """Minimal HTTP/1.1 server for `GET /api/stream` on a dedicated event loop thread."""
+
+    def __init__(self, hub, authenticate, host='0.0.0.0', port=5002, path='/api/stream',
+                 max_connections=20000, header_timeout=10.0, auth_workers=8, reuse_port=False):
+        """
+        authenticate(token) returns the user_id for a valid auth token, or
+        None. It is blocking and runs on a small thread pool.
+        reuse_port lets the workers on one host share the port; only use it
+        with a relay, so that every worker sees every event.
+        """
+        self.hub = hub
+        self.authenticate = authenticate
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_connections = max_connections
+        self.header_timeout = header_timeout
+        self.auth_workers = auth_workers
+        self.reuse_port = reuse_port
+
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sse-stream', daemon=True)
+        self._thread.start()
+        self._ready.wait(5.0)
+
+    def shutdown(self, timeout=5.0):
+        if self._loop is None:
+            return
+        self.hub.unbind()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.auth_workers,
+                                                     thread_name_prefix='sse-auth'))
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=1024,
+                                     reuse_port=self.reuse_port or None))
+        except OSError as e:
+            print(f"Event stream could not listen on {self.host}:{self.port}: {e}")
+            self._ready.set()
+            loop.close()
+            return
+        self._loop = loop
+        self.hub.bind(loop)
+        self._ready.set()
+        print(f"Event stream listening on {self.host}:{self.port}{self.path}")
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop = None
+            loop.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, target, headers = await asyncio.wait_for(self._read_request(reader),
+                                                             self.header_timeout)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            writer.close()
+            return
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if method == 'OPTIONS':
+            self._respond(writer, 204, None, extra=(
+                "Access-Control-Allow-Methods: GET, OPTIONS\r\n"
+                "Access-Control-Allow-Headers: Authorization, Last-Event-ID\r\n"))
+            return
+        if method != 'GET' or url.path != self.path:
+            self._respond(writer, 404, {"success": False, "error": "Endpoint not found"})
+            return
+        if self.hub.stats()["connections"] >= self.max_connections:
+            self._respond(writer, 503, {"success": False, "error": "Too many stream connections",
+                                        "code": "OVERLOADED"}, extra="Retry-After: 5\r\n")
+            return
+
+        # EventSource cannot set headers, so the token may also come in the query string
+        token = headers.get('authorization', '').replace('Bearer ', '') or query.get('token', [''])[0]
+        if not token:
+            self._respond(writer, 401, {"success": False, "error": "Authentication token is missing",
+                                        "code": "AUTH_TOKEN_MISSING"})
+            return
+        try:
+            user_id = await asyncio.get_running_loop().run_in_executor(None, self.authenticate, token)
+        except Exception as e:
+            print(f"Stream authentication failed: {e}")
+            self._respond(writer, 503, {"success": False, "error": "Authentication unavailable",
+                                        "code": "OVERLOADED"}, extra="Retry-After: 5\r\n")
+            return
+        if not user_id:
+            self._respond(writer, 401, {"success": False, "error": "Invalid or expired token",
+                                        "code": "AUTH_TOKEN_INVALID"})
+            return
+
+        requested = set(','.join(query.get('topics', ['portfolio,leaderboard'])).split(','))
+        topics = set()
+        if 'portfolio' in requested:
+            topics.add(user_topic(user_id))
+        if 'leaderboard' in requested:
+            topics.add(LEADERBOARD_TOPIC)
+        last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n"
+                     b"X-Accel-Buffering: no\r\n"
+                     b"Access-Control-Allow-Origin: *\r\n\r\n")
+
+        connection = _Connection(writer.transport, user_id, topics)
+        self.hub.subscribe(connection, last_event_id)
+        try:
+            # Clients send nothing after the request; EOF means they went away
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            self.hub.unsubscribe(connection)
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        method, target, _ = request_line.split(' ', 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+            if len(headers) > 100:
+                raise ValueError("Too many headers")
+        return method, target, headers
+
+    def _respond(self, writer, status, body, extra=''):
+        reasons = {204: 'No Content', 401: 'Unauthorized', 404: 'Not Found', 503: 'Service Unavailable'}
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        writer.write((f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                      f"Content-Type: application/json\r\n"
+                      f"Content-Length: {len(payload)}\r\n"
+                      f"Access-Control-Allow-Origin: *\r\n"
+                      f"{extra}"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + payload)
+        writer.close()
+
+
+class LeaderboardWatch:
+    """
+    Keeps the top portfolio totals in memory so a write can tell, without a
+    query, whether it changed the top of the leaderboard.
+
+    Besides the `size` ranked entries it tracks `slack` runners-up, so a
+    leader dropping out can usually be replaced from memory. A periodic
+    resync from the database picks up writes made by other instances.
+    """
+
+    def __init__(self, load, on_change, size=10, slack=40, resync_interval=60.0):
+        """
+        load(limit) returns the top [(user_id, total_value)] from storage.
+        on_change(top) is called with the new ranking when it changes.
+        """
+        self.load = load
+        self.on_change = on_change
+        self.size = size
+        self.capacity = size + slack
+        self.resync_interval = resync_interval
+
+        self._values = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self.resync()
+        self._thread = threading.Thread(target=self._run, name='leaderboard-watch', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.resync_interval):
+            try:
+                self.resync()
+            except Exception as e:
+                print(f"Leaderboard resync failed: {e}")
+
+    def resync(self):
+        pairs = self.load(self.capacity)
+        with self._lock:
+            before = self._ranking()
+            self._values = dict(pairs)
+            after = self._ranking()
+        if after != before:
+            self.on_change(self.top())
+
+    def observe(self, user_id, total_value):
+        """Record a committed portfolio total; notifies when the ranking shifts."""
+        with self._lock:
+            if (user_id not in self._values and len(self._values) >= self.capacity
+                    and total_value <= min(self._values.values())):
+                return False
+            before = self._ranking()
+            self._values[user_id] = total_value
+            if len(self._values) > self.capacity:
+                del self._values[min(self._values, key=self._values.get)]
+            after = self._ranking()
+        if after != before:
+            self.on_change(self.top())
+            return True
+        return False
+
+    def top(self):
+        with self._lock:
+            return [(user_id, value) for user_id, value in self._sorted()[:self.size]]
+
+    def _sorted(self):
+        return sorted(self._values.items(), key=lambda item: item[1], reverse=True)
+
+    def _ranking(self):
+        return tuple((user_id, round(value, 2)) for user_id, value in self._sorted()[:self.size])
+
+
+def _address(value):
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+class EventRelay:
+    """Fire-and-forget UDP fan-out of events to the other worker processes."""
+
+    # Largest payload that fits in one datagram
+    MAX_DATAGRAM = 65000
+
+    def __init__(self, listen, peers, on_event):
+        """
+        listen: "host:port" to receive relayed events on.
+        peers:  ["host:port", ...] to send events to.
+        on_event(event, data) runs on the receiver thread for every relayed event.
+        """
+        self.listen = _address(listen)
+        self.peers = [_address(peer) for peer in peers if peer and peer != listen]
+        self.on_event = on_event
+        self._send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread = None
+        self._stats = {"sent": 0, "received": 0, "oversized": 0, "send_errors": 0, "handler_errors": 0}
+
+    def start(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        receiver.bind(self.listen)
+        self._thread = threading.Thread(target=self._receive, args=(receiver,),
+                                        name='stream-relay', daemon=True)
+        self._thread.start()
+
+    def send(self, event, data):
+        message = json.dumps({"event": event, "data": data}, separators=(',', ':'), default=str).encode('utf-8')
+        if len(message) > self.MAX_DATAGRAM:
+            self._stats["oversized"] += 1
+            return
+        for peer in self.peers:
+            try:
+                self._send_socket.sendto(message, peer)
+                self._stats["sent"] += 1
+            except OSError:
+                # Clients of that worker miss the delta and catch up on their next refetch
+                self._stats["send_errors"] += 1
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                message, _ = receiver.recvfrom(self.MAX_DATAGRAM + 1)
+            except OSError:
+                return
+            self._stats["received"] += 1
+            try:
+                relayed = json.loads(message)
+                self.on_event(relayed["event"], relayed["data"])
+            except Exception as e:
+                self._stats["handler_errors"] += 1
+                print(f"Event relay: dropped a relayed event: {e}")
+
+    def stats(self):
+        return dict(self._stats, peers=len(self.peers))
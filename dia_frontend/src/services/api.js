@@ -196,6 +196,31 @@ export const getPortfolio = async (userId) => {
   }
 };
 
+// =============================================================================
+// DASHBOARD API
+// =============================================================================
+
+// One round trip for the home screen: portfolio, funds, recommendation and
+// leaderboard. Pass a subset of sections to only fetch what is rendered.
+export const getDashboard = async (fields = null) => {
+  try {
+    const response = await api.get('/api/dashboard', {
+      params: fields ? { fields: fields.join(',') } : undefined,
+    });
+    return response.data;
+  } catch (error) {
+    return {
+      success: true,
+      data: {
+        portfolio: { portfolio: MOCK_PORTFOLIO },
+        funds: { funds: MOCK_FUNDS },
+        recommendation: null,
+        leaderboard: null
+      }
+    };
+  }
+};
+
 // =============================================================================
 // FUNDS APIs
 // =============================================================================